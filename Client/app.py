@@ -1,6 +1,7 @@
 import streamlit as st
 import requests
 from requests.auth import HTTPBasicAuth
+from chat_client import iter_sse_events
 
 BASE_URL = "http://127.0.0.1:8000"
 
@@ -17,6 +18,13 @@ if 'auth' not in st.session_state:
 if 'logged_in' not in st.session_state:
     st.session_state['logged_in'] = False
 
+if 'chat_token' not in st.session_state:
+    st.session_state['chat_token'] = None
+if 'chat_session_id' not in st.session_state:
+    st.session_state['chat_session_id'] = None
+if 'chat_messages' not in st.session_state:
+    st.session_state['chat_messages'] = []
+
 st.title("RAG Chatbot Portal")
 
 # Role selection and login
@@ -65,6 +73,9 @@ if st.sidebar.button("Logout"):
     st.session_state['username'] = ''
     st.session_state['password'] = ''
     st.session_state['auth'] = None
+    st.session_state['chat_token'] = None
+    st.session_state['chat_session_id'] = None
+    st.session_state['chat_messages'] = []
     st.experimental_rerun()
 
 if role == 'admin':
@@ -394,6 +405,7 @@ if role == 'admin':
         st.info("Feature UI coming soon...")
 else:
     menu = st.sidebar.radio("Select section", [
+        "Chat",
         "Upload PDFs",
         "Upload All PDFs from Folder",
         "List My PDFs",
@@ -407,7 +419,62 @@ else:
     ])
     st.header(f"User: {menu}")
 
-    if menu == "Upload PDFs":
+    if menu == "Chat":
+        st.subheader("Chat with My Documents")
+        # The chat API uses JWT bearer auth; log in with the portal credentials
+        if not st.session_state['chat_token']:
+            try:
+                res = requests.post(f"{BASE_URL}/auth/login", json={"email": username, "password": st.session_state['password']})
+                if res.status_code == 200:
+                    st.session_state['chat_token'] = res.json()["access_token"]
+                else:
+                    st.error(f"Chat login failed: {res.text}")
+            except Exception as e:
+                st.error(f"Error: {e}")
+        if st.button("New Chat"):
+            st.session_state['chat_session_id'] = None
+            st.session_state['chat_messages'] = []
+        for m in st.session_state['chat_messages']:
+            with st.chat_message(m["role"]):
+                st.markdown(m["content"])
+        prompt = st.chat_input("Ask a question about your documents")
+        if prompt and st.session_state['chat_token']:
+            st.session_state['chat_messages'].append({"role": "user", "content": prompt})
+            with st.chat_message("user"):
+                st.markdown(prompt)
+            headers = {"Authorization": f"Bearer {st.session_state['chat_token']}"}
+            payload = {"message": prompt, "session_id": st.session_state['chat_session_id']}
+            sources = []
+
+            def stream_tokens():
+                # Render tokens as they arrive instead of waiting for the full answer
+                with requests.post(f"{BASE_URL}/chat/stream", json=payload, headers=headers, stream=True) as res:
+                    if res.status_code != 200:
+                        yield f"Chat failed: {res.text}"
+                        return
+                    for event, data in iter_sse_events(res):
+                        if event == "sources":
+                            sources.extend(data["sources"])
+                        elif event == "token":
+                            yield data["content"]
+                        elif event == "done":
+                            # A new session exists only once the answer is saved
+                            st.session_state['chat_session_id'] = data["session_id"]
+                        elif event == "error":
+                            yield f"\n\nError: {data.get('detail', 'Unknown error')}"
+
+            with st.chat_message("assistant"):
+                try:
+                    answer = st.write_stream(stream_tokens())
+                except Exception as e:
+                    answer = f"Error: {e}"
+                    st.error(answer)
+                if sources:
+                    with st.expander("Sources"):
+                        for src in sources:
+                            st.markdown(f"**{src['filename']}** ({src['similarity']}): {src['content']}")
+            st.session_state['chat_messages'].append({"role": "assistant", "content": answer})
+    elif menu == "Upload PDFs":
         st.subheader("Upload PDF(s)")
         uploaded_files = st.file_uploader("Select PDF files", type=["pdf"], accept_multiple_files=True)
         is_public = st.radio("Is public?", ["No", "Yes"])
@@ -1,6 +1,6 @@
 import requests
 import getpass
-from requests.auth import HTTPBasicAuth
+import json
 
 BASE_URL = "http://127.0.0.1:8000"
 # BASE_URL = "http://40.82.161.202:8000"
@@ -8,66 +8,109 @@ BASE_URL = "http://127.0.0.1:8000"
 def authenticate():
     print("=== Chat Client Login ===")
     while True:
-        user_id = input("User ID: ").strip()
+        email = input("Email: ").strip()
         password = getpass.getpass("Password: ")
         try:
-            res = requests.get(f"{BASE_URL}/user/auth/check", auth=HTTPBasicAuth(user_id, password))
-            if res.status_code == 200 and res.json().get("success"):
+            res = requests.post(f"{BASE_URL}/auth/login", json={"email": email, "password": password})
+            if res.status_code == 200:
                 print("✅ Authentication successful!\n")
-                return user_id, password
+                return {"Authorization": f"Bearer {res.json()['access_token']}"}
             else:
-                print("❌ Incorrect username or password. Please try again.\n")
+                print("❌ Incorrect email or password. Please try again.\n")
         except Exception as e:
             print(f"❌ Error connecting to server: {e}\n")
 
-def print_history(auth):
-    history_api = f"{BASE_URL}/user/chat/history"
+def iter_sse_events(res):
+    """Yield (event, data) pairs from a streaming Server-Sent Events response."""
+    event, data = None, []
+    for line in res.iter_lines(decode_unicode=True):
+        if line.startswith("event:"):
+            event = line[len("event:"):].strip()
+        elif line.startswith("data:"):
+            data.append(line[len("data:"):].strip())
+        elif not line and event:
+            yield event, json.loads("\n".join(data)) if data else {}
+            event, data = None, []
+
+def sync_history(headers, session_id, history):
+    """
+    Bring the local copy of a session's history up to date.
+    Only messages newer than the last one we have are downloaded, and an
+    unchanged session answers 304 to If-None-Match.
+    """
+    history_api = f"{BASE_URL}/chat/sessions/{session_id}/messages"
+    params = {"after": history["messages"][-1]["id"]} if history["messages"] else {}
+    req_headers = dict(headers)
+    if history["etag"] and history["etag_params"] == params:
+        req_headers["If-None-Match"] = history["etag"]
+    while True:
+        res = requests.get(history_api, headers=req_headers, params=params)
+        if res.status_code == 304:
+            return True
+        if res.status_code != 200:
+            return False
+        history["messages"].extend(res.json())
+        if "X-Next-Cursor" not in res.headers:
+            history["etag"], history["etag_params"] = res.headers.get("ETag"), params
+            return True
+        params = {"cursor": res.headers["X-Next-Cursor"]}
+        req_headers.pop("If-None-Match", None)
+
+def print_history(headers, session_id, history):
     try:
-        res = requests.get(history_api, auth=auth)
+        synced = sync_history(headers, session_id, history)
         print("*" * 10)
-        if res.status_code == 200:
-            history = res.json().get("history", [])
-            print("\n--- User Message History ---")
-            for i, msg in enumerate(history, 1):
-                print(f"{i}: {msg}")
-            print("----------------------------\n")
+        if synced:
+            print("\n--- Session Message History ---")
+            for i, msg in enumerate(history["messages"], 1):
+                print(f"{i}: [{msg['role']}] {msg['content']}")
+            print("-------------------------------\n")
         else:
             print("Failed to fetch history.")
     except Exception as e:
         print(f"Error fetching history: {e}")
 
 def chat():
-    chat_api = f"{BASE_URL}/user/chat"
+    chat_api = f"{BASE_URL}/chat/stream"
 
     # Authenticate user first
-    user_id, password = authenticate()
-    auth = HTTPBasicAuth(user_id, password)
-    
+    headers = authenticate()
+    session_id = None
+    history = {"messages": [], "etag": None, "etag_params": None}  # local copy, synced incrementally
+
     print("Chat started! Type 'exit' or 'quit' to end the session.")
     print("-" * 50)
-    
+
     while True:
         msg = input("You: ")
-        if msg.lower() in ("exit", "quit"): 
+        if msg.lower() in ("exit", "quit"):
             print("Goodbye!")
             break
         try:
-            res = requests.post(chat_api, json={"user_id": user_id, "message": msg}, auth=auth)
-            
-            if res.status_code == 200:
-                response_data = res.json()
-                print_history(auth)
-                print("Prompt: ", response_data.get("prompt", ""))
-                print("*" * 10)
-                print("🤖 Predict:", response_data.get("response", ""))
-            else:
-                try:
-                    error_data = res.json()
-                    print(f"Error: {error_data.get('error', 'Unknown error')}")
-                except:
-                    print(f"Error: HTTP {res.status_code} - {res.text}")
+            with requests.post(chat_api, json={"message": msg, "session_id": session_id}, headers=headers, stream=True) as res:
+                if res.status_code != 200:
+                    try:
+                        print(f"Error: {res.json().get('detail', 'Unknown error')}")
+                    except:
+                        print(f"Error: HTTP {res.status_code} - {res.text}")
+                    continue
+                # Render tokens as they arrive
+                for event, data in iter_sse_events(res):
+                    if event == "sources":
+                        print("📄 Sources:", ", ".join(sorted({s["filename"] for s in data["sources"]})) or "none")
+                        print("🤖 Predict: ", end="", flush=True)
+                    elif event == "token":
+                        print(data["content"], end="", flush=True)
+                    elif event == "done":
+                        # A new session exists only once the answer is saved
+                        session_id = data["session_id"]
+                        print()
+                    elif event == "error":
+                        print(f"\nError: {data.get('detail', 'Unknown error')}")
+            if session_id:
+                print_history(headers, session_id, history)
         except Exception as e:
             print(f"Error sending message: {e}")
 
 if __name__ == "__main__":
-    chat()
\ No newline at end of file
+    chat()
@@ -1,22 +1,41 @@
+"""
+Open-loop load generator for the chat API.
+
+Requests are started on a fixed schedule (constant rate or Poisson
+arrivals), whether or not earlier ones have finished, so a slow server gets
+more concurrent requests instead of fewer - as with real users. Latency is
+measured from each request's scheduled start, which corrects for
+coordinated omission: time a request spent waiting for the generator or for
+a pooled connection counts against the server. Service time (from the
+moment the request was actually sent) is reported alongside.
+
+All requests share one pooled httpx client. Test users log in once through
+POST /auth/login (JWT) and send POST /chat.
+
+Examples:
+    python test_multi_chat.py --rate 5 --duration 60
+    python test_multi_chat.py --rate 5 --duration 60 --arrival poisson --json-out run.json
+    python test_multi_chat.py --ramp 1:40:2 --step-duration 30 --slo-p99-ms 3000
+"""
+import argparse
 import asyncio
-import httpx
-import time
-from datetime import datetime
+import json
+import math
 import random
-import argparse
 import sys
-from requests.auth import HTTPBasicAuth
+import time
+from collections import Counter
+from datetime import datetime
+
+import httpx
 
 BASE_URL = "http://127.0.0.1:8000"
 # BASE_URL = "http://40.82.161.202:8000"
 
-n_requests = 100
-test_duration = 120
-
-# Define a list of test users (userid, password)
+# Define a list of test users (email, password)
 test_users = [
-    ("user_1", "123123"),
-    ("user_2", "123123"),
+    ("user_1@example.com", "123123"),
+    ("user_2@example.com", "123123"),
     # ("testuser3", "testpass3"),
     # ("testuser4", "testpass4"),
     # ("testuser5", "testpass5"),
@@ -30,110 +49,366 @@ question_list = [
     "Where Elara lives?"
 ]
 
+# Upper bounds (ms) of the latency histogram buckets; the last bucket is open
+HISTOGRAM_BUCKETS_MS = (10, 25, 50, 100, 250, 500, 1000, 2500, 5000, 10000, 20000, 30000, 60000)
+
+
 def parse_args():
-    parser = argparse.ArgumentParser(description="Run FastAPI chat load test without pytest.")
-    parser.add_argument("--log-to-file", action="store_true", help="Enable logging to file")
-    parser.add_argument("--log-to-prompt", action="store_true", help="Enable logging to console")
+    parser = argparse.ArgumentParser(description="Open-loop load test of the chat API.")
+    parser.add_argument("--base-url", default=BASE_URL)
+    parser.add_argument("--rate", type=float, default=2.0, help="Requests per second to offer")
+    parser.add_argument("--duration", type=float, default=60.0, help="Seconds to offer load for")
+    parser.add_argument("--arrival", choices=("constant", "poisson"), default="constant",
+                        help="Evenly spaced requests, or exponentially distributed gaps")
+    parser.add_argument("--ramp", metavar="START:STOP:STEP",
+                        help="Step the rate from START to STOP req/s to find the saturation point")
+    parser.add_argument("--step-duration", type=float, default=30.0, help="Seconds per ramp step")
+    parser.add_argument("--max-connections", type=int, default=200, help="Size of the shared connection pool")
+    parser.add_argument("--max-inflight", type=int, default=5000,
+                        help="Requests in flight beyond this are not sent and count as client_overload")
+    parser.add_argument("--timeout", type=float, default=60.0, help="Per-request timeout in seconds")
+    parser.add_argument("--slo-p99-ms", type=float, default=5000.0, help="p99 latency a healthy step stays under")
+    parser.add_argument("--max-error-rate", type=float, default=0.01, help="Error share a healthy step stays under")
+    parser.add_argument("--seed", type=int, default=None, help="Seed for arrivals and questions")
+    parser.add_argument("--register", action="store_true", help="Register test users that cannot log in")
+    parser.add_argument("--sync-history", action="store_true",
+                        help="After each reply, sync the user's history incrementally (not timed)")
+    parser.add_argument("--json-out", help="Also write the report as JSON to this file")
+    parser.add_argument("--log-to-file", action="store_true", help="Log every response to test_log.txt")
+    parser.add_argument("--log-to-prompt", action="store_true", help="Log every response to the console")
     return parser.parse_args()
 
-def get_auth(user_index):
-    return HTTPBasicAuth(*test_users[user_index % len(test_users)])
 
-async def send_chat(index, user_id, user_index, delay, log_to_prompt, log_to_file, lock, success_count):
-    chat_api = f"{BASE_URL}/user/chat"
-    history_api = f"{BASE_URL}/user/chat/history"
-    await asyncio.sleep(delay)
-    message = f"{random.choice(question_list)} {index}"
+# =============================================================================
+# Statistics
+# =============================================================================
+
+def percentile(values, pct):
+    """Nearest-rank percentile of unsorted values."""
+    if not values:
+        return None
+    ordered = sorted(values)
+    return ordered[max(0, math.ceil(pct / 100 * len(ordered)) - 1)]
+
+
+def histogram(values):
+    """Counts per latency bucket, keyed by the bucket's upper bound."""
+    counts = Counter()
+    for value in values:
+        for bound in HISTOGRAM_BUCKETS_MS:
+            if value <= bound:
+                counts[f"<={bound}ms"] += 1
+                break
+        else:
+            counts[f">{HISTOGRAM_BUCKETS_MS[-1]}ms"] += 1
+    labels = [f"<={b}ms" for b in HISTOGRAM_BUCKETS_MS] + [f">{HISTOGRAM_BUCKETS_MS[-1]}ms"]
+    return {label: counts[label] for label in labels if counts[label]}
+
+
+def latency_summary(values):
+    def rounded(v):
+        return round(v, 1) if v is not None else None
+    return {
+        "p50_ms": rounded(percentile(values, 50)),
+        "p90_ms": rounded(percentile(values, 90)),
+        "p99_ms": rounded(percentile(values, 99)),
+        "max_ms": rounded(max(values) if values else None),
+        "histogram": histogram(values)
+    }
+
+
+class StepResults:
+    """Outcome of every request offered at one rate."""
+
+    def __init__(self, rate, arrival):
+        self.rate = rate
+        self.arrival = arrival
+        self.latencies = []  # ms from scheduled start (coordinated-omission corrected)
+        self.service_times = []  # ms from actual send
+        self.send_lags = []  # ms between scheduled start and actual send
+        self.errors = Counter()
+        self.offered = 0
+        self.started_at = None
+        self.finished_at = None
+        self.max_inflight = 0
+
+    def report(self):
+        ok = len(self.latencies)
+        elapsed = (self.finished_at - self.started_at) if self.started_at else 0.0
+        return {
+            "offered_rate": self.rate,
+            "arrival": self.arrival,
+            "offered": self.offered,
+            "ok": ok,
+            "errors": dict(self.errors),
+            "error_rate": round(sum(self.errors.values()) / self.offered, 4) if self.offered else 0.0,
+            "seconds": round(elapsed, 2),
+            "throughput_per_s": round(ok / elapsed, 2) if elapsed else 0.0,
+            "max_inflight": self.max_inflight,
+            "latency": latency_summary(self.latencies),
+            "service_time": latency_summary(self.service_times),
+            "send_lag_p99_ms": round(percentile(self.send_lags, 99), 1) if self.send_lags else None
+        }
+
+
+# =============================================================================
+# Users
+# =============================================================================
+
+async def login(client, email, password, register):
+    """Log in (registering first if allowed and needed); returns the user's state."""
+    response = await client.post("/auth/login", json={"email": email, "password": password})
+    if response.status_code == 401 and register:
+        response = await client.post("/auth/register", json={"email": email, "password": password})
+    if response.status_code != 200:
+        raise RuntimeError(f"Login failed for {email}: {response.status_code} {response.text[:200]}")
+    return {
+        "email": email,
+        "headers": {"Authorization": f"Bearer {response.json()['access_token']}"},
+        "session_id": None,
+        "history": [],
+        "etag": None,
+        "etag_after": None,
+        "lock": asyncio.Lock(),
+        "session_lock": asyncio.Lock()
+    }
+
+
+async def sync_history(client, state):
+    """Download only messages newer than the user's local copy (304 if unchanged)."""
+    history_api = f"/chat/sessions/{state['session_id']}/messages"
+    after = state["history"][-1]["id"] if state["history"] else None
+    params = {"after": after} if after is not None else {}
+    headers = dict(state["headers"])
+    if state["etag"] and state["etag_after"] == after:
+        headers["If-None-Match"] = state["etag"]
+    while True:
+        response = await client.get(history_api, headers=headers, params=params)
+        if response.status_code == 304:
+            return
+        response.raise_for_status()
+        state["history"].extend(response.json())
+        if "X-Next-Cursor" not in response.headers:
+            state["etag"], state["etag_after"] = response.headers.get("ETag"), after
+            return
+        params = {"cursor": response.headers["X-Next-Cursor"]}
+        headers.pop("If-None-Match", None)
+
+
+async def post_chat(client, state, message):
+    """
+    POST /chat in the user's session. Until the session exists, requests
+    take turns: the first creates it and the others then reuse it, rather
+    than each opening a session of its own.
+    """
+    if state["session_id"] is not None:
+        return await client.post(
+            "/chat", json={"message": message, "session_id": state["session_id"]}, headers=state["headers"]
+        )
+    async with state["session_lock"]:
+        response = await client.post(
+            "/chat", json={"message": message, "session_id": state["session_id"]}, headers=state["headers"]
+        )
+        if response.status_code == 200 and state["session_id"] is None:
+            state["session_id"] = response.json()["session_id"]
+        return response
+
+
+def log_response(args, index, state, message, body):
+    log_line = (
+        f"{'*' * 30}\n"
+        f"Time: {datetime.now().strftime('%Y-%m-%d %H:%M:%S')}\n"
+        f"Request #{index + 1}\n"
+        f"User: {state['email']}\n"
+        f"Message: {message}\n"
+        f"Response: {body.get('response')}\n"
+        f"Sources: {len(body.get('sources') or [])}\n"
+        f"Full History: {state['history']}\n"
+        f"{'*' * 30}\n"
+    )
+    if args.log_to_prompt:
+        print(log_line)
+    if args.log_to_file:
+        with open("test_log.txt", "a", encoding="utf-8") as f:
+            f.write(log_line + "\n")
+
+
+# =============================================================================
+# Load generation
+# =============================================================================
+
+def arrival_gaps(rate, arrival, rng):
+    """Seconds between consecutive scheduled request starts."""
+    while True:
+        yield rng.expovariate(rate) if arrival == "poisson" else 1.0 / rate
+
+
+async def send_chat(client, args, index, state, scheduled, results, inflight, rng):
+    message = f"{rng.choice(question_list)} {index}"
+    sent = time.perf_counter()
+    results.send_lags.append((sent - scheduled) * 1000)
     try:
-        async with httpx.AsyncClient(timeout=20.0) as ac:
-            response = await ac.post(
-                chat_api,
-                json={"user_id": user_id, "message": message},
-                auth=get_auth(user_index)
-            )
-            assert response.status_code == 200
-            json_data = response.json()
-            assert "response" in json_data
-            async with lock:
-                success_count["count"] += 1
-            await asyncio.sleep(1)
-            now = datetime.now()
-            history_response = await ac.get(history_api, auth=get_auth(user_index))
-            history = history_response.json().get("history", [])
-            log_line = (
-                f"{'*' * 30}\n"
-                f"Time: {now.strftime('%Y-%m-%d %H:%M:%S')}\n"
-                f"Request #{index + 1}/{n_requests}\n"
-                f"User: {user_id}\n"
-                f"Message: {message}\n"
-                f"Response: {json_data['response']}\n"
-                f"Prompt: {json_data.get('prompt', 'N/A')}\n"
-                f"Full History: {history}\n"
-                f"{'*' * 30}\n"
-            )
-            if log_to_prompt:
-                print(log_line)
-            if log_to_file:
-                with open("test_log.txt", "a", encoding="utf-8") as f:
-                    f.write(log_line + "\n")
-            return json_data["response"]
+        response = await post_chat(client, state, message)
+        finished = time.perf_counter()
+        if response.status_code != 200:
+            results.errors[f"http_{response.status_code}"] += 1
+            return
+        body = response.json()
+        results.latencies.append((finished - scheduled) * 1000)
+        results.service_times.append((finished - sent) * 1000)
+        if args.log_to_prompt or args.log_to_file:
+            log_response(args, index, state, message, body)
+        if args.sync_history:
+            try:
+                async with state["lock"]:
+                    await sync_history(client, state)
+            except httpx.HTTPError as e:
+                print(f"[WARN] History sync for {state['email']} failed: {e}")
+    except httpx.TimeoutException:
+        results.errors["timeout"] += 1
+    except httpx.HTTPError as e:
+        results.errors[type(e).__name__] += 1
     except Exception as e:
+        results.errors[type(e).__name__] += 1
         error_log = f"[ERROR] Request #{index + 1} failed: {e}\n"
         print(error_log)
-        if log_to_file:
+        if args.log_to_file:
             with open("test_log.txt", "a", encoding="utf-8") as f:
                 f.write(error_log + "\n")
-        return None
+    finally:
+        results.finished_at = time.perf_counter()
+        inflight["count"] -= 1
+
+
+async def run_step(client, args, states, rate, duration, rng):
+    """Offer `rate` requests per second for `duration` seconds, open loop."""
+    results = StepResults(rate, args.arrival)
+    inflight = {"count": 0}
+    tasks = []
+    start = time.perf_counter()
+    results.started_at = start
+    scheduled = start
+    index = 0
+    for gap in arrival_gaps(rate, args.arrival, rng):
+        if scheduled - start >= duration:
+            break
+        delay = scheduled - time.perf_counter()
+        if delay > 0:
+            await asyncio.sleep(delay)
+        results.offered += 1
+        if inflight["count"] >= args.max_inflight:
+            results.errors["client_overload"] += 1
+        else:
+            inflight["count"] += 1
+            results.max_inflight = max(results.max_inflight, inflight["count"])
+            state = states[index % len(states)]
+            tasks.append(asyncio.create_task(
+                send_chat(client, args, index, state, scheduled, results, inflight, rng)
+            ))
+        index += 1
+        scheduled += gap
+    await asyncio.gather(*tasks)
+    if results.finished_at is None:
+        results.finished_at = time.perf_counter()
+    return results.report()
+
+
+def healthy(report, args):
+    """Whether a step kept up with its offered rate within the SLO."""
+    p99 = report["latency"]["p99_ms"]
+    return (
+        report["error_rate"] <= args.max_error_rate
+        and p99 is not None and p99 <= args.slo_p99_ms
+        and report["throughput_per_s"] >= 0.9 * report["offered_rate"]
+    )
+
+
+def parse_ramp(spec):
+    start, stop, step = (float(part) for part in spec.split(":"))
+    if start <= 0 or step <= 0 or stop < start:
+        raise ValueError("--ramp needs 0 < START <= STOP and STEP > 0")
+    rates = []
+    rate = start
+    while rate <= stop + 1e-9:
+        rates.append(round(rate, 6))
+        rate += step
+    return rates
+
+
+def print_step(report):
+    latency = report["latency"]
+    print(
+        f"rate {report['offered_rate']:>7.2f}/s  ok {report['ok']:>6}  errors {sum(report['errors'].values()):>5}  "
+        f"throughput {report['throughput_per_s']:>7.2f}/s  p50 {latency['p50_ms']}  p90 {latency['p90_ms']}  "
+        f"p99 {latency['p99_ms']}  max {latency['max_ms']} ms"
+    )
+    if report["errors"]:
+        print(f"    errors: {report['errors']}")
+
+
+async def run_all(args):
+    rng = random.Random(args.seed)
+    limits = httpx.Limits(max_connections=args.max_connections, max_keepalive_connections=args.max_connections)
+    async with httpx.AsyncClient(base_url=args.base_url, limits=limits, timeout=args.timeout) as client:
+        states = [await login(client, email, password, args.register) for email, password in test_users]
+
+        if not args.ramp:
+            report = await run_step(client, args, states, args.rate, args.duration, rng)
+            print_step(report)
+            return {"mode": "fixed", "steps": [report]}
+
+        steps = []
+        saturation = None
+        for rate in parse_ramp(args.ramp):
+            report = await run_step(client, args, states, rate, args.step_duration, rng)
+            print_step(report)
+            steps.append(report)
+            if not healthy(report, args):
+                saturation = rate
+                break
+        healthy_rates = [s["offered_rate"] for s in steps if healthy(s, args)]
+        return {
+            "mode": "ramp",
+            "steps": steps,
+            "saturation_rate": saturation,
+            "max_healthy_rate": healthy_rates[-1] if healthy_rates else None
+        }
+
 
 def main():
     args = parse_args()
-    log_to_file = args.log_to_file
-    log_to_prompt = args.log_to_prompt
-    # Rotate through test users for each request
-    users = [test_users[i % len(test_users)][0] for i in range(n_requests)]
-    interval = test_duration / n_requests
-    success_count = {"count": 0}
-    lock = asyncio.Lock()
-    response_times = []
-
-    async def timed_send_chat(index, user_id, user_index, delay):
-        t0 = time.time()
-        result = await send_chat(index, user_id, user_index, delay, log_to_prompt, log_to_file, lock, success_count)
-        t1 = time.time()
-        response_times.append(t1 - t0)
-        return result
-
-    async def run_all():
-        tasks = [
-            timed_send_chat(i, users[i], i, i * interval)
-            for i in range(n_requests)
-        ]
-        results = await asyncio.gather(*tasks)
-        return results
-
-    start_time = time.time()
-    results = asyncio.run(run_all())
-    elapsed = time.time() - start_time
-    passed = success_count["count"]
-    failed = n_requests - passed
-    avg_response_time = sum(response_times) / len(response_times) if response_times else 0
-    summary = (
-        f"\n✅ {passed} / {n_requests} requests succeeded.\n"
-        f"❌ {failed} requests failed.\n"
-        f"🕒 Total time elapsed: {elapsed:.2f} seconds\n"
-        f"⏱️ Average response time: {avg_response_time:.2f} seconds\n"
-    )
-    if log_to_prompt:
-        print(summary)
-    if log_to_file:
-        with open("test_log.txt", "a", encoding="utf-8") as f:
-            f.write(summary + "\n")
-    if failed > 5:
-        print(f"❌Test failed❌: {failed} requests failed (allowed <= 5)")
-    if elapsed < test_duration * 0.9:
-        print(f"❌Test failed❌: elapsed time {elapsed:.2f}s is less than 90% of expected {test_duration}s")
-    if failed <= 5 and elapsed >= test_duration * 0.9:
-        print("✅Test passed!✅")
+    if args.rate <= 0:
+        sys.exit("--rate must be positive")
+    started = time.time()
+    result = asyncio.run(run_all(args))
+    result["elapsed_seconds"] = round(time.time() - started, 2)
+    result["base_url"] = args.base_url
+
+    last = result["steps"][-1]
+    print("\nCorrected latency histogram (last step):")
+    for bucket, count in last["latency"]["histogram"].items():
+        print(f"  {bucket:>10} {count:>7} {'#' * min(60, count)}")
+
+    if result["mode"] == "ramp":
+        if result["saturation_rate"] is None:
+            print(f"\nNo saturation up to {last['offered_rate']}/s")
+        else:
+            print(f"\nSaturated at {result['saturation_rate']}/s; last healthy rate: {result['max_healthy_rate']}/s")
+
+    if args.json_out:
+        with open(args.json_out, "w", encoding="utf-8") as f:
+            json.dump(result, f, indent=2)
+        print(f"Report written to {args.json_out}")
+
+    if result["mode"] == "fixed":
+        if healthy(last, args):
+            print("✅Test passed!✅")
+        else:
+            print(f"❌Test failed❌: p99 {last['latency']['p99_ms']} ms (SLO {args.slo_p99_ms}), "
+                  f"error rate {last['error_rate']} (max {args.max_error_rate}), "
+                  f"throughput {last['throughput_per_s']}/s of {last['offered_rate']}/s offered")
+            sys.exit(1)
+
 
 if __name__ == "__main__":
     main()
@@ -0,0 +1,101 @@
+"""
+Micro-batching - coalesce concurrent single-item calls into one batched call.
+
+Requests that arrive within a short window (or until the batch is full) are
+sent upstream together, and each caller receives its own result. Used for
+query embeddings, where many concurrent /chat requests would otherwise each
+make a separate HTTPS round trip.
+"""
+import asyncio
+from typing import Any, Awaitable, Callable, List, Optional, Set, Tuple
+
+
+class MicroBatcher:
+    """
+    Collects items for up to `window_ms` or `max_size` items, then calls
+    `batch_fn` once with the whole list.
+
+    `batch_fn` must return one result per input item, in order. If it
+    raises, every caller in that batch receives the exception.
+    """
+
+    def __init__(
+        self,
+        batch_fn: Callable[[List[Any]], Awaitable[List[Any]]],
+        window_ms: float,
+        max_size: int
+    ):
+        self._batch_fn = batch_fn
+        self.window = window_ms / 1000
+        self.max_size = max_size
+        self._pending: List[Tuple[Any, asyncio.Future]] = []
+        self._timer: Optional[asyncio.TimerHandle] = None
+        self._tasks: Set[asyncio.Task] = set()
+        self.stats = {"requests": 0, "batches": 0, "batched_items": 0, "expired": 0}
+
+    async def submit(self, item: Any, timeout: Optional[float] = None) -> Any:
+        """
+        Queue an item and wait for its result.
+
+        Args:
+            item: The input for batch_fn
+            timeout: Per-request deadline in seconds; raises TimeoutError when
+                exceeded, and the item is dropped if its batch has not left yet
+
+        Returns:
+            The result for this item
+        """
+        loop = asyncio.get_running_loop()
+        future = loop.create_future()
+        self._pending.append((item, future))
+        self.stats["requests"] += 1
+
+        if len(self._pending) >= self.max_size:
+            self._flush()
+        elif self._timer is None:
+            self._timer = loop.call_later(self.window, self._flush)
+
+        if timeout is None:
+            return await future
+        return await asyncio.wait_for(future, timeout)
+
+    def _flush(self) -> None:
+        """Send the oldest pending items as one batch."""
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+
+        batch = self._pending[:self.max_size]
+        self._pending = self._pending[self.max_size:]
+        if self._pending:
+            # Leftovers start a new window (or flush straight away if still full)
+            loop = asyncio.get_running_loop()
+            if len(self._pending) >= self.max_size:
+                loop.call_soon(self._flush)
+            else:
+                self._timer = loop.call_later(self.window, self._flush)
+
+        task = asyncio.get_running_loop().create_task(self._run(batch))
+        self._tasks.add(task)
+        task.add_done_callback(self._tasks.discard)
+
+    async def _run(self, batch: List[Tuple[Any, asyncio.Future]]) -> None:
+        """Call batch_fn for the still-waiting items and fan the results out."""
+        live = [(item, future) for item, future in batch if not future.done()]
+        self.stats["expired"] += len(batch) - len(live)
+        if not live:
+            return
+
+        self.stats["batches"] += 1
+        self.stats["batched_items"] += len(live)
+        try:
+            results = await self._batch_fn([item for item, _ in live])
+        except Exception as e:
+            for _, future in live:
+                if not future.done():
+                    future.set_exception(e)
+            return
+
+        for (_, future), result in zip(live, results):
+            if not future.done():
+                future.set_result(result)
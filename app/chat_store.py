@@ -0,0 +1,230 @@
+"""
+Chat store module - persistence of chat exchanges.
+
+A chat request touches the database twice at most:
+- before the LLM call, one read-only transaction checks session ownership
+  (or reserves the id of a new session from its sequence) alongside
+  retrieval
+- after it, one transaction inserts the new session, if any, together with
+  the user/assistant message pair
+
+With CHAT_WRITE_BEHIND on, a new session is still inserted right away (so
+every worker behind the load balancer can find it for the follow-up
+request, and a DELETE on any worker removes it), but the message pair is
+queued and a background task inserts queued messages in batches every
+CHAT_WRITE_BEHIND_FLUSH_MS; the queue is flushed on shutdown. Queued
+messages are only visible to the worker that queued them (its reads flush
+first): with several workers, another worker's history read can lag by up
+to one flush interval. Message ids are not known when the response is sent.
+
+A batch that fails on a transient error (connection lost, failover) stays
+queued and is retried with exponential backoff up to
+CHAT_WRITE_BEHIND_RETRY_MAX_SECONDS; only an exchange rejected with an
+IntegrityError (e.g. its session was deleted meanwhile) is dropped. Once
+CHAT_WRITE_BEHIND_MAX_QUEUE exchanges are waiting, new ones are written
+synchronously instead, so a long outage slows requests down rather than
+growing the queue without bound.
+"""
+import asyncio
+from typing import List, NamedTuple, Optional, Tuple
+
+from sqlalchemy import insert, select, text
+from sqlalchemy.exc import IntegrityError
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app import metrics
+from app.config import settings
+from app.db import get_async_db_context
+from app.models import ChatMessage, ChatSession
+
+
+class ChatExchange(NamedTuple):
+    """One question/answer pair, plus the session to create if it is new."""
+    session_id: int
+    user_id: int
+    new_session_title: Optional[str]  # None for an existing session
+    question: str
+    answer: str
+
+
+async def reserve_session_id(db: AsyncSession) -> int:
+    """Take the next chat_sessions id without inserting the row yet."""
+    return await db.scalar(text("SELECT nextval(pg_get_serial_sequence('chat_sessions', 'id'))"))
+
+
+async def session_owned_by(db: AsyncSession, session_id: int, user_id: int) -> bool:
+    """Whether the session exists and belongs to the user."""
+    owner = await db.scalar(select(ChatSession.user_id).where(ChatSession.id == session_id))
+    return owner == user_id
+
+
+def _session_row(exchange: ChatExchange) -> dict:
+    return {
+        "id": exchange.session_id,
+        "user_id": exchange.user_id,
+        "title": exchange.new_session_title
+    }
+
+
+def _message_rows(exchange: ChatExchange) -> List[dict]:
+    # created_at is left to the column default, i.e. set when the row is
+    # inserted, so (created_at, id) order follows insertion order even when
+    # exchanges of one session overlap
+    return [
+        {"session_id": exchange.session_id, "role": "user", "content": exchange.question},
+        {"session_id": exchange.session_id, "role": "assistant", "content": exchange.answer},
+    ]
+
+
+async def save_exchange(exchange: ChatExchange) -> Tuple[Optional[int], Optional[int]]:
+    """
+    Persist a chat exchange in one transaction, or queue it in write-behind mode.
+
+    Returns:
+        Tuple of (user_message_id, assistant_message_id); both None when queued
+    """
+    if chat_writer.enabled:
+        if not chat_writer.full():
+            if exchange.new_session_title is not None:
+                # Sessions are never queued: other workers must see them at once
+                with metrics.stage("db_write"):
+                    async with get_async_db_context() as db:
+                        db.add(ChatSession(**_session_row(exchange)))
+            chat_writer.enqueue(exchange)
+            return None, None
+        chat_writer.stats["sync_fallbacks"] += 1
+
+    with metrics.stage("db_write"):
+        async with get_async_db_context() as db:
+            if exchange.new_session_title is not None:
+                db.add(ChatSession(**_session_row(exchange)))
+            user_msg, assistant_msg = (ChatMessage(**row) for row in _message_rows(exchange))
+            db.add_all([user_msg, assistant_msg])
+            await db.flush()
+    return user_msg.id, assistant_msg.id
+
+
+class ChatWriter:
+    """Queues chat exchanges and inserts their messages in batches from a background task."""
+
+    def __init__(self, enabled: bool, flush_ms: float, max_batch: int, max_queue: int,
+                 retry_max_seconds: float):
+        self.enabled = enabled
+        self.interval = flush_ms / 1000
+        self.max_batch = max_batch
+        self.max_queue = max_queue
+        self.retry_max = retry_max_seconds
+        self._queue: List[ChatExchange] = []
+        self._lock = asyncio.Lock()
+        self._task: Optional[asyncio.Task] = None
+        self._backoff = 0.0
+        self._retry_at = 0.0  # loop time before which the background task does not retry
+        self.stats = {
+            "queued": 0, "flushes": 0, "written": 0, "dropped": 0,
+            "failed_flushes": 0, "sync_fallbacks": 0
+        }
+
+    def full(self) -> bool:
+        return len(self._queue) >= self.max_queue
+
+    def enqueue(self, exchange: ChatExchange) -> None:
+        self._queue.append(exchange)
+        self.stats["queued"] += 1
+
+    async def _insert(self, batch: List[ChatExchange]) -> None:
+        messages = [row for e in batch for row in _message_rows(e)]
+        with metrics.stage("db_write"):
+            async with get_async_db_context() as db:
+                await db.execute(insert(ChatMessage), messages)
+
+    async def _insert_each(self, batch: List[ChatExchange]) -> List[ChatExchange]:
+        """
+        Insert one by one after a batch hit an IntegrityError, dropping the
+        exchanges that are rejected; returns the rest from the first
+        transient failure on, still to be written.
+        """
+        for i, exchange in enumerate(batch):
+            try:
+                await self._insert([exchange])
+                self.stats["written"] += 1
+            except IntegrityError as e:
+                self.stats["dropped"] += 1
+                print(f"Dropping chat exchange for session {exchange.session_id}: {e}")
+            except Exception:
+                return batch[i:]
+        return []
+
+    async def flush(self) -> bool:
+        """
+        Insert everything queued so far.
+
+        Returns:
+            False if a transient error left exchanges queued for a later retry
+        """
+        async with self._lock:
+            while self._queue:
+                batch = self._queue[:self.max_batch]
+                self._queue = self._queue[self.max_batch:]
+                unwritten: List[ChatExchange] = []
+                try:
+                    await self._insert(batch)
+                    self.stats["written"] += len(batch)
+                except IntegrityError:
+                    # One bad exchange (e.g. its session was deleted) must not block the rest
+                    unwritten = await self._insert_each(batch)
+                except Exception as e:
+                    print(f"Chat write-behind batch failed, keeping {len(batch)} exchanges queued: {e}")
+                    unwritten = batch
+                self.stats["flushes"] += 1
+                if unwritten:
+                    # Back in front, in order; retried after a growing pause
+                    self._queue[:0] = unwritten
+                    self.stats["failed_flushes"] += 1
+                    self._backoff = min(max(self._backoff * 2, self.interval), self.retry_max)
+                    self._retry_at = asyncio.get_running_loop().time() + self._backoff
+                    return False
+            self._backoff = 0.0
+            return True
+
+    async def _run(self) -> None:
+        loop = asyncio.get_running_loop()
+        while True:
+            await asyncio.sleep(self.interval)
+            if loop.time() < self._retry_at:
+                continue
+            try:
+                await self.flush()
+            except Exception as e:
+                print(f"Chat write-behind flush failed: {e}")
+
+    def start(self) -> None:
+        if self.enabled and self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        """Stop the background task and flush what is left."""
+        if self._task is not None:
+            # Holding the lock guarantees the task is not half-way through a batch
+            async with self._lock:
+                self._task.cancel()
+                self._task = None
+        if not await self.flush():
+            print(f"Chat write-behind: {len(self._queue)} exchanges could not be written at shutdown")
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "enabled": self.enabled,
+            "queue_depth": len(self._queue),
+            "max_queue": self.max_queue,
+            "backoff_seconds": self._backoff
+        }
+
+
+chat_writer = ChatWriter(
+    settings.CHAT_WRITE_BEHIND,
+    settings.CHAT_WRITE_BEHIND_FLUSH_MS,
+    settings.CHAT_WRITE_BEHIND_MAX_BATCH,
+    settings.CHAT_WRITE_BEHIND_MAX_QUEUE,
+    settings.CHAT_WRITE_BEHIND_RETRY_MAX_SECONDS
+)
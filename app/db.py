@@ -1,13 +1,21 @@
 """
 Database module - SQLAlchemy engine and session management for Postgres.
+
+Request handlers use the async engine so a request waiting on I/O never
+holds a thread. Batch ingestion gets its own small async pool so a large
+upload cannot take connections away from chat. The sync engine remains for
+startup DDL and background maintenance that runs in worker threads.
 """
-from sqlalchemy import create_engine
+import time
+from sqlalchemy import create_engine, event
+from sqlalchemy.ext.asyncio import AsyncSession, async_sessionmaker, create_async_engine
 from sqlalchemy.orm import sessionmaker, declarative_base
-from contextlib import contextmanager
+from contextlib import asynccontextmanager, contextmanager
 
+from app import slow_queries, tracing
 from app.config import settings
 
-# Create SQLAlchemy engine
+# Create SQLAlchemy engine (sync - DDL, maintenance, scripts)
 engine = create_engine(
     settings.DATABASE_URL,
     pool_pre_ping=True,
@@ -15,23 +23,164 @@ engine = create_engine(
     max_overflow=10
 )
 
-# Session factory
+# Create async SQLAlchemy engine (request path)
+async_engine = create_async_engine(
+    settings.DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.DB_POOL_SIZE,
+    max_overflow=settings.DB_MAX_OVERFLOW,
+    pool_timeout=settings.DB_POOL_TIMEOUT
+)
+
+# Separate async engine for batch ingestion (chunk inserts)
+batch_engine = create_async_engine(
+    settings.DATABASE_URL,
+    pool_pre_ping=True,
+    pool_size=settings.DB_BATCH_POOL_SIZE,
+    max_overflow=0,
+    pool_timeout=settings.DB_POOL_TIMEOUT
+)
+
+
+class PoolMetrics:
+    """
+    Checkout statistics for one async connection pool.
+    
+    Hold times and in-use counts come from pool events; wait times are
+    recorded by the session helpers below, which check out eagerly.
+    """
+
+    def __init__(self, capacity: int):
+        self.capacity = capacity
+        self.checkouts = 0
+        self.in_use = 0
+        self.peak_in_use = 0
+        self.saturated = 0  # checkouts that left no spare connection
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        self.hold_total = 0.0
+        self.hold_max = 0.0
+
+    def on_checkout(self, record) -> None:
+        self.checkouts += 1
+        self.in_use += 1
+        self.peak_in_use = max(self.peak_in_use, self.in_use)
+        if self.in_use >= self.capacity:
+            self.saturated += 1
+        record.info["checked_out_at"] = time.perf_counter()
+
+    def on_checkin(self, record) -> None:
+        started = record.info.pop("checked_out_at", None)
+        if started is None:
+            return
+        self.in_use -= 1
+        held = time.perf_counter() - started
+        self.hold_total += held
+        self.hold_max = max(self.hold_max, held)
+
+    def on_wait(self, seconds: float) -> None:
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def snapshot(self) -> dict:
+        checkouts = max(self.checkouts, 1)
+        return {
+            "capacity": self.capacity,
+            "checkouts": self.checkouts,
+            "in_use": self.in_use,
+            "peak_in_use": self.peak_in_use,
+            "saturated_checkouts": self.saturated,
+            "wait_avg_ms": round(self.wait_total / checkouts * 1000, 3),
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "hold_avg_ms": round(self.hold_total / checkouts * 1000, 3),
+            "hold_max_ms": round(self.hold_max * 1000, 3)
+        }
+
+
+def _instrument(async_pool_engine, metrics: PoolMetrics) -> None:
+    """Feed an async engine's pool events into `metrics`."""
+    pool = async_pool_engine.sync_engine.pool
+    event.listen(pool, "checkout", lambda conn, record, proxy: metrics.on_checkout(record))
+    event.listen(pool, "checkin", lambda conn, record: metrics.on_checkin(record))
+
+
+pool_metrics = PoolMetrics(settings.DB_POOL_SIZE + settings.DB_MAX_OVERFLOW)
+batch_pool_metrics = PoolMetrics(settings.DB_BATCH_POOL_SIZE)
+_instrument(async_engine, pool_metrics)
+_instrument(batch_engine, batch_pool_metrics)
+tracing.instrument_engine(engine, "sync")
+tracing.instrument_engine(async_engine.sync_engine, "request")
+tracing.instrument_engine(batch_engine.sync_engine, "batch")
+slow_queries.instrument_engine(engine, "sync")
+slow_queries.instrument_engine(async_engine.sync_engine, "request")
+slow_queries.instrument_engine(batch_engine.sync_engine, "batch")
+
+# Session factories
 SessionLocal = sessionmaker(autocommit=False, autoflush=False, bind=engine)
+AsyncSessionLocal = async_sessionmaker(
+    async_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False  # Keep loaded attributes usable after commit
+)
+BatchSessionLocal = async_sessionmaker(
+    batch_engine,
+    class_=AsyncSession,
+    autoflush=False,
+    expire_on_commit=False
+)
 
 # Base class for models
 Base = declarative_base()
 
 
-def get_db():
+async def _timed_checkout(db: AsyncSession, metrics: PoolMetrics = pool_metrics) -> None:
+    """Check out the session's connection now, recording how long the pool made us wait."""
+    started = time.perf_counter()
+    with tracing.span("db.pool.wait", **{"db.pool": "batch" if metrics is batch_pool_metrics else "request"}):
+        await db.connection()
+    metrics.on_wait(time.perf_counter() - started)
+
+
+async def get_db():
     """
-    Dependency that provides a database session.
+    Dependency that provides an async database session.
     Use with FastAPI's Depends().
     """
-    db = SessionLocal()
-    try:
+    async with AsyncSessionLocal() as db:
+        await _timed_checkout(db)
         yield db
-    finally:
-        db.close()
+
+
+@asynccontextmanager
+async def get_async_db_context():
+    """
+    Async context manager for database sessions outside of FastAPI dependencies.
+    """
+    async with AsyncSessionLocal() as db:
+        await _timed_checkout(db)
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
+
+
+@asynccontextmanager
+async def get_batch_db_context():
+    """
+    Async session on the batch pool, for ingestion work that must not
+    compete with request handlers for connections.
+    """
+    async with BatchSessionLocal() as db:
+        await _timed_checkout(db, batch_pool_metrics)
+        try:
+            yield db
+            await db.commit()
+        except Exception:
+            await db.rollback()
+            raise
 
 
 @contextmanager
@@ -57,3 +206,8 @@ def init_db():
     """
     from app import models  # noqa: F401 - Import to register models
     Base.metadata.create_all(bind=engine)
+    
+    # create_all skips existing tables; add indexes declared since they were created
+    for table in Base.metadata.sorted_tables:
+        for index in table.indexes:
+            index.create(bind=engine, checkfirst=True)
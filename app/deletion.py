@@ -0,0 +1,254 @@
+"""
+Deletion module - set-based deletes, tenant purge and S3 cleanup.
+
+Documents and chat sessions are deleted with a single DELETE statement; their
+chunks and messages go with the ON DELETE CASCADE foreign keys, so nothing
+is loaded into the session (a document's chunks carry a 1536-float
+embedding each).
+
+S3 objects are not deleted inline. Their keys are written to the
+s3_deletions table in the same transaction as the DELETE, and a background
+task removes them in batches, retrying failures with exponential backoff.
+An object is therefore never orphaned by a crash or an S3 error, and a key
+that keeps failing stays in the table (after S3_CLEANUP_MAX_ATTEMPTS) for
+inspection.
+
+A tenant purge removes a user's chunks, messages, sessions and documents in
+batches of DELETE_BATCH_SIZE rows, each in its own short transaction, and
+deletes the user row last.
+"""
+import asyncio
+from datetime import datetime, timedelta
+from typing import Dict, List, Optional
+
+from sqlalchemy import delete, func, insert, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.chat_store import chat_writer
+from app.config import settings
+from app.db import get_batch_db_context
+from app.models import ChatMessage, ChatSession, Chunk, Document, S3Deletion, User
+from app.s3_utils import delete_pdfs_from_s3
+from app.security import invalidate_principal
+
+# Longest retry delay for a failing S3 deletion
+_MAX_BACKOFF_SECONDS = 3600
+
+# Claimed rows are not due again for this long, in case the worker dies
+# between claiming them and recording the outcome
+_CLAIM_LEASE_SECONDS = 300
+
+
+async def enqueue_s3_deletions(db: AsyncSession, s3_keys: List[str]) -> None:
+    """Queue S3 objects for deletion as part of the caller's transaction."""
+    if s3_keys:
+        await db.execute(insert(S3Deletion), [{"s3_key": key} for key in s3_keys])
+
+
+async def delete_document(db: AsyncSession, doc_id: int, user_id: int) -> bool:
+    """
+    Delete a document (its chunks cascade) and queue its PDF for deletion.
+    The caller commits.
+
+    Returns:
+        False if the user has no such document
+    """
+    s3_key = await db.scalar(
+        delete(Document)
+        .where(Document.id == doc_id, Document.user_id == user_id)
+        .returning(Document.s3_key)
+    )
+    if s3_key is None:
+        return False
+    await enqueue_s3_deletions(db, [s3_key])
+    return True
+
+
+async def delete_session(db: AsyncSession, session_id: int, user_id: int) -> bool:
+    """
+    Delete a chat session (its messages cascade). The caller commits.
+
+    Returns:
+        False if the user has no such session
+    """
+    deleted = await db.scalar(
+        delete(ChatSession)
+        .where(ChatSession.id == session_id, ChatSession.user_id == user_id)
+        .returning(ChatSession.id)
+    )
+    return deleted is not None
+
+
+async def _delete_in_batches(statement_for_batch) -> int:
+    """Run a batched DELETE until it deletes fewer rows than a full batch."""
+    total = 0
+    while True:
+        async with get_batch_db_context() as db:
+            deleted = await statement_for_batch(db)
+        total += deleted
+        if deleted < settings.DELETE_BATCH_SIZE:
+            return total
+
+
+async def purge_tenant(user_id: int) -> Optional[Dict[str, int]]:
+    """
+    Remove a user and everything they own, in bounded batches.
+
+    Each batch is its own transaction, so row locks are held only briefly
+    and other tenants' queries are not blocked behind one long DELETE.
+    Anything the user creates while the purge runs goes with the user row
+    at the end.
+
+    Args:
+        user_id: The user to purge
+
+    Returns:
+        Rows deleted per table, or None if the user does not exist
+    """
+    async with get_batch_db_context() as db:
+        if await db.scalar(select(User.id).where(User.id == user_id)) is None:
+            return None
+
+    await chat_writer.flush()  # Queued messages must land before their sessions go
+    batch = settings.DELETE_BATCH_SIZE
+
+    async def chunks_batch(db: AsyncSession) -> int:
+        ids = select(Chunk.id).where(Chunk.user_id == user_id).limit(batch)
+        return (await db.execute(delete(Chunk).where(Chunk.id.in_(ids)))).rowcount
+
+    async def messages_batch(db: AsyncSession) -> int:
+        ids = (
+            select(ChatMessage.id)
+            .join(ChatSession, ChatSession.id == ChatMessage.session_id)
+            .where(ChatSession.user_id == user_id)
+            .limit(batch)
+        )
+        return (await db.execute(delete(ChatMessage).where(ChatMessage.id.in_(ids)))).rowcount
+
+    async def sessions_batch(db: AsyncSession) -> int:
+        ids = select(ChatSession.id).where(ChatSession.user_id == user_id).limit(batch)
+        return (await db.execute(delete(ChatSession).where(ChatSession.id.in_(ids)))).rowcount
+
+    async def documents_batch(db: AsyncSession) -> int:
+        ids = select(Document.id).where(Document.user_id == user_id).limit(batch)
+        s3_keys = (await db.scalars(
+            delete(Document).where(Document.id.in_(ids)).returning(Document.s3_key)
+        )).all()
+        await enqueue_s3_deletions(db, s3_keys)
+        return len(s3_keys)
+
+    counts = {
+        "chunks": await _delete_in_batches(chunks_batch),
+        "chat_messages": await _delete_in_batches(messages_batch),
+        "chat_sessions": await _delete_in_batches(sessions_batch),
+        "documents": await _delete_in_batches(documents_batch),
+    }
+
+    async with get_batch_db_context() as db:
+        # Documents uploaded during the purge still need their PDFs queued
+        late_keys = (await db.scalars(
+            delete(Document).where(Document.user_id == user_id).returning(Document.s3_key)
+        )).all()
+        await enqueue_s3_deletions(db, late_keys)
+        await db.execute(delete(User).where(User.id == user_id))
+    counts["documents"] += len(late_keys)
+
+    invalidate_principal(user_id)
+    return counts
+
+
+class S3Cleaner:
+    """Deletes queued S3 objects in batches from a background task."""
+
+    def __init__(self, interval: float, batch_size: int, max_attempts: int):
+        self.interval = interval
+        self.batch_size = min(batch_size, 1000)  # S3 DeleteObjects limit
+        self.max_attempts = max_attempts
+        self._task: Optional[asyncio.Task] = None
+        self.stats = {"passes": 0, "deleted": 0, "failed": 0}
+
+    async def drain_once(self) -> int:
+        """
+        Delete one batch of due S3 objects.
+
+        Rows are claimed with FOR UPDATE SKIP LOCKED in a short transaction
+        that also counts the attempt and leases them out for
+        _CLAIM_LEASE_SECONDS, so several API workers can drain the queue
+        without deleting the same object twice. The S3 call runs with no
+        transaction open, and a second transaction removes the deleted rows
+        and reschedules the failed ones with backoff.
+
+        Returns:
+            Number of queued objects processed (deleted or rescheduled)
+        """
+        now = datetime.utcnow()
+        async with get_batch_db_context() as db:
+            rows = (await db.execute(
+                select(S3Deletion.id, S3Deletion.s3_key, S3Deletion.attempts)
+                .where(S3Deletion.next_attempt_at <= now, S3Deletion.attempts < self.max_attempts)
+                .order_by(S3Deletion.next_attempt_at)
+                .limit(self.batch_size)
+                .with_for_update(skip_locked=True)
+            )).all()
+            if not rows:
+                return 0
+            await db.execute(update(S3Deletion).where(S3Deletion.id.in_([row.id for row in rows])).values(
+                attempts=S3Deletion.attempts + 1,
+                next_attempt_at=now + timedelta(seconds=_CLAIM_LEASE_SECONDS)
+            ))
+
+        errors = await delete_pdfs_from_s3([row.s3_key for row in rows])
+        done = [row.id for row in rows if row.s3_key not in errors]
+
+        now = datetime.utcnow()
+        async with get_batch_db_context() as db:
+            if done:
+                await db.execute(delete(S3Deletion).where(S3Deletion.id.in_(done)))
+            for row in rows:
+                if row.s3_key in errors:
+                    backoff = min(self.interval * 2 ** row.attempts, _MAX_BACKOFF_SECONDS)
+                    await db.execute(update(S3Deletion).where(S3Deletion.id == row.id).values(
+                        next_attempt_at=now + timedelta(seconds=backoff),
+                        last_error=errors[row.s3_key][:1000]
+                    ))
+
+        self.stats["deleted"] += len(done)
+        self.stats["failed"] += len(rows) - len(done)
+        return len(rows)
+
+    async def _run(self) -> None:
+        while True:
+            try:
+                # Keep going while batches come back full, then wait
+                while await self.drain_once() == self.batch_size:
+                    pass
+            except Exception as e:
+                print(f"S3 cleanup failed: {e}")
+            self.stats["passes"] += 1
+            await asyncio.sleep(self.interval)
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    def stop(self) -> None:
+        # Anything left is still queued in the database for the next start
+        if self._task is not None:
+            self._task.cancel()
+            self._task = None
+
+    async def snapshot(self) -> dict:
+        """Counters for this worker plus the queue backlog (shared by all workers)."""
+        async with get_batch_db_context() as db:
+            pending, dead = (await db.execute(select(
+                func.count().filter(S3Deletion.attempts < self.max_attempts),
+                func.count().filter(S3Deletion.attempts >= self.max_attempts)
+            ))).one()
+        return {**self.stats, "pending": pending, "dead": dead}
+
+
+s3_cleaner = S3Cleaner(
+    settings.S3_CLEANUP_INTERVAL_SECONDS,
+    settings.S3_CLEANUP_BATCH_SIZE,
+    settings.S3_CLEANUP_MAX_ATTEMPTS
+)
@@ -0,0 +1,245 @@
+"""
+Fair share module - per-tenant limits on expensive operations.
+
+/chat, /chat/stream and /documents/upload take a slot from the tenant
+limiter before doing any OpenAI work. Each user gets:
+- at most TENANT_MAX_CONCURRENCY operations in flight
+- TENANT_RPM operations and TENANT_TPM estimated tokens per minute
+
+A request over its limits waits up to TENANT_QUEUE_SECONDS for room, and is
+otherwise rejected with 429 and Retry-After. Once admitted, upstream
+capacity is shared between tenants by weight (TENANT_WEIGHTS) in
+app/rate_limit.py.
+
+Limits are per worker process by default. Set FAIR_SHARE_REDIS_URL (and
+`pip install redis`) to keep them in Redis so they hold across gunicorn
+workers.
+"""
+import asyncio
+import time
+from contextlib import asynccontextmanager
+from typing import Dict
+
+from app.config import settings
+from app.rate_limit import TokenBucket
+
+# Re-check interval while waiting for a concurrency slot
+_SLOT_POLL_SECONDS = 0.05
+
+
+class TenantRateLimited(Exception):
+    """A tenant exceeded its limits and the request could not wait long enough."""
+
+    def __init__(self, retry_after: float):
+        super().__init__(f"Tenant rate limit exceeded, retry after {retry_after:.1f}s")
+        self.retry_after = retry_after
+
+
+class _TenantState:
+    def __init__(self):
+        self.in_flight = 0
+        self.requests = TokenBucket(settings.TENANT_RPM) if settings.TENANT_RPM > 0 else None
+        self.tokens = TokenBucket(settings.TENANT_TPM) if settings.TENANT_TPM > 0 else None
+
+
+class LocalBackend:
+    """Tenant limits kept in this worker process."""
+
+    def __init__(self):
+        self._tenants: Dict[int, _TenantState] = {}
+
+    def _state(self, tenant: int) -> _TenantState:
+        state = self._tenants.get(tenant)
+        if state is None:
+            state = self._tenants[tenant] = _TenantState()
+        return state
+
+    async def try_acquire(self, tenant: int, tokens: int) -> float:
+        """Take a slot and budget, returning 0, or return the seconds to wait."""
+        state = self._state(tenant)
+        if state.in_flight >= settings.TENANT_MAX_CONCURRENCY:
+            return _SLOT_POLL_SECONDS
+        wait = max(
+            state.requests.wait_time(1) if state.requests else 0.0,
+            state.tokens.wait_time(tokens) if state.tokens else 0.0
+        )
+        if wait > 0:
+            return wait
+        if state.requests:
+            state.requests.take(1)
+        if state.tokens:
+            state.tokens.take(tokens)
+        state.in_flight += 1
+        return 0.0
+
+    async def release(self, tenant: int) -> None:
+        state = self._state(tenant)
+        state.in_flight = max(0, state.in_flight - 1)
+
+    async def charge(self, tenant: int, tokens: int) -> None:
+        """Charge tokens only known after admission; the debt delays later requests."""
+        state = self._state(tenant)
+        if state.tokens:
+            state.tokens.take(tokens)
+
+    def snapshot(self) -> dict:
+        return {
+            "backend": "local",
+            "tenants": len(self._tenants),
+            "tenants_in_flight": sum(1 for s in self._tenants.values() if s.in_flight)
+        }
+
+
+# Token buckets are hashes {level, ts}; refill uses the Redis clock so all
+# workers agree on time
+_REDIS_REFILL = """
+local now_parts = redis.call('TIME')
+local now = tonumber(now_parts[1]) + tonumber(now_parts[2]) / 1000000
+local function refill(key, rate)
+    if rate <= 0 then return nil end
+    local v = redis.call('HMGET', key, 'level', 'ts')
+    local level = tonumber(v[1]) or rate
+    local ts = tonumber(v[2]) or now
+    return math.min(rate, level + (now - ts) * rate / 60)
+end
+local function store(key, level)
+    redis.call('HSET', key, 'level', level, 'ts', now)
+    redis.call('EXPIRE', key, 120)
+end
+"""
+
+# KEYS: in-flight counter, request bucket, token bucket
+# ARGV: max concurrency, rpm, tpm, tokens, lease seconds, slot poll seconds
+_REDIS_ACQUIRE = _REDIS_REFILL + """
+local max_conc, rpm, tpm = tonumber(ARGV[1]), tonumber(ARGV[2]), tonumber(ARGV[3])
+local tokens = tonumber(ARGV[4])
+if tonumber(redis.call('GET', KEYS[1]) or '0') >= max_conc then return ARGV[6] end
+local requests = refill(KEYS[2], rpm)
+local budget = refill(KEYS[3], tpm)
+local wait = 0
+if requests and requests < 1 then wait = math.max(wait, (1 - requests) * 60 / rpm) end
+if budget and budget < math.min(tokens, tpm) then
+    wait = math.max(wait, (math.min(tokens, tpm) - budget) * 60 / tpm)
+end
+if wait > 0 then return tostring(wait) end
+if requests then store(KEYS[2], requests - 1) end
+if budget then store(KEYS[3], budget - tokens) end
+redis.call('INCR', KEYS[1])
+redis.call('EXPIRE', KEYS[1], ARGV[5])
+return '0'
+"""
+
+_REDIS_RELEASE = """
+if tonumber(redis.call('GET', KEYS[1]) or '0') > 0 then redis.call('DECR', KEYS[1]) end
+"""
+
+_REDIS_CHARGE = _REDIS_REFILL + """
+local budget = refill(KEYS[1], tonumber(ARGV[1]))
+if budget then store(KEYS[1], budget - tonumber(ARGV[2])) end
+"""
+
+
+class RedisBackend:
+    """
+    Tenant limits shared across worker processes through Redis.
+
+    In-flight counters carry a lease (OPENAI_REQUEST_DEADLINE_SECONDS x 2)
+    so slots held by a crashed worker are eventually freed.
+    """
+
+    def __init__(self, url: str):
+        import redis.asyncio as redis  # optional dependency, only needed for a shared backend
+
+        self._redis = redis.from_url(url)
+        self._acquire = self._redis.register_script(_REDIS_ACQUIRE)
+        self._release = self._redis.register_script(_REDIS_RELEASE)
+        self._charge = self._redis.register_script(_REDIS_CHARGE)
+        self._lease = int(settings.OPENAI_REQUEST_DEADLINE_SECONDS * 2)
+
+    @staticmethod
+    def _keys(tenant: int) -> list:
+        return [f"fair_share:{tenant}:{name}" for name in ("in_flight", "requests", "tokens")]
+
+    async def try_acquire(self, tenant: int, tokens: int) -> float:
+        wait = await self._acquire(keys=self._keys(tenant), args=[
+            settings.TENANT_MAX_CONCURRENCY, settings.TENANT_RPM, settings.TENANT_TPM,
+            tokens, self._lease, _SLOT_POLL_SECONDS
+        ])
+        return float(wait)
+
+    async def release(self, tenant: int) -> None:
+        await self._release(keys=self._keys(tenant)[:1])
+
+    async def charge(self, tenant: int, tokens: int) -> None:
+        await self._charge(keys=self._keys(tenant)[2:], args=[settings.TENANT_TPM, tokens])
+
+    def snapshot(self) -> dict:
+        return {"backend": "redis"}
+
+
+class TenantLimiter:
+    """Admits or rejects a tenant's expensive operations."""
+
+    def __init__(self, backend):
+        self.backend = backend
+        self.stats = {"admitted": 0, "queued": 0, "rejected": 0, "queued_seconds": 0.0}
+
+    async def acquire(self, tenant: int, tokens: int = 0) -> None:
+        """
+        Take a slot for one operation, waiting up to TENANT_QUEUE_SECONDS.
+
+        Args:
+            tenant: The user id
+            tokens: Estimated OpenAI tokens the operation will use
+
+        Raises:
+            TenantRateLimited: If the tenant is still over its limits at the deadline
+        """
+        started = time.monotonic()
+        deadline = started + settings.TENANT_QUEUE_SECONDS
+        queued = False
+        while True:
+            wait = await self.backend.try_acquire(tenant, tokens)
+            now = time.monotonic()
+            if wait <= 0:
+                self.stats["admitted"] += 1
+                self.stats["queued_seconds"] += now - started
+                return
+            if now + wait > deadline:
+                self.stats["rejected"] += 1
+                raise TenantRateLimited(wait)
+            if not queued:
+                self.stats["queued"] += 1
+                queued = True
+            await asyncio.sleep(wait)
+
+    async def release(self, tenant: int) -> None:
+        await self.backend.release(tenant)
+
+    async def charge(self, tenant: int, tokens: int) -> None:
+        await self.backend.charge(tenant, tokens)
+
+    @asynccontextmanager
+    async def slot(self, tenant: int, tokens: int = 0):
+        """Hold a tenant slot for the duration of the block."""
+        await self.acquire(tenant, tokens)
+        try:
+            yield
+        finally:
+            await self.release(tenant)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "queued_seconds": round(self.stats["queued_seconds"], 3),
+            **self.backend.snapshot()
+        }
+
+
+def _make_backend():
+    if settings.FAIR_SHARE_REDIS_URL:
+        return RedisBackend(settings.FAIR_SHARE_REDIS_URL)
+    return LocalBackend()
+
+
+limiter = TenantLimiter(_make_backend())
@@ -0,0 +1,75 @@
+"""
+Ingestion module - parse, chunk and embed a stored PDF.
+
+Used inline by the upload endpoint (INGESTION_MODE=inline) and by the
+'ingest_document' job of the background workers (INGESTION_MODE=queue,
+see app/worker.py).
+"""
+from sqlalchemy import delete, select
+
+from app import fair_share, metrics
+from app.chunking import chunk_text
+from app.db import get_batch_db_context
+from app.lanes import BATCH, run_in_lane
+from app.models import Chunk, Document
+from app.openai_client import get_embeddings_batch
+from app.pdf_utils import extract_text_from_pdf
+from app.rate_limit import estimate_tokens
+from app.s3_utils import download_pdf_from_s3
+
+INGEST_JOB = "ingest_document"
+
+
+async def ingest_document(doc_id: int, user_id: int, file_bytes: bytes) -> int:
+    """
+    Extract, chunk and embed a PDF and store its chunks.
+
+    Parsing and chunking run in the batch lane (app/lanes.py) and chunks are
+    written through the batch DB pool. Existing chunks of the document are
+    replaced in the same transaction, so running this twice is harmless.
+
+    Args:
+        doc_id: The document the chunks belong to
+        user_id: The owner, charged for the embedding tokens
+        file_bytes: The PDF content
+
+    Returns:
+        Number of chunks stored
+    """
+    with metrics.stage("pdf_extract"):
+        text = await run_in_lane(BATCH, extract_text_from_pdf, file_bytes)
+    with metrics.stage("chunking"):
+        chunks = await run_in_lane(BATCH, chunk_text, text)
+    if not chunks:
+        return 0
+
+    # Get embeddings in batch, charging the tokens to the tenant's budget
+    await fair_share.limiter.charge(user_id, sum(estimate_tokens(c) for c in chunks))
+    embeddings = await get_embeddings_batch(chunks, tenant=user_id)
+
+    with metrics.stage("db_write"):
+        async with get_batch_db_context() as db:
+            await db.execute(delete(Chunk).where(Chunk.document_id == doc_id))
+            db.add_all([
+                Chunk(document_id=doc_id, user_id=user_id, content=content, embedding=embedding)
+                for content, embedding in zip(chunks, embeddings)
+            ])
+    return len(chunks)
+
+
+async def run_ingest_job(payload: dict) -> None:
+    """
+    Job handler: ingest a document from its stored PDF.
+
+    A document deleted before the job ran is skipped.
+    """
+    async with get_batch_db_context() as db:
+        doc = (await db.execute(
+            select(Document.id, Document.user_id, Document.s3_key)
+            .where(Document.id == payload["document_id"])
+        )).first()
+    if doc is None:
+        return
+
+    file_bytes = await download_pdf_from_s3(doc.s3_key)
+    await ingest_document(doc.id, doc.user_id, file_bytes)
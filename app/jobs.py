@@ -0,0 +1,209 @@
+"""
+Jobs module - durable Postgres-backed work queue.
+
+Jobs are rows in the jobs table, enqueued in the same transaction as the
+data they refer to. Workers (python -m app.worker) claim them one at a time
+with SELECT ... FOR UPDATE SKIP LOCKED, so any number of worker processes
+can consume the queue without contention or double delivery.
+
+A claimed job holds a lease of JOB_LEASE_SECONDS that its worker renews
+with heartbeats. If the worker dies, the lease expires and another worker
+picks the job up again. A failed job is retried with exponential backoff
+(JOB_RETRY_BASE_SECONDS x 2^(attempt - 1)) until it has used
+max_attempts, then it is parked in the 'dead' state for inspection.
+
+Handlers must be idempotent: a job whose worker lost its lease can run
+twice.
+"""
+from datetime import datetime, timedelta
+from typing import Any, Dict, List, NamedTuple, Optional
+
+from sqlalchemy import and_, delete, func, or_, select, update
+from sqlalchemy.ext.asyncio import AsyncSession
+
+from app.config import settings
+from app.db import get_batch_db_context
+from app.models import Job
+
+QUEUED, RUNNING, DONE, DEAD = "queued", "running", "done", "dead"
+
+# Longest delay between retries of a failing job
+_MAX_RETRY_SECONDS = 3600
+
+
+class ClaimedJob(NamedTuple):
+    id: int
+    kind: str
+    payload: Dict[str, Any]
+    attempts: int  # including this one
+    max_attempts: int
+
+
+async def enqueue(
+    db: AsyncSession,
+    kind: str,
+    payload: Dict[str, Any],
+    user_id: Optional[int] = None,
+    max_attempts: Optional[int] = None
+) -> int:
+    """
+    Add a job as part of the caller's transaction.
+
+    Args:
+        db: The session whose commit makes the job visible to workers
+        kind: Handler name (see app/worker.py)
+        payload: JSON-serializable handler arguments
+        user_id: Owning tenant, if any (the job goes with a purged user)
+        max_attempts: Defaults to JOB_MAX_ATTEMPTS
+
+    Returns:
+        The job id
+    """
+    job = Job(
+        kind=kind,
+        payload=payload,
+        user_id=user_id,
+        max_attempts=max_attempts or settings.JOB_MAX_ATTEMPTS
+    )
+    db.add(job)
+    await db.flush()
+    return job.id
+
+
+async def claim(worker_id: str, kinds: List[str]) -> Optional[ClaimedJob]:
+    """
+    Lease the next due job: a queued job whose run_at has passed, or a
+    running job whose worker let its lease expire.
+
+    Returns:
+        The claimed job, or None if there is nothing to do
+    """
+    now = datetime.utcnow()
+    candidate = (
+        select(Job.id)
+        .where(Job.kind.in_(kinds), or_(
+            and_(Job.status == QUEUED, Job.run_at <= now),
+            and_(Job.status == RUNNING, Job.lease_expires_at < now)
+        ))
+        .order_by(Job.run_at)
+        .limit(1)
+        .with_for_update(skip_locked=True)
+        .scalar_subquery()
+    )
+    async with get_batch_db_context() as db:
+        row = (await db.execute(
+            update(Job)
+            .where(Job.id == candidate)
+            .values(
+                status=RUNNING,
+                locked_by=worker_id,
+                lease_expires_at=now + timedelta(seconds=settings.JOB_LEASE_SECONDS),
+                attempts=Job.attempts + 1
+            )
+            .returning(Job.id, Job.kind, Job.payload, Job.attempts, Job.max_attempts)
+        )).first()
+    return ClaimedJob(*row) if row else None
+
+
+async def heartbeat(job_id: int, worker_id: str) -> bool:
+    """
+    Extend a running job's lease.
+
+    Returns:
+        False if the lease was lost (expired and claimed by another worker)
+    """
+    async with get_batch_db_context() as db:
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == RUNNING)
+            .values(lease_expires_at=datetime.utcnow() + timedelta(seconds=settings.JOB_LEASE_SECONDS))
+        )
+    return result.rowcount == 1
+
+
+async def complete(job_id: int, worker_id: str) -> bool:
+    """Mark a job done; False if this worker no longer holds its lease."""
+    async with get_batch_db_context() as db:
+        result = await db.execute(
+            update(Job)
+            .where(Job.id == job_id, Job.locked_by == worker_id, Job.status == RUNNING)
+            .values(status=DONE, finished_at=datetime.utcnow(), lease_expires_at=None)
+        )
+    return result.rowcount == 1
+
+
+def retry_delay(attempts: int) -> float:
+    """Seconds to wait before the next attempt, after `attempts` failures."""
+    return min(settings.JOB_RETRY_BASE_SECONDS * 2 ** (attempts - 1), _MAX_RETRY_SECONDS)
+
+
+async def fail(job: ClaimedJob, worker_id: str, error: str) -> str:
+    """
+    Record a failed attempt: schedule a retry, or park the job as dead once
+    it has used all its attempts.
+
+    Returns:
+        The job's new status
+    """
+    now = datetime.utcnow()
+    if job.attempts >= job.max_attempts:
+        values = {"status": DEAD, "finished_at": now}
+    else:
+        values = {"status": QUEUED, "run_at": now + timedelta(seconds=retry_delay(job.attempts))}
+    async with get_batch_db_context() as db:
+        await db.execute(
+            update(Job)
+            .where(Job.id == job.id, Job.locked_by == worker_id, Job.status == RUNNING)
+            .values(**values, locked_by=None, lease_expires_at=None, last_error=error[:2000])
+        )
+    return values["status"]
+
+
+async def prune_finished() -> int:
+    """
+    Delete jobs done more than JOB_RETENTION_HOURS ago, in batches of
+    DELETE_BATCH_SIZE. Dead jobs are kept for inspection.
+
+    Returns:
+        Number of jobs deleted
+    """
+    cutoff = datetime.utcnow() - timedelta(hours=settings.JOB_RETENTION_HOURS)
+    total = 0
+    while True:
+        ids = (
+            select(Job.id)
+            .where(Job.status == DONE, Job.finished_at < cutoff)
+            .limit(settings.DELETE_BATCH_SIZE)
+        )
+        async with get_batch_db_context() as db:
+            deleted = (await db.execute(delete(Job).where(Job.id.in_(ids)))).rowcount
+        total += deleted
+        if deleted < settings.DELETE_BATCH_SIZE:
+            return total
+
+
+async def queue_stats() -> dict:
+    """Jobs by status, age of the oldest due job and recent throughput."""
+    now = datetime.utcnow()
+    async with get_batch_db_context() as db:
+        by_status = dict((await db.execute(
+            select(Job.status, func.count()).group_by(Job.status)
+        )).all())
+        oldest_due = await db.scalar(
+            select(func.min(Job.run_at)).where(Job.status == QUEUED, Job.run_at <= now)
+        )
+        done_1m, done_5m = (await db.execute(select(
+            func.count().filter(Job.finished_at >= now - timedelta(minutes=1)),
+            func.count().filter(Job.finished_at >= now - timedelta(minutes=5))
+        ).where(Job.status == DONE))).one()
+    return {
+        "by_status": {s: by_status.get(s, 0) for s in (QUEUED, RUNNING, DONE, DEAD)},
+        "oldest_due_seconds": round((now - oldest_due).total_seconds(), 1) if oldest_due else 0.0,
+        "done_last_minute": done_1m,
+        "done_per_minute_5m": round(done_5m / 5, 1)
+    }
+
+
+async def get_job(db: AsyncSession, job_id: int, user_id: int) -> Optional[Job]:
+    """A tenant's job, or None if it does not exist or belongs to someone else."""
+    return await db.scalar(select(Job).where(Job.id == job_id, Job.user_id == user_id))
@@ -0,0 +1,131 @@
+"""
+Execution lanes - keep batch ingestion from starving interactive chat.
+
+Work is tagged with a lane:
+- interactive: query embeddings and chat completions for a waiting user
+- batch: document embeddings, PDF parsing/chunking and re-indexing
+
+Each lane has its own OpenAI concurrency cap (enforced by app/rate_limit.py,
+which also gives interactive work strict priority for upstream capacity),
+its own thread pool for CPU-bound work and, for batch, its own DB pool
+(app/db.py). Queue depth, in-flight count and wait time are recorded per
+lane, both for upstream OpenAI slots and for the worker pool, and exported
+as rag_lane_* metrics.
+"""
+import asyncio
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+from functools import partial
+from typing import Any, Callable, Dict
+
+from app import profiler
+from app.config import settings
+
+INTERACTIVE = "interactive"
+BATCH = "batch"
+
+
+class Lane:
+    """Limits, worker pool and wait statistics for one lane."""
+
+    def __init__(self, name: str, max_concurrency: int, worker_threads: int):
+        self.name = name
+        self.max_concurrency = max_concurrency
+        self.executor = ThreadPoolExecutor(
+            max_workers=worker_threads, thread_name_prefix=f"{name}-lane"
+        )
+        # Upstream OpenAI slots (maintained by app/rate_limit.py, on the event loop)
+        self.waiting = 0
+        self.in_flight = 0
+        self.waits = 0
+        self.wait_total = 0.0
+        self.wait_max = 0.0
+        # Worker pool: submitted on the event loop, started/finished on worker threads
+        self._worker_lock = threading.Lock()
+        self.submitted = 0
+        self.started = 0
+        self.finished = 0
+        self.cancelled = 0  # cancelled before a worker picked them up
+        self.worker_wait_total = 0.0
+
+    def record_wait(self, seconds: float) -> None:
+        self.waits += 1
+        self.wait_total += seconds
+        self.wait_max = max(self.wait_max, seconds)
+
+    def _worker_started(self, waited: float) -> None:
+        with self._worker_lock:
+            self.started += 1
+            self.worker_wait_total += waited
+
+    def _worker_finished(self) -> None:
+        with self._worker_lock:
+            self.finished += 1
+
+    @property
+    def worker_queue_depth(self) -> int:
+        return self.submitted - self.started - self.cancelled
+
+    @property
+    def worker_in_flight(self) -> int:
+        return self.started - self.finished
+
+    def snapshot(self) -> dict:
+        return {
+            "max_concurrency": self.max_concurrency,
+            "upstream_queue_depth": self.waiting,
+            "upstream_in_flight": self.in_flight,
+            "worker_queue_depth": self.worker_queue_depth,
+            "worker_in_flight": self.worker_in_flight,
+            "waits": self.waits,
+            "wait_avg_ms": round(self.wait_total / max(self.waits, 1) * 1000, 3),
+            "wait_max_ms": round(self.wait_max * 1000, 3),
+            "worker_wait_avg_ms": round(self.worker_wait_total / max(self.started, 1) * 1000, 3)
+        }
+
+
+LANES: Dict[str, Lane] = {
+    INTERACTIVE: Lane(
+        INTERACTIVE,
+        settings.OPENAI_INTERACTIVE_MAX_CONCURRENCY,
+        settings.INTERACTIVE_WORKER_THREADS
+    ),
+    BATCH: Lane(
+        BATCH,
+        settings.OPENAI_BATCH_MAX_CONCURRENCY,
+        settings.BATCH_WORKER_THREADS
+    ),
+}
+
+
+async def run_in_lane(lane: str, fn: Callable[..., Any], *args: Any, **kwargs: Any) -> Any:
+    """Run blocking/CPU-bound work on the lane's own thread pool."""
+    loop = asyncio.get_running_loop()
+    call = partial(fn, *args, **kwargs)
+    if settings.PROFILING_ENABLED:
+        # Sample the worker thread into the request's profile, if it has one
+        call = profiler.bind_to_request(call)
+    pool = LANES[lane]
+    submitted = time.perf_counter()
+
+    def work():
+        pool._worker_started(time.perf_counter() - submitted)
+        try:
+            return call()
+        finally:
+            pool._worker_finished()
+
+    pool.submitted += 1
+    future = pool.executor.submit(work)
+    try:
+        return await asyncio.wrap_future(future, loop=loop)
+    except asyncio.CancelledError:
+        # Cancelling the awaiting task cancels the work too if it has not started
+        if future.cancelled():
+            pool.cancelled += 1
+        raise
+
+
+def lane_stats() -> Dict[str, dict]:
+    return {name: lane.snapshot() for name, lane in LANES.items()}
@@ -1,40 +1,90 @@
 """
 Main FastAPI application with all endpoints.
 """
+import asyncio
+import json
+import math
 from contextlib import asynccontextmanager
 from typing import List, Optional
 
-from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request
-from fastapi.responses import JSONResponse
+from fastapi import FastAPI, Depends, HTTPException, status, UploadFile, File, Request, Response, Query
+from fastapi.responses import JSONResponse, PlainTextResponse, StreamingResponse
+from openai import APIError
 from pydantic import BaseModel, EmailStr
-from sqlalchemy.orm import Session
+from sqlalchemy import select, tuple_
+from sqlalchemy.ext.asyncio import AsyncSession
 
 from app.config import settings
-from app.db import get_db, init_db
-from app.models import User, Document, Chunk, ChatSession, ChatMessage
+from app.db import (
+    async_engine, batch_engine, batch_pool_metrics, get_async_db_context,
+    get_db, init_db, pool_metrics
+)
+from app.models import User, Document, ChatSession, ChatMessage
 from app.security import (
-    hash_password,
-    verify_password,
+    hash_password_async,
+    verify_password_async,
+    password_pool,
+    PasswordHasherBusy,
     create_access_token,
-    get_current_user
+    get_current_user,
+    get_current_reader,
+    get_current_admin,
+    authenticate,
+    is_admin,
+    principal_cache,
+    Principal
+)
+from app.s3_utils import upload_pdf_to_s3, get_pdf_presigned_url
+from app.ingestion import INGEST_JOB, ingest_document
+from app.openai_client import get_embedding, chat_completion, chat_completion_stream
+from app.rag import retrieve_chunks, build_rag_prompt
+from app.rate_limit import estimate_tokens
+from app.pagination import decode_cursor, finish_page, make_etag, not_modified
+from app import (
+    chat_store, deletion, fair_share, jobs, metrics, openai_client, profiler, rate_limit, tracing, vector_index
 )
-from app.s3_utils import upload_pdf_to_s3, get_pdf_presigned_url, delete_pdf_from_s3
-from app.pdf_utils import extract_text_from_pdf
-from app.chunking import chunk_text
-from app.openai_client import get_embedding, get_embeddings_batch, chat_completion
-from app.rag import retrieve_context, build_rag_prompt
+from app.slow_queries import slow_query_log
+from app.chat_store import ChatExchange, chat_writer
+from app.deletion import s3_cleaner
+from app.fair_share import TenantRateLimited
+from app.lanes import BATCH, LANES, lane_stats, run_in_lane
 
 
 # =============================================================================
 # Lifespan
 # =============================================================================
 
+async def vector_index_maintenance_loop():
+    """Periodically build/rebuild vector indexes as the data drifts."""
+    while True:
+        try:
+            actions = await run_in_lane(BATCH, vector_index.maintain)
+            for action in actions:
+                print(f"Vector index maintenance: {action}")
+        except Exception as e:
+            print(f"Vector index maintenance failed: {e}")
+        await asyncio.sleep(settings.VECTOR_INDEX_CHECK_SECONDS)
+
+
 @asynccontextmanager
 async def lifespan(app: FastAPI):
     """Application lifespan - initialize DB on startup."""
     init_db()
+    password_pool.start()
+    chat_writer.start()
+    s3_cleaner.start()
+    profiler.sampler.start_rolling()
+    maintenance_task = asyncio.create_task(vector_index_maintenance_loop())
     print("FastAPI Server is starting up!")
     yield
+    maintenance_task.cancel()
+    s3_cleaner.stop()
+    profiler.sampler.stop()
+    await chat_writer.stop()
+    await async_engine.dispose()
+    await batch_engine.dispose()
+    password_pool.shutdown()
+    tracing.exporter.flush()
     print("FastAPI Server is shutting down!")
 
 
@@ -70,6 +120,69 @@ async def api_gateway_protection(request: Request, call_next):
     return response
 
 
+# Per-request latency and Server-Timing (around the app, so it times everything),
+# then the request's root span; tracing costs nothing unless enabled
+if settings.TRACING_ENABLED:
+    app.add_middleware(tracing.TracingMiddleware)
+app.add_middleware(metrics.MetricsMiddleware)
+
+
+async def _may_profile(token: str) -> bool:
+    principal = await authenticate(token)
+    return principal is not None and is_admin(principal)
+
+
+# Admin-requested profiles (X-Profile) wrap everything else; the middleware
+# is not installed at all unless profiling is enabled
+if settings.PROFILING_ENABLED:
+    app.add_middleware(profiler.ProfilerMiddleware, authorize=_may_profile)
+
+
+# =============================================================================
+# Upstream Errors
+# =============================================================================
+
+@app.exception_handler(TimeoutError)
+async def upstream_timeout_handler(request: Request, exc: TimeoutError):
+    """OpenAI capacity did not free up before the request's deadline."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Upstream model capacity exhausted, please retry"},
+        headers={"Retry-After": str(int(settings.OPENAI_RETRY_MAX_SECONDS))}
+    )
+
+
+@app.exception_handler(APIError)
+async def upstream_error_handler(request: Request, exc: APIError):
+    """OpenAI kept failing after retries."""
+    print(f"OpenAI error: {exc}")
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Upstream model unavailable, please retry"},
+        headers={"Retry-After": str(int(settings.OPENAI_RETRY_MAX_SECONDS))}
+    )
+
+
+@app.exception_handler(TenantRateLimited)
+async def tenant_rate_limited_handler(request: Request, exc: TenantRateLimited):
+    """The user is over their fair share of expensive operations."""
+    return JSONResponse(
+        status_code=status.HTTP_429_TOO_MANY_REQUESTS,
+        content={"detail": "Too many requests, please retry later"},
+        headers={"Retry-After": str(max(1, math.ceil(exc.retry_after)))}
+    )
+
+
+@app.exception_handler(PasswordHasherBusy)
+async def password_hasher_busy_handler(request: Request, exc: PasswordHasherBusy):
+    """Login/register storm: shed load instead of queueing bcrypt work."""
+    return JSONResponse(
+        status_code=status.HTTP_503_SERVICE_UNAVAILABLE,
+        content={"detail": "Too many sign-ins in progress, please retry"},
+        headers={"Retry-After": "1"}
+    )
+
+
 # =============================================================================
 # Pydantic Schemas
 # =============================================================================
@@ -94,6 +207,7 @@ class DocumentResponse(BaseModel):
     filename: str
     s3_key: str
     created_at: str
+    job_id: Optional[int] = None  # set when ingestion was queued for the workers
 
     class Config:
         from_attributes = True
@@ -129,45 +243,53 @@ class MessageResponse(BaseModel):
         from_attributes = True
 
 
+class JobResponse(BaseModel):
+    id: int
+    kind: str
+    status: str
+    attempts: int
+    last_error: Optional[str] = None
+    finished_at: Optional[str] = None
+
+
 # =============================================================================
 # Auth Routes (IDE-4)
 # =============================================================================
 
 @app.post("/auth/register", response_model=TokenResponse, tags=["Auth"])
-def register(user_data: UserRegister, db: Session = Depends(get_db)):
+async def register(user_data: UserRegister, db: AsyncSession = Depends(get_db)):
     """Register a new user account."""
     # Check if email already exists
-    existing = db.query(User).filter(User.email == user_data.email).first()
+    existing = await db.scalar(select(User).where(User.email == user_data.email))
     if existing:
         raise HTTPException(
             status_code=status.HTTP_400_BAD_REQUEST,
             detail="Email already registered"
         )
     
-    # Create new user with hashed password
-    hashed_pw = hash_password(user_data.password)
+    # Create new user with hashed password (bcrypt runs in its own process pool)
+    hashed_pw = await hash_password_async(user_data.password)
     new_user = User(email=user_data.email, hashed_password=hashed_pw)
     db.add(new_user)
-    db.commit()
-    db.refresh(new_user)
+    await db.commit()
     
     # Generate token
-    token = create_access_token(new_user.id)
+    token = create_access_token(new_user.id, email=new_user.email)
     return TokenResponse(access_token=token)
 
 
 @app.post("/auth/login", response_model=TokenResponse, tags=["Auth"])
-def login(user_data: UserLogin, db: Session = Depends(get_db)):
+async def login(user_data: UserLogin, db: AsyncSession = Depends(get_db)):
     """Login with email and password."""
-    user = db.query(User).filter(User.email == user_data.email).first()
+    user = await db.scalar(select(User).where(User.email == user_data.email))
     
-    if not user or not verify_password(user_data.password, user.hashed_password):
+    if not user or not await verify_password_async(user_data.password, user.hashed_password):
         raise HTTPException(
             status_code=status.HTTP_401_UNAUTHORIZED,
             detail="Invalid email or password"
         )
     
-    token = create_access_token(user.id)
+    token = create_access_token(user.id, email=user.email)
     return TokenResponse(access_token=token)
 
 
@@ -176,15 +298,20 @@ def login(user_data: UserLogin, db: Session = Depends(get_db)):
 # =============================================================================
 
 @app.post("/documents/upload", response_model=DocumentResponse, tags=["Documents"])
-def upload_document(
+async def upload_document(
     file: UploadFile = File(...),
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Upload a PDF document.
     The document is stored in S3 and chunked for RAG retrieval.
     Multi-tenancy: Document is owned by the current user.
+    
+    Parsing, chunking and embedding run in the batch lane (app/lanes.py) and
+    chunks are written through the batch DB pool, so large uploads do not
+    slow down concurrent chat requests. With INGESTION_MODE=queue they run
+    in the background workers instead (app/worker.py): the response returns
+    as soon as the PDF is stored, with a job_id to poll at /jobs/{job_id}.
     """
     if not file.filename.lower().endswith(".pdf"):
         raise HTTPException(
@@ -192,64 +319,95 @@ def upload_document(
             detail="Only PDF files are allowed"
         )
     
+    async with fair_share.limiter.slot(current_user.id):
+        return await ingest_upload(file, current_user)
+
+
+async def ingest_upload(file: UploadFile, current_user: Principal) -> DocumentResponse:
+    """Store an uploaded PDF, then ingest it inline or hand it to the workers."""
     # Read file content
-    file_bytes = file.file.read()
+    file_bytes = await file.read()
     
     # Upload to S3
-    s3_key = upload_pdf_to_s3(file_bytes, file.filename, current_user.id)
-    
-    # Create document record
-    doc = Document(
-        user_id=current_user.id,
-        filename=file.filename,
-        s3_key=s3_key
-    )
-    db.add(doc)
-    db.commit()
-    db.refresh(doc)
+    s3_key = await upload_pdf_to_s3(file_bytes, file.filename, current_user.id)
     
-    # Extract text and chunk
-    try:
-        text = extract_text_from_pdf(file_bytes)
-        chunks = chunk_text(text)
-        
-        # Get embeddings in batch
-        if chunks:
-            embeddings = get_embeddings_batch(chunks)
-            
-            # Create chunk records with embeddings
-            for content, embedding in zip(chunks, embeddings):
-                chunk_record = Chunk(
-                    document_id=doc.id,
-                    user_id=current_user.id,
-                    content=content,
-                    embedding=embedding
-                )
-                db.add(chunk_record)
-            
-            db.commit()
-    except Exception as e:
-        # Log error but don't fail - document is still uploaded
-        print(f"Error processing PDF: {e}")
+    # Create document record (and its ingestion job, in the same transaction)
+    job_id = None
+    async with get_async_db_context() as db:
+        doc = Document(
+            user_id=current_user.id,
+            filename=file.filename,
+            s3_key=s3_key
+        )
+        db.add(doc)
+        await db.flush()
+        if settings.INGESTION_MODE == "queue":
+            job_id = await jobs.enqueue(db, INGEST_JOB, {"document_id": doc.id}, user_id=current_user.id)
     
-    return DocumentResponse(
+    response = DocumentResponse(
         id=doc.id,
         filename=doc.filename,
         s3_key=doc.s3_key,
-        created_at=doc.created_at.isoformat()
+        created_at=doc.created_at.isoformat(),
+        job_id=job_id
+    )
+    
+    if job_id is None:
+        try:
+            await ingest_document(doc.id, current_user.id, file_bytes)
+        except Exception as e:
+            # Log error but don't fail - document is still uploaded
+            print(f"Error processing PDF: {e}")
+    
+    return response
+
+
+@app.get("/jobs/{job_id}", response_model=JobResponse, tags=["Documents"])
+async def get_job_status(
+    job_id: int,
+    current_user: Principal = Depends(get_current_reader),
+    db: AsyncSession = Depends(get_db)
+):
+    """
+    Get the status of a background job, e.g. a queued document ingestion
+    (queued, running, done or dead).
+    Multi-tenancy: Only visible to the user who owns the job.
+    """
+    job = await jobs.get_job(db, job_id, current_user.id)
+    if not job:
+        raise HTTPException(status_code=404, detail="Job not found")
+    return JobResponse(
+        id=job.id,
+        kind=job.kind,
+        status=job.status,
+        attempts=job.attempts,
+        last_error=job.last_error,
+        finished_at=job.finished_at.isoformat() if job.finished_at else None
     )
 
 
 @app.get("/documents", response_model=List[DocumentResponse], tags=["Documents"])
-def list_documents(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def list_documents(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: Principal = Depends(get_current_reader),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    List all documents for the current user.
+    List the current user's documents, newest first, one page at a time.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
     Multi-tenancy: Only returns documents owned by the current user.
     """
-    docs = db.query(Document).filter(Document.user_id == current_user.id).all()
+    query = (
+        select(Document.id, Document.filename, Document.s3_key, Document.created_at)
+        .where(Document.user_id == current_user.id)
+        .order_by(Document.created_at.desc(), Document.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(Document.created_at, Document.id) < decode_cursor(cursor))
+    docs = finish_page((await db.execute(query)).all(), limit, response)
     return [
         DocumentResponse(
             id=d.id,
@@ -262,51 +420,42 @@ def list_documents(
 
 
 @app.get("/documents/{doc_id}", tags=["Documents"])
-def get_document(
+async def get_document(
     doc_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_reader),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Get a document's download URL.
     Multi-tenancy: Only accessible if owned by current user.
     """
-    doc = db.query(Document).filter(
+    doc = await db.scalar(select(Document).where(
         Document.id == doc_id,
         Document.user_id == current_user.id  # Multi-tenancy check
-    ).first()
+    ))
     
     if not doc:
         raise HTTPException(status_code=404, detail="Document not found")
     
-    url = get_pdf_presigned_url(doc.s3_key)
+    url = await get_pdf_presigned_url(doc.s3_key)
     return {"id": doc.id, "filename": doc.filename, "download_url": url}
 
 
 @app.delete("/documents/{doc_id}", tags=["Documents"])
-def delete_document(
+async def delete_document(
     doc_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a document and its chunks.
+    The PDF is removed from S3 in the background (see app/deletion.py).
     Multi-tenancy: Only deletable if owned by current user.
     """
-    doc = db.query(Document).filter(
-        Document.id == doc_id,
-        Document.user_id == current_user.id  # Multi-tenancy check
-    ).first()
-    
-    if not doc:
+    # One DELETE (cascades to chunks in the database) plus the S3 cleanup entry
+    if not await deletion.delete_document(db, doc_id, current_user.id):
         raise HTTPException(status_code=404, detail="Document not found")
-    
-    # Delete from S3
-    delete_pdf_from_s3(doc.s3_key)
-    
-    # Delete from DB (cascades to chunks)
-    db.delete(doc)
-    db.commit()
+    await db.commit()
     
     return {"message": "Document deleted"}
 
@@ -315,71 +464,227 @@ def delete_document(
 # Chat Routes (IDE-6 Multi-tenancy)
 # =============================================================================
 
+CHAT_MAX_TOKENS = 1024
+
+async def prepare_chat(user: Principal, request: ChatRequest):
+    """
+    Embed the query, then check the session (or reserve a new session id)
+    and retrieve context in one short read-only transaction. No DB
+    connection is held while waiting on OpenAI.
+    Multi-tenancy: Raises 404 unless the session is owned by the user.
+    
+    Returns:
+        Tuple of (session_id, whether the session is new, retrieved chunks)
+    """
+    query_embedding = await get_embedding(request.message, tenant=user.id)
+    
+    async with get_async_db_context() as db:
+        if request.session_id:
+            if not await chat_store.session_owned_by(db, request.session_id, user.id):
+                raise HTTPException(status_code=404, detail="Session not found")
+            session_id, is_new = request.session_id, False
+        else:
+            session_id, is_new = await chat_store.reserve_session_id(db), True
+        # Retrieve relevant context (multi-tenancy enforced in rag.py)
+        retrieved = await retrieve_chunks(
+            db, user.id, query_embedding=query_embedding
+        )
+        return session_id, is_new, retrieved
+
+
+async def save_chat_messages(
+    user: Principal,
+    session_id: int,
+    is_new: bool,
+    question: str,
+    answer: str
+):
+    """
+    Persist the exchange (and the session, if new) in one transaction, or
+    queue it when CHAT_WRITE_BEHIND is on.
+    
+    Returns:
+        Tuple of (user_message_id, assistant_message_id); (None, None) when queued
+    """
+    return await chat_store.save_exchange(ChatExchange(
+        session_id=session_id,
+        user_id=user.id,
+        new_session_title=question[:50] if is_new else None,
+        question=question,
+        answer=answer
+    ))
+
+
+def chat_token_estimate(message: str) -> int:
+    """Tokens a chat request is charged up front: question, retrieved context and answer."""
+    context_chars = settings.RETRIEVAL_TOP_K * settings.CHUNK_SIZE
+    return estimate_tokens(message) + context_chars // 4 + CHAT_MAX_TOKENS
+
+
+# Saves of streamed answers whose client went away, kept until they finish
+_background_saves: set = set()
+
+
+def _finish_in_background(save: asyncio.Task) -> None:
+    """Let a chat save outlive its request, logging it if it fails."""
+    def done(task: asyncio.Task) -> None:
+        _background_saves.discard(task)
+        if not task.cancelled() and task.exception() is not None:
+            print(f"Error saving streamed chat messages: {task.exception()}")
+    
+    _background_saves.add(save)
+    save.add_done_callback(done)
+
+
+def sse_event(event: str, data: dict) -> str:
+    """Format a Server-Sent Events message."""
+    return f"event: {event}\ndata: {json.dumps(data)}\n\n"
+
+
 @app.post("/chat", response_model=ChatResponse, tags=["Chat"])
-def chat(
+async def chat(
     request: ChatRequest,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user)
 ):
     """
     Send a chat message and get a RAG-powered response.
     Multi-tenancy: Only retrieves from current user's documents.
+    
+    Runs in three phases so a pooled connection is only held for the DB work:
+    session check + retrieval (read-only), then the LLM call with no
+    connection, then one transaction for the new session and messages.
     """
-    # Get or create session
-    if request.session_id:
-        session = db.query(ChatSession).filter(
-            ChatSession.id == request.session_id,
-            ChatSession.user_id == current_user.id  # Multi-tenancy check
-        ).first()
-        if not session:
-            raise HTTPException(status_code=404, detail="Session not found")
-    else:
-        # Create new session
-        session = ChatSession(user_id=current_user.id, title=request.message[:50])
-        db.add(session)
-        db.commit()
-        db.refresh(session)
-    
-    # Retrieve relevant context (multi-tenancy enforced in rag.py)
-    context_results = retrieve_context(db, current_user.id, request.message)
-    context_chunks = [content for content, _ in context_results]
-    
-    # Build RAG prompt and get response
-    messages = build_rag_prompt(context_chunks, request.message)
-    response_text = chat_completion(messages)
-    
-    # Save messages to session
-    user_msg = ChatMessage(session_id=session.id, role="user", content=request.message)
-    assistant_msg = ChatMessage(session_id=session.id, role="assistant", content=response_text)
-    db.add(user_msg)
-    db.add(assistant_msg)
-    db.commit()
-    
-    # Build sources info
-    sources = [
-        {"content": content[:200], "similarity": round(score, 3)}
-        for content, score in context_results
-    ]
+    async with fair_share.limiter.slot(current_user.id, chat_token_estimate(request.message)):
+        session_id, is_new, retrieved = await prepare_chat(current_user, request)
+        
+        # Build RAG prompt and get response
+        messages = build_rag_prompt([r.content for r in retrieved], request.message)
+        response_text = await chat_completion(
+            messages, max_tokens=CHAT_MAX_TOKENS, tenant=current_user.id
+        )
+        
+        # Save messages to session
+        await save_chat_messages(
+            current_user, session_id, is_new, request.message, response_text
+        )
+    
+    # Build sources info (snippets are cut by the retrieval query)
+    sources = [r.as_source() for r in retrieved]
     
     return ChatResponse(
         response=response_text,
-        session_id=session.id,
+        session_id=session_id,
         sources=sources
     )
 
 
+@app.post("/chat/stream", tags=["Chat"])
+async def chat_stream(
+    request: ChatRequest,
+    current_user: Principal = Depends(get_current_user)
+):
+    """
+    Send a chat message and stream the RAG-powered response as Server-Sent Events.
+    
+    Events, in order:
+        sources: {"session_id", "sources"} - sent as soon as retrieval finishes;
+                 a new session only exists once "done" is sent
+        token:   {"content"} - one per generated text delta
+        done:    {"session_id", "user_message_id", "assistant_message_id"}
+                 (message ids are null when CHAT_WRITE_BEHIND is on)
+        error:   {"detail"} - sent instead of done if generation or saving fails
+    
+    An answer cut short by a client disconnect or a generation error is
+    still saved with the text generated so far, if there is any.
+    
+    Multi-tenancy: Only retrieves from current user's documents.
+    """
+    # Admission and retrieval happen before the response starts so errors
+    # still map to HTTP codes; the tenant slot is held until the stream ends
+    await fair_share.limiter.acquire(current_user.id, chat_token_estimate(request.message))
+    try:
+        session_id, is_new, retrieved = await prepare_chat(current_user, request)
+    except BaseException:
+        await fair_share.limiter.release(current_user.id)
+        raise
+    messages = build_rag_prompt([r.content for r in retrieved], request.message)
+    sources = [r.as_source() for r in retrieved]
+    
+    async def event_stream():
+        parts: List[str] = []
+        saving: Optional[asyncio.Task] = None
+        
+        def save() -> asyncio.Task:
+            # A task, so the save survives the stream being cancelled mid-write
+            return asyncio.create_task(save_chat_messages(
+                current_user, session_id, is_new, request.message, "".join(parts)
+            ))
+        
+        try:
+            yield sse_event("sources", {"session_id": session_id, "sources": sources})
+            
+            try:
+                async for delta in chat_completion_stream(
+                    messages, max_tokens=CHAT_MAX_TOKENS, tenant=current_user.id
+                ):
+                    parts.append(delta)
+                    yield sse_event("token", {"content": delta})
+            except Exception as e:
+                print(f"Error streaming chat completion: {e}")
+                yield sse_event("error", {"detail": "Chat completion failed"})
+                return
+            
+            saving = save()
+            try:
+                user_message_id, assistant_message_id = await asyncio.shield(saving)
+            except asyncio.CancelledError:
+                raise
+            except Exception as e:
+                print(f"Error saving chat messages: {e}")
+                yield sse_event("error", {"detail": "Saving the chat failed"})
+                return
+            yield sse_event("done", {
+                "session_id": session_id,
+                "user_message_id": user_message_id,
+                "assistant_message_id": assistant_message_id
+            })
+        finally:
+            # Keep a partial answer when the client disconnected or generation failed
+            if saving is None and parts:
+                saving = save()
+            if saving is not None and not saving.done():
+                _finish_in_background(saving)
+            await fair_share.limiter.release(current_user.id)
+    
+    return StreamingResponse(
+        event_stream(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"}
+    )
+
+
 @app.get("/chat/sessions", response_model=List[SessionResponse], tags=["Chat"])
-def list_sessions(
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+async def list_sessions(
+    response: Response,
+    cursor: Optional[str] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: Principal = Depends(get_current_reader),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    List all chat sessions for the current user.
+    List the current user's chat sessions, newest first, one page at a time.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
     Multi-tenancy: Only returns sessions owned by current user.
     """
-    sessions = db.query(ChatSession).filter(
-        ChatSession.user_id == current_user.id
-    ).order_by(ChatSession.created_at.desc()).all()
+    query = (
+        select(ChatSession.id, ChatSession.title, ChatSession.created_at)
+        .where(ChatSession.user_id == current_user.id)
+        .order_by(ChatSession.created_at.desc(), ChatSession.id.desc())
+        .limit(limit + 1)
+    )
+    if cursor:
+        query = query.where(tuple_(ChatSession.created_at, ChatSession.id) < decode_cursor(cursor))
+    sessions = finish_page((await db.execute(query)).all(), limit, response)
     
     return [
         SessionResponse(
@@ -392,26 +697,70 @@ def list_sessions(
 
 
 @app.get("/chat/sessions/{session_id}/messages", response_model=List[MessageResponse], tags=["Chat"])
-def get_session_messages(
+async def get_session_messages(
     session_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    request: Request,
+    response: Response,
+    cursor: Optional[str] = None,
+    after: Optional[int] = None,
+    limit: int = Query(settings.PAGE_DEFAULT_LIMIT, ge=1, le=settings.PAGE_MAX_LIMIT),
+    current_user: Principal = Depends(get_current_reader),
+    db: AsyncSession = Depends(get_db)
 ):
     """
-    Get all messages in a chat session.
+    Get a chat session's messages in insertion (id) order, one page at a time.
+    Pass the X-Next-Cursor response header back as `cursor` for the next page.
+    
+    Incremental sync: `after=<message_id>` returns only the messages inserted
+    after that one. Ids come from a sequence, so a message saved after the
+    client's last sync is never skipped, even if its exchange started first. Responses carry an ETag; sending it back in If-None-Match
+    gets 304 when nothing changed.
+    
     Multi-tenancy: Only accessible if session is owned by current user.
     """
-    session = db.query(ChatSession).filter(
+    await chat_writer.flush()  # Read-your-writes for queued messages (no-op if empty)
+    
+    # Ownership check and the newest message id (for the ETag) in one query
+    newest_id = (
+        select(ChatMessage.id)
+        .where(ChatMessage.session_id == ChatSession.id)
+        .order_by(ChatMessage.id.desc())
+        .limit(1)
+        .scalar_subquery()
+    )
+    row = (await db.execute(select(ChatSession.id, newest_id).where(
         ChatSession.id == session_id,
         ChatSession.user_id == current_user.id  # Multi-tenancy check
-    ).first()
+    ))).first()
     
-    if not session:
+    if not row:
         raise HTTPException(status_code=404, detail="Session not found")
     
-    messages = db.query(ChatMessage).filter(
-        ChatMessage.session_id == session_id
-    ).order_by(ChatMessage.created_at).all()
+    etag = make_etag(session_id, row[1], cursor, after, limit)
+    if not_modified(request, etag):
+        return Response(status_code=status.HTTP_304_NOT_MODIFIED, headers={"ETag": etag})
+    response.headers["ETag"] = etag
+    
+    if after is not None:
+        anchor = await db.scalar(select(ChatMessage.id).where(
+            ChatMessage.id == after,
+            ChatMessage.session_id == session_id
+        ))
+        if anchor is None:
+            raise HTTPException(status_code=400, detail="Unknown message id in 'after'")
+    
+    query = (
+        select(ChatMessage)
+        .where(ChatMessage.session_id == session_id)
+        .order_by(ChatMessage.id)
+        .limit(limit + 1)
+    )
+    # The cursor carries (created_at, id) like the other pages; messages only page on id
+    if cursor:
+        query = query.where(ChatMessage.id > decode_cursor(cursor)[1])
+    elif after is not None:
+        query = query.where(ChatMessage.id > after)
+    messages = finish_page((await db.scalars(query)).all(), limit, response)
     
     return [
         MessageResponse(
@@ -425,34 +774,327 @@ def get_session_messages(
 
 
 @app.delete("/chat/sessions/{session_id}", tags=["Chat"])
-def delete_session(
+async def delete_session(
     session_id: int,
-    current_user: User = Depends(get_current_user),
-    db: Session = Depends(get_db)
+    current_user: Principal = Depends(get_current_user),
+    db: AsyncSession = Depends(get_db)
 ):
     """
     Delete a chat session and its messages.
     Multi-tenancy: Only deletable if owned by current user.
     """
-    session = db.query(ChatSession).filter(
-        ChatSession.id == session_id,
-        ChatSession.user_id == current_user.id  # Multi-tenancy check
-    ).first()
+    await chat_writer.flush()  # Queued messages must land before their session goes
     
-    if not session:
+    # One DELETE; messages cascade in the database
+    if not await deletion.delete_session(db, session_id, current_user.id):
         raise HTTPException(status_code=404, detail="Session not found")
-    
-    db.delete(session)
-    db.commit()
+    await db.commit()
     
     return {"message": "Session deleted"}
 
 
+# =============================================================================
+# Admin Routes
+# =============================================================================
+
+@app.get("/admin/vector-index", tags=["Admin"])
+async def vector_index_health(admin: Principal = Depends(get_current_admin)):
+    """
+    Report health of the managed vector indexes: row counts, growth and
+    delete churn since the last build, and any pending maintenance action.
+    """
+    return {
+        "indexes": await asyncio.to_thread(vector_index.health_report),
+        "search_settings": vector_index.search_settings(settings.RETRIEVAL_TOP_K)
+    }
+
+
+@app.get("/admin/db-pool", tags=["Admin"])
+async def db_pool_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report request-path connection pool usage: checkout wait and hold
+    times, peak connections in use and how often the pool saturated.
+    The batch ingestion pool and the chat write-behind queue are reported
+    alongside.
+    """
+    return {
+        **pool_metrics.snapshot(),
+        "pool_status": async_engine.pool.status(),
+        "chat_writer": chat_writer.snapshot(),
+        "batch": {
+            **batch_pool_metrics.snapshot(),
+            "pool_status": batch_engine.pool.status()
+        }
+    }
+
+
+@app.get("/admin/upstream", tags=["Admin"])
+async def upstream_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report how OpenAI calls were shaped before leaving this worker:
+    micro-batched query embeddings, coalesced identical calls, the
+    per-model rate-limit schedulers, interactive/batch lane queues and
+    per-tenant admission.
+    """
+    return {
+        "tenants": fair_share.limiter.snapshot(),
+        "lanes": lane_stats(),
+        "embedding_batcher": openai_client.query_embedding_batcher.stats,
+        "embedding_single_flight": openai_client.embedding_flights.stats,
+        "completion_single_flight": openai_client.completion_flights.stats,
+        "schedulers": rate_limit.scheduler_stats()
+    }
+
+
+@app.get("/admin/auth", tags=["Admin"])
+async def auth_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report the principal cache (hits save a DB checkout per request) and
+    the bcrypt process pool's queue depth and rejections.
+    """
+    return {
+        "principal_cache": principal_cache.snapshot(),
+        "password_hashing": password_pool.snapshot()
+    }
+
+
+@app.get("/admin/tracing", tags=["Admin"])
+async def tracing_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report span export from this worker: traces exported or dropped by
+    sampling, export queue depth and OTLP failures (which fall back to the
+    JSONL file).
+    """
+    return {
+        "enabled": settings.TRACING_ENABLED,
+        "sample_rate": settings.TRACE_SAMPLE_RATE,
+        "slow_ms": settings.TRACE_SLOW_MS,
+        **tracing.exporter.snapshot()
+    }
+
+
+@app.get("/admin/slow-queries", tags=["Admin"])
+async def slow_query_stats(
+    limit: int = Query(20, ge=1, le=500),
+    order_by: str = Query("slow_total", pattern="^(slow_total|slow_calls|total|max|calls|vector_index_misses)$"),
+    admin: Principal = Depends(get_current_admin)
+):
+    """
+    Report the query shapes of this worker with the most time spent over
+    SLOW_QUERY_MS (or ordered by `order_by`), with the summary of their
+    last captured EXPLAIN plan: whether the vector index served the search,
+    sequential scans and buffer usage.
+    """
+    return {**slow_query_log.snapshot(), "top": slow_query_log.top(limit, order_by)}
+
+
+@app.get("/admin/slow-queries/{fingerprint}", tags=["Admin"])
+async def slow_query_detail(fingerprint: str, admin: Principal = Depends(get_current_admin)):
+    """Get one query shape with its full last EXPLAIN plan."""
+    shape = slow_query_log.get(fingerprint)
+    if shape is None:
+        raise HTTPException(status_code=404, detail="Query shape not found")
+    return shape
+
+
+@app.delete("/admin/slow-queries", tags=["Admin"])
+async def slow_query_reset(admin: Principal = Depends(get_current_admin)):
+    """Forget the recorded query shapes, e.g. after fixing an index."""
+    slow_query_log.reset()
+    return {"message": "Slow query log reset"}
+
+
+@app.get("/admin/profiles", tags=["Admin"])
+async def profiler_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report the sampling profiler of this worker and list the stored
+    request profiles, newest first.
+    """
+    return {
+        "enabled": settings.PROFILING_ENABLED,
+        "interval_ms": settings.PROFILE_INTERVAL_MS,
+        "sampler": profiler.sampler.snapshot(),
+        "stored": await asyncio.to_thread(profiler.list_stored)
+    }
+
+
+@app.get("/admin/profiles/rolling", tags=["Admin"])
+async def rolling_profile(
+    seconds: Optional[int] = Query(None, ge=1),
+    format: str = Query(profiler.FORMAT_SPEEDSCOPE, pattern="^(speedscope|collapsed)$"),
+    admin: Principal = Depends(get_current_admin)
+):
+    """
+    Dump the rolling low-rate profile of this worker process, covering the
+    last `seconds` (default: all kept), as speedscope JSON or collapsed
+    stacks.
+    """
+    if not profiler.sampler.rolling:
+        raise HTTPException(status_code=404, detail="Rolling profiler is off (PROFILER_ROLLING_HZ=0)")
+    body, media_type = profiler.sampler.rolling_profile(seconds).render(format)
+    return Response(content=body, media_type=media_type)
+
+
+@app.get("/admin/profiles/{profile_id}", tags=["Admin"])
+async def stored_profile(
+    profile_id: str,
+    format: str = Query(profiler.FORMAT_SPEEDSCOPE, pattern="^(speedscope|collapsed)$"),
+    admin: Principal = Depends(get_current_admin)
+):
+    """Get a profile stored by an `X-Profile: store` request."""
+    profile = await asyncio.to_thread(profiler.load, profile_id)
+    if profile is None:
+        raise HTTPException(status_code=404, detail="Profile not found")
+    body, media_type = profile.render(format)
+    return Response(content=body, media_type=media_type)
+
+
+@app.get("/admin/jobs", tags=["Admin"])
+async def job_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report the background job queue across all workers: jobs by status,
+    how long the oldest due job has waited, and jobs finished per minute.
+    """
+    return await jobs.queue_stats()
+
+
+@app.get("/admin/deletions", tags=["Admin"])
+async def deletion_stats(admin: Principal = Depends(get_current_admin)):
+    """
+    Report the S3 cleanup queue: objects deleted and failed by this worker,
+    plus the backlog still pending and those that exhausted their retries.
+    """
+    return {"s3_cleanup": await s3_cleaner.snapshot()}
+
+
+@app.delete("/admin/users/{user_id}", tags=["Admin"])
+async def purge_user(user_id: int, admin: Principal = Depends(get_current_admin)):
+    """
+    Purge a user and everything they own (documents, chunks, chat history),
+    in bounded batches. Their PDFs are queued for deletion from S3.
+    """
+    counts = await deletion.purge_tenant(user_id)
+    if counts is None:
+        raise HTTPException(status_code=404, detail="User not found")
+    return {"message": "User purged", "deleted": counts}
+
+
+@app.post("/admin/vector-index/maintain", tags=["Admin"])
+async def vector_index_maintain(admin: Principal = Depends(get_current_admin)):
+    """Run a maintenance pass now instead of waiting for the next interval."""
+    return {"actions": await run_in_lane(BATCH, vector_index.maintain)}
+
+
+# =============================================================================
+# Metrics
+# =============================================================================
+
+def _pools(read) -> dict:
+    return {("request",): read(pool_metrics), ("batch",): read(batch_pool_metrics)}
+
+
+def _lookups(**caches) -> dict:
+    return {
+        (name, result): value
+        for name, (hits, misses) in caches.items()
+        for result, value in (("hit", hits), ("miss", misses))
+    }
+
+
+def _lanes(read) -> dict:
+    return {
+        (name, queue): value
+        for name, lane in LANES.items()
+        for queue, value in zip(("upstream", "worker"), read(lane))
+    }
+
+
+metrics.register_callback(
+    "rag_db_pool_checkouts_total", "counter", "Connections checked out of the pool", ("pool",),
+    lambda: _pools(lambda m: m.checkouts)
+)
+metrics.register_callback(
+    "rag_db_pool_in_use", "gauge", "Connections currently checked out", ("pool",),
+    lambda: _pools(lambda m: m.in_use)
+)
+metrics.register_callback(
+    "rag_db_pool_wait_seconds_total", "counter", "Time spent waiting for a connection", ("pool",),
+    lambda: _pools(lambda m: m.wait_total)
+)
+metrics.register_callback(
+    "rag_db_pool_saturated_checkouts_total", "counter", "Checkouts that left no spare connection", ("pool",),
+    lambda: _pools(lambda m: m.saturated)
+)
+metrics.register_callback(
+    "rag_cache_lookups_total", "counter",
+    "Cache lookups by result (single-flight hits are calls that joined one in flight)",
+    ("cache", "result"),
+    lambda: _lookups(
+        principal=(principal_cache.stats["hits"], principal_cache.stats["misses"]),
+        embedding_single_flight=(
+            openai_client.embedding_flights.stats["coalesced"], openai_client.embedding_flights.stats["upstream"]
+        ),
+        completion_single_flight=(
+            openai_client.completion_flights.stats["coalesced"], openai_client.completion_flights.stats["upstream"]
+        )
+    )
+)
+metrics.register_callback(
+    "rag_password_pool_queue_depth", "gauge", "Password hashes waiting for a bcrypt worker process", (),
+    lambda: {(): password_pool.queue_depth}
+)
+metrics.register_callback(
+    "rag_password_pool_in_flight", "gauge", "Password hashes running or queued", (),
+    lambda: {(): password_pool.in_flight}
+)
+metrics.register_callback(
+    "rag_password_pool_rejected_total", "counter",
+    "Password hashes rejected because the queue was full (PasswordHasherBusy, 503)", (),
+    lambda: {(): password_pool.stats["rejected"]}
+)
+metrics.register_callback(
+    "rag_db_slow_queries_total", "counter", "Statements slower than SLOW_QUERY_MS", (),
+    lambda: {(): slow_query_log.stats["slow"]}
+)
+
+
+metrics.register_callback(
+    "rag_lane_queue_depth", "gauge",
+    "Work waiting per lane, for an upstream OpenAI slot or a worker thread", ("lane", "queue"),
+    lambda: _lanes(lambda lane: (lane.waiting, lane.worker_queue_depth))
+)
+metrics.register_callback(
+    "rag_lane_in_flight", "gauge", "Upstream calls and worker-thread tasks running per lane", ("lane", "queue"),
+    lambda: _lanes(lambda lane: (lane.in_flight, lane.worker_in_flight))
+)
+metrics.register_callback(
+    "rag_lane_wait_seconds_total", "counter", "Time spent queued per lane", ("lane", "queue"),
+    lambda: _lanes(lambda lane: (lane.wait_total, lane.worker_wait_total))
+)
+metrics.register_callback(
+    "rag_lane_waits_total", "counter", "Queued items admitted per lane", ("lane", "queue"),
+    lambda: _lanes(lambda lane: (lane.waits, lane.started))
+)
+
+
+@app.get("/metrics", response_class=PlainTextResponse, tags=["Metrics"])
+async def prometheus_metrics(request: Request):
+    """
+    Prometheus scrape endpoint: per-stage and per-route latency histograms,
+    OpenAI token counts, connection pool, cache, lane and password hashing
+    queue counters (this worker process only). Requires `Authorization: Bearer <METRICS_TOKEN>` when
+    METRICS_TOKEN is set.
+    """
+    if settings.METRICS_TOKEN and request.headers.get("authorization") != f"Bearer {settings.METRICS_TOKEN}":
+        raise HTTPException(status_code=status.HTTP_401_UNAUTHORIZED, detail="Invalid metrics token")
+    return PlainTextResponse(metrics.render(), media_type="text/plain; version=0.0.4")
+
+
 # =============================================================================
 # Health Check
 # =============================================================================
 
 @app.get("/health", tags=["Health"])
-def health_check():
+async def health_check():
     """Health check endpoint."""
     return {"status": "healthy"}
@@ -0,0 +1,241 @@
+"""
+Metrics module - per-stage latency histograms, Prometheus exposition and
+Server-Timing headers.
+
+Pipeline code wraps each stage in `stage(name)`:
+
+    with metrics.stage("embedding"):
+        vector = await get_embedding(text)
+
+which observes the duration in the rag_stage_seconds histogram and, inside
+an HTTP request, also records it for that request's Server-Timing header
+(e.g. `embedding;dur=41.2, vector_search;dur=3.7, total;dur=52.0`). For
+streamed responses the header only covers stages finished before the
+first byte.
+
+Counters owned by other modules (connection pools, caches) are read at
+scrape time through callbacks registered with `register_callback`, so they
+cost nothing per request. GET /metrics renders everything in the
+Prometheus text format.
+
+Metrics are kept per worker process, like the /admin statistics.
+"""
+import time
+from bisect import bisect_left
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Callable, Dict, List, Optional, Tuple
+
+from app import tracing
+from app.config import settings
+
+STAGES = ("embedding", "vector_search", "llm", "db_write", "s3", "pdf_extract", "chunking")
+
+# Seconds; wide enough for a 30s LLM call, fine enough for a 5ms query
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0)
+
+Labels = Tuple[str, ...]
+
+
+def _format_labels(names: Labels, values: Labels, extra: str = "") -> str:
+    pairs = [f'{n}="{v}"' for n, v in zip(names, values)]
+    if extra:
+        pairs.append(extra)
+    return "{" + ",".join(pairs) + "}" if pairs else ""
+
+
+class Counter:
+    """Monotonic counter with labels."""
+
+    def __init__(self, name: str, help_text: str, label_names: Labels = ()):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self._values: Dict[Labels, float] = {}
+
+    def inc(self, labels: Labels = (), amount: float = 1) -> None:
+        self._values[labels] = self._values.get(labels, 0) + amount
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} counter"]
+        for labels, value in self._values.items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+class Histogram:
+    """Cumulative-bucket histogram with labels, as Prometheus expects."""
+
+    def __init__(self, name: str, help_text: str, label_names: Labels = (), buckets=DEFAULT_BUCKETS):
+        self.name = name
+        self.help = help_text
+        self.label_names = label_names
+        self.buckets = tuple(buckets)
+        # labels -> [count per bucket (last is +Inf), sum]
+        self._series: Dict[Labels, list] = {}
+
+    def observe(self, labels: Labels, value: float) -> None:
+        series = self._series.get(labels)
+        if series is None:
+            series = self._series[labels] = [[0] * (len(self.buckets) + 1), 0.0]
+        series[0][bisect_left(self.buckets, value)] += 1
+        series[1] += value
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} histogram"]
+        for labels, (counts, total) in self._series.items():
+            cumulative = 0
+            for bound, count in zip((*self.buckets, "+Inf"), counts):
+                cumulative += count
+                le = _format_labels(self.label_names, labels, f'le="{bound}"')
+                lines.append(f"{self.name}_bucket{le} {cumulative}")
+            plain = _format_labels(self.label_names, labels)
+            lines.append(f"{self.name}_sum{plain} {total}")
+            lines.append(f"{self.name}_count{plain} {cumulative}")
+        return lines
+
+
+class _Callback:
+    """Metric whose samples are read from elsewhere at scrape time."""
+
+    def __init__(self, name: str, kind: str, help_text: str, label_names: Labels,
+                 read: Callable[[], Dict[Labels, float]]):
+        self.name = name
+        self.kind = kind
+        self.help = help_text
+        self.label_names = label_names
+        self.read = read
+
+    def render(self) -> List[str]:
+        lines = [f"# HELP {self.name} {self.help}", f"# TYPE {self.name} {self.kind}"]
+        for labels, value in self.read().items():
+            lines.append(f"{self.name}{_format_labels(self.label_names, labels)} {value}")
+        return lines
+
+
+STAGE_SECONDS = Histogram(
+    "rag_stage_seconds", "Time spent in each pipeline stage", ("stage",)
+)
+REQUEST_SECONDS = Histogram(
+    "rag_http_request_seconds", "HTTP request latency by route", ("method", "route", "status")
+)
+OPENAI_TOKENS = Counter(
+    "rag_openai_tokens_total", "Tokens used upstream, as reported by OpenAI", ("model", "kind")
+)
+
+_registry: list = [STAGE_SECONDS, REQUEST_SECONDS, OPENAI_TOKENS]
+
+
+def register_callback(name: str, kind: str, help_text: str, label_names: Labels,
+                      read: Callable[[], Dict[Labels, float]]) -> None:
+    """
+    Export values owned by another module, read when /metrics is scraped.
+
+    Args:
+        name: Metric name
+        kind: 'counter' or 'gauge'
+        help_text: Description for the HELP line
+        label_names: Names of the label values in `read`'s keys
+        read: Returns the current value per tuple of label values
+    """
+    _registry.append(_Callback(name, kind, help_text, label_names, read))
+
+
+def render() -> str:
+    """All metrics in the Prometheus text exposition format."""
+    lines: List[str] = []
+    for metric in _registry:
+        lines.extend(metric.render())
+    return "\n".join(lines) + "\n"
+
+
+# =============================================================================
+# Stage timing
+# =============================================================================
+
+# (stage, seconds) pairs of the current HTTP request, for Server-Timing
+_request_timings: ContextVar[Optional[list]] = ContextVar("request_timings", default=None)
+
+
+def record(stage_name: str, seconds: float) -> None:
+    """Record a stage duration measured by the caller."""
+    STAGE_SECONDS.observe((stage_name,), seconds)
+    timings = _request_timings.get()
+    if timings is not None:
+        timings.append((stage_name, seconds))
+
+
+@contextmanager
+def stage(stage_name: str, **span_attributes):
+    """Time the block as one pipeline stage (and a span, when tracing)."""
+    started = time.perf_counter()
+    entered = tracing.enter_span(stage_name, **span_attributes)
+    try:
+        yield
+    except BaseException as e:
+        tracing.exit_span(entered, e)
+        raise
+    else:
+        tracing.exit_span(entered)
+    finally:
+        record(stage_name, time.perf_counter() - started)
+
+
+def count_tokens(model: str, usage) -> None:
+    """Count the prompt/completion tokens of an OpenAI usage object (if any)."""
+    if usage is None:
+        return
+    OPENAI_TOKENS.inc((model, "prompt"), usage.prompt_tokens or 0)
+    completion = getattr(usage, "completion_tokens", None)
+    if completion:
+        OPENAI_TOKENS.inc((model, "completion"), completion)
+
+
+def _server_timing(timings: list, total: float) -> bytes:
+    # Stages repeated within a request (e.g. several S3 calls) are summed
+    merged: Dict[str, float] = {}
+    for name, seconds in timings:
+        merged[name] = merged.get(name, 0.0) + seconds
+    merged["total"] = total
+    return ", ".join(f"{name};dur={seconds * 1000:.1f}" for name, seconds in merged.items()).encode()
+
+
+class MetricsMiddleware:
+    """
+    ASGI middleware timing every HTTP request and adding Server-Timing.
+
+    Plain ASGI rather than @app.middleware("http"), which would add a task
+    and a response wrapper to every request.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        started = time.perf_counter()
+        timings: list = []
+        token = _request_timings.set(timings)
+        status_code = 500
+
+        async def send_with_timing(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if settings.SERVER_TIMING_ENABLED:
+                    header = _server_timing(timings, time.perf_counter() - started)
+                    message["headers"] = [*message.get("headers", ()), (b"server-timing", header)]
+            await send(message)
+
+        try:
+            await self.app(scope, receive, send_with_timing)
+        finally:
+            _request_timings.reset(token)
+            route = scope.get("route")
+            REQUEST_SECONDS.observe(
+                (scope["method"], route.path if route is not None else "unmatched", str(status_code)),
+                time.perf_counter() - started
+            )
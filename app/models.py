@@ -2,7 +2,8 @@
 Database models - User, Document, Chunk, ChatSession, ChatMessage with pgvector.
 """
 from datetime import datetime
-from sqlalchemy import Column, Integer, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy import Column, Integer, BigInteger, Float, String, Text, DateTime, ForeignKey, Index
+from sqlalchemy.dialects.postgresql import JSONB
 from sqlalchemy.orm import relationship
 from pgvector.sqlalchemy import Vector
 
@@ -18,9 +19,10 @@ class User(Base):
     hashed_password = Column(String(255), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
-    # Relationships
-    documents = relationship("Document", back_populates="owner", cascade="all, delete-orphan")
-    chat_sessions = relationship("ChatSession", back_populates="owner", cascade="all, delete-orphan")
+    # Relationships (passive_deletes: rows go with the ON DELETE CASCADE foreign
+    # keys instead of being loaded and deleted one by one; see app/deletion.py)
+    documents = relationship("Document", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True)
+    chat_sessions = relationship("ChatSession", back_populates="owner", cascade="all, delete-orphan", passive_deletes=True)
 
 
 class Document(Base):
@@ -28,14 +30,24 @@ class Document(Base):
     __tablename__ = "documents"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     filename = Column(String(255), nullable=False)
     s3_key = Column(String(512), nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
     owner = relationship("User", back_populates="documents")
-    chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan")
+    chunks = relationship("Chunk", back_populates="document", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Keyset pagination of a user's documents, newest first; INCLUDE makes
+    # each page an index-only scan
+    __table_args__ = (
+        Index(
+            "ix_documents_user_created",
+            user_id, created_at.desc(), id.desc(),
+            postgresql_include=["filename", "s3_key"]
+        ),
+    )
 
 
 class Chunk(Base):
@@ -43,7 +55,8 @@ class Chunk(Base):
     __tablename__ = "chunks"
 
     id = Column(Integer, primary_key=True, index=True)
-    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False)
+    # Indexed so the cascade from a deleted document finds its chunks directly
+    document_id = Column(Integer, ForeignKey("documents.id", ondelete="CASCADE"), nullable=False, index=True)
     user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
     content = Column(Text, nullable=False)
     embedding = Column(Vector(1536))  # OpenAI text-embedding-3-small dimension
@@ -52,11 +65,59 @@ class Chunk(Base):
     # Relationships
     document = relationship("Document", back_populates="chunks")
 
-    # Index for vector similarity search (uses pgvector's ivfflat)
+    # The vector similarity index (ix_chunks_embedding) is not declared here:
+    # ivfflat trains its centroids at build time, so it is built after data
+    # is loaded and rebuilt on drift by app/vector_index.py.
+
+
+class VectorIndexState(Base):
+    """Build bookkeeping for a managed vector index (see app/vector_index.py)."""
+    __tablename__ = "vector_index_state"
+
+    index_name = Column(String(255), primary_key=True)
+    table_name = Column(String(255), nullable=False)
+    index_type = Column(String(50), nullable=False)  # 'ivfflat' or 'hnsw'
+    lists = Column(Integer)  # ivfflat only
+    rows_at_build = Column(BigInteger, nullable=False, default=0)
+    deletes_at_build = Column(BigInteger, nullable=False, default=0)
+    build_seconds = Column(Float)
+    built_at = Column(DateTime, default=datetime.utcnow)
+
+
+class S3Deletion(Base):
+    """S3 object waiting to be deleted (durable cleanup queue, see app/deletion.py)."""
+    __tablename__ = "s3_deletions"
+
+    id = Column(BigInteger, primary_key=True)
+    s3_key = Column(String(512), nullable=False)
+    attempts = Column(Integer, nullable=False, default=0)
+    next_attempt_at = Column(DateTime, nullable=False, default=datetime.utcnow, index=True)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+
+
+class Job(Base):
+    """Background job in the durable work queue (see app/jobs.py)."""
+    __tablename__ = "jobs"
+
+    id = Column(BigInteger, primary_key=True)
+    kind = Column(String(50), nullable=False)  # e.g. 'ingest_document'
+    payload = Column(JSONB, nullable=False)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), index=True)
+    status = Column(String(20), nullable=False, default="queued")  # queued, running, done, dead
+    attempts = Column(Integer, nullable=False, default=0)
+    max_attempts = Column(Integer, nullable=False)
+    run_at = Column(DateTime, nullable=False, default=datetime.utcnow)  # not before
+    locked_by = Column(String(255))
+    lease_expires_at = Column(DateTime)
+    last_error = Column(Text)
+    created_at = Column(DateTime, default=datetime.utcnow)
+    finished_at = Column(DateTime)
+
+    # Claiming scans queued jobs by run_at and running jobs by lease expiry
     __table_args__ = (
-        Index('ix_chunks_embedding', 'embedding', postgresql_using='ivfflat',
-              postgresql_with={'lists': 100},
-              postgresql_ops={'embedding': 'vector_cosine_ops'}),
+        Index("ix_jobs_status_run_at", status, run_at),
+        Index("ix_jobs_status_lease", status, lease_expires_at),
     )
 
 
@@ -65,13 +126,22 @@ class ChatSession(Base):
     __tablename__ = "chat_sessions"
 
     id = Column(Integer, primary_key=True, index=True)
-    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False, index=True)
+    user_id = Column(Integer, ForeignKey("users.id", ondelete="CASCADE"), nullable=False)
     title = Column(String(255), default="New Chat")
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
     owner = relationship("User", back_populates="chat_sessions")
-    messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan")
+    messages = relationship("ChatMessage", back_populates="session", cascade="all, delete-orphan", passive_deletes=True)
+
+    # Keyset pagination of a user's sessions, newest first (index-only with INCLUDE)
+    __table_args__ = (
+        Index(
+            "ix_chat_sessions_user_created",
+            user_id, created_at.desc(), id.desc(),
+            postgresql_include=["title"]
+        ),
+    )
 
 
 class ChatMessage(Base):
@@ -79,10 +149,17 @@ class ChatMessage(Base):
     __tablename__ = "chat_messages"
 
     id = Column(Integer, primary_key=True, index=True)
-    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False, index=True)
+    session_id = Column(Integer, ForeignKey("chat_sessions.id", ondelete="CASCADE"), nullable=False)
     role = Column(String(50), nullable=False)  # 'user' or 'assistant'
     content = Column(Text, nullable=False)
     created_at = Column(DateTime, default=datetime.utcnow)
 
     # Relationships
     session = relationship("ChatSession", back_populates="messages")
+
+    # Keyset pagination of a session's history in id (insertion) order;
+    # content is too large to INCLUDE, so pages are an index range scan plus
+    # heap fetches
+    __table_args__ = (
+        Index("ix_chat_messages_session_id", session_id, id),
+    )
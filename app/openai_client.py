@@ -1,45 +1,135 @@
 """
 OpenAI client - embeddings and chat completions.
 """
-from typing import List, Optional
+from typing import AsyncIterator, List, Optional, Tuple
 
-from openai import OpenAI
+from openai import AsyncOpenAI
 
+from app import fair_share, metrics, tracing
+from app.batching import MicroBatcher
 from app.config import settings
+from app.lanes import BATCH, INTERACTIVE
+from app.rate_limit import estimate_tokens, get_scheduler
+from app.singleflight import SingleFlight, content_hash, normalize_text
 
-# Initialize OpenAI client
-client = OpenAI(api_key=settings.OPENAI_API_KEY)
+# Initialize OpenAI client (async, so waiting on the API never holds a thread).
+# SDK retries are off: app/rate_limit.py owns retries, backoff and budgets.
+client = AsyncOpenAI(api_key=settings.OPENAI_API_KEY, max_retries=0)
 
 
-def get_embedding(text: str) -> List[float]:
+def _usage_tokens(response) -> Optional[int]:
+    usage = getattr(response, "usage", None)
+    return usage.total_tokens if usage is not None else None
+
+
+async def _create_embeddings(
+    texts: List[str],
+    lane: str = INTERACTIVE,
+    tenant: Optional[int] = None
+) -> List[List[float]]:
+    """Call the embeddings API once for a list of already-cleaned texts."""
+    model = settings.OPENAI_EMBEDDING_MODEL
+    scheduler = get_scheduler(model)
+    tokens = sum(estimate_tokens(t) for t in texts)
+    
+    raw = await scheduler.run(
+        lambda: tracing.traced(
+            "openai.embeddings",
+            client.embeddings.with_raw_response.create(model=model, input=texts),
+            **{"openai.model": model, "openai.inputs": len(texts)}
+        ),
+        tokens=tokens,
+        lane=lane,
+        tenant=tenant
+    )
+    response = raw.parse()
+    scheduler.reconcile(tokens, _usage_tokens(response))
+    metrics.count_tokens(model, response.usage)
+    
+    # Sort by index to maintain order
+    sorted_data = sorted(response.data, key=lambda x: x.index)
+    return [d.embedding for d in sorted_data]
+
+
+async def _embed_query_batch(items: List[Tuple[str, Optional[int]]]) -> List[List[float]]:
+    """Embed a micro-batch of (text, tenant) items; a batch from one tenant is billed to it."""
+    tenants = {tenant for _, tenant in items}
+    tenant = tenants.pop() if len(tenants) == 1 else None
+    return await _create_embeddings([text for text, _ in items], tenant=tenant)
+
+
+# Coalesces concurrent query embeddings into one embeddings.create call
+query_embedding_batcher = MicroBatcher(
+    _embed_query_batch,
+    window_ms=settings.EMBEDDING_BATCH_WINDOW_MS,
+    max_size=settings.EMBEDDING_BATCH_MAX_SIZE
+)
+
+# Identical concurrent calls share one upstream request
+embedding_flights = SingleFlight()
+completion_flights = SingleFlight()
+
+
+async def _embed_query(text: str, tenant: Optional[int]) -> List[float]:
+    """Embed one cleaned query, through the micro-batcher when enabled."""
+    if not settings.EMBEDDING_BATCH_ENABLED:
+        return (await _create_embeddings([text], tenant=tenant))[0]
+    
+    return await query_embedding_batcher.submit(
+        (text, tenant), timeout=settings.EMBEDDING_BATCH_TIMEOUT_SECONDS
+    )
+
+
+async def get_embedding(text: str, tenant: Optional[int] = None) -> List[float]:
     """
     Get embedding vector for a text using OpenAI.
     
+    Concurrent calls are micro-batched into a single API request unless
+    EMBEDDING_BATCH_ENABLED is off, and identical in-flight texts share
+    one result unless SINGLE_FLIGHT_ENABLED is off.
+    
     Args:
         text: The text to embed
+        tenant: User id the call is made for; its token bucket is charged
+            even when the call is micro-batched with, or shares the in-flight
+            result of, other users' queries
         
     Returns:
         Embedding vector as list of floats (1536 dimensions)
+    
+    Raises:
+        TimeoutError: If the result is not ready within EMBEDDING_BATCH_TIMEOUT_SECONDS
     """
-    # Clean and truncate text if needed
-    text = text.replace("\n", " ").strip()
+    # Normalize whitespace; the normalized text is both embedded and used as the key
+    text = normalize_text(text)
     if not text:
         return [0.0] * 1536
     
-    response = client.embeddings.create(
-        model=settings.OPENAI_EMBEDDING_MODEL,
-        input=text
-    )
+    # Charge every caller's token bucket up front, outside the single flight,
+    # so a caller that joins another tenant's flight still pays, and a tenant
+    # over its budget only fails its own request
+    if tenant is not None:
+        await fair_share.limiter.charge(tenant, estimate_tokens(text))
     
-    return response.data[0].embedding
+    with metrics.stage("embedding"):
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return await _embed_query(text, tenant)
+        
+        key = ("embedding", settings.OPENAI_EMBEDDING_MODEL, text)
+        return await embedding_flights.do(key, lambda: _embed_query(text, tenant))
 
 
-def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
+async def get_embeddings_batch(texts: List[str], tenant: Optional[int] = None) -> List[List[float]]:
     """
-    Get embeddings for multiple texts in a single API call.
+    Get embeddings for document chunks.
+    
+    Runs in the batch lane, in sub-batches of EMBEDDING_DOCUMENT_BATCH_SIZE
+    sent one after another, so a large document never holds more than one
+    batch slot and interactive calls can be admitted in between.
     
     Args:
         texts: List of texts to embed
+        tenant: User id the document belongs to
         
     Returns:
         List of embedding vectors
@@ -50,30 +140,33 @@ def get_embeddings_batch(texts: List[str]) -> List[List[float]]:
     # Clean texts
     cleaned_texts = [t.replace("\n", " ").strip() for t in texts]
     
-    response = client.embeddings.create(
-        model=settings.OPENAI_EMBEDDING_MODEL,
-        input=cleaned_texts
-    )
-    
-    # Sort by index to maintain order
-    sorted_data = sorted(response.data, key=lambda x: x.index)
-    return [d.embedding for d in sorted_data]
+    size = settings.EMBEDDING_DOCUMENT_BATCH_SIZE
+    embeddings = []
+    with metrics.stage("embedding"):
+        for start in range(0, len(cleaned_texts), size):
+            embeddings.extend(await _create_embeddings(cleaned_texts[start:start + size], lane=BATCH, tenant=tenant))
+    return embeddings
 
 
-def chat_completion(
+async def chat_completion(
     messages: List[dict],
     model: Optional[str] = None,
     temperature: float = 0.7,
-    max_tokens: int = 1024
+    max_tokens: int = 1024,
+    tenant: Optional[int] = None
 ) -> str:
     """
     Generate a chat completion using OpenAI.
     
+    Identical concurrent requests (same model, parameters and normalized
+    prompt including context) share one upstream call.
+    
     Args:
         messages: List of message dicts with 'role' and 'content'
         model: Model to use (default from settings)
         temperature: Sampling temperature
         max_tokens: Maximum tokens in response
+        tenant: User id the call is made for
         
     Returns:
         The assistant's response text
@@ -81,11 +174,88 @@ def chat_completion(
     if model is None:
         model = settings.OPENAI_CHAT_MODEL
     
-    response = client.chat.completions.create(
-        model=model,
-        messages=messages,
-        temperature=temperature,
-        max_tokens=max_tokens
-    )
+    scheduler = get_scheduler(model)
+    tokens = sum(estimate_tokens(m["content"]) for m in messages) + max_tokens
+    
+    async def create() -> str:
+        raw = await scheduler.run(
+            lambda: tracing.traced(
+                "openai.chat",
+                client.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens
+                ),
+                **{"openai.model": model}
+            ),
+            tokens=tokens,
+            tenant=tenant
+        )
+        response = raw.parse()
+        scheduler.reconcile(tokens, _usage_tokens(response))
+        metrics.count_tokens(model, response.usage)
+        return response.choices[0].message.content
+    
+    with metrics.stage("llm"):
+        if not settings.SINGLE_FLIGHT_ENABLED:
+            return await create()
+        
+        # The prompt embeds the retrieved context, so hashing it covers the context too
+        prompt = [{"role": m["role"], "content": normalize_text(m["content"])} for m in messages]
+        key = ("chat", model, temperature, max_tokens, content_hash(prompt))
+        return await completion_flights.do(key, create)
+
+
+async def chat_completion_stream(
+    messages: List[dict],
+    model: Optional[str] = None,
+    temperature: float = 0.7,
+    max_tokens: int = 1024,
+    tenant: Optional[int] = None
+) -> AsyncIterator[str]:
+    """
+    Stream a chat completion from OpenAI, yielding text as it is generated.
     
-    return response.choices[0].message.content
+    Args:
+        messages: List of message dicts with 'role' and 'content'
+        model: Model to use (default from settings)
+        temperature: Sampling temperature
+        max_tokens: Maximum tokens in response
+        tenant: User id the call is made for
+        
+    Yields:
+        Content deltas of the assistant's response
+    """
+    if model is None:
+        model = settings.OPENAI_CHAT_MODEL
+    
+    scheduler = get_scheduler(model)
+    tokens = sum(estimate_tokens(m["content"]) for m in messages) + max_tokens
+    
+    # Timed until the stream ends (or the client goes away)
+    with metrics.stage("llm"):
+        # Admission and retries cover opening the stream; usage arrives in the last chunk
+        raw = await scheduler.run(
+            lambda: tracing.traced(
+                "openai.chat",
+                client.chat.completions.with_raw_response.create(
+                    model=model,
+                    messages=messages,
+                    temperature=temperature,
+                    max_tokens=max_tokens,
+                    stream=True,
+                    stream_options={"include_usage": True}
+                ),
+                **{"openai.model": model, "openai.stream": True}
+            ),
+            tokens=tokens,
+            tenant=tenant
+        )
+        
+        async for chunk in raw.parse():
+            if chunk.usage is not None:
+                scheduler.reconcile(tokens, chunk.usage.total_tokens)
+                metrics.count_tokens(model, chunk.usage)
+            if chunk.choices and chunk.choices[0].delta.content:
+                yield chunk.choices[0].delta.content
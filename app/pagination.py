@@ -0,0 +1,73 @@
+"""
+Pagination module - keyset (cursor) pagination for list endpoints.
+
+Pages are ordered by (created_at, id) - chat messages by id alone, their
+insertion order - and continue strictly after the last row of the previous
+page, so each page is an index range scan no matter how deep the client
+pages. The cursor for the next page is returned in the
+X-Next-Cursor response header (absent on the last page) and is opaque to
+clients.
+
+List responses also carry a weak ETag derived from the query and the
+newest row, so a client polling an unchanged list gets 304 Not Modified.
+"""
+import base64
+import hashlib
+import json
+from datetime import datetime
+from typing import List, Tuple
+
+from fastapi import HTTPException, Request, Response, status
+
+NEXT_CURSOR_HEADER = "X-Next-Cursor"
+
+
+def encode_cursor(created_at: datetime, row_id: int) -> str:
+    raw = json.dumps([created_at.isoformat(), row_id], separators=(",", ":")).encode()
+    return base64.urlsafe_b64encode(raw).decode().rstrip("=")
+
+
+def decode_cursor(cursor: str) -> Tuple[datetime, int]:
+    """
+    Decode a cursor from encode_cursor.
+
+    Raises:
+        HTTPException: 400 if the cursor is malformed
+    """
+    try:
+        raw = base64.urlsafe_b64decode(cursor + "=" * (-len(cursor) % 4))
+        created_at, row_id = json.loads(raw)
+        return datetime.fromisoformat(created_at), int(row_id)
+    except (ValueError, TypeError):
+        raise HTTPException(status_code=status.HTTP_400_BAD_REQUEST, detail="Invalid cursor")
+
+
+def finish_page(rows: List, limit: int, response: Response) -> List:
+    """
+    Trim a page fetched with limit + 1 rows and set the next-page cursor.
+
+    Args:
+        rows: Up to limit + 1 rows, in page order, with created_at and id
+        limit: The page size
+        response: The response to set X-Next-Cursor on
+
+    Returns:
+        The rows of this page
+    """
+    page = rows[:limit]
+    if len(rows) > limit:
+        last = page[-1]
+        response.headers[NEXT_CURSOR_HEADER] = encode_cursor(last.created_at, last.id)
+    return page
+
+
+def make_etag(*parts) -> str:
+    """Weak ETag over the values that determine a response."""
+    digest = hashlib.sha1(":".join(str(p) for p in parts).encode()).hexdigest()[:20]
+    return f'W/"{digest}"'
+
+
+def not_modified(request: Request, etag: str) -> bool:
+    """Whether the client's If-None-Match already names this ETag."""
+    header = request.headers.get("if-none-match", "")
+    return header.strip() == "*" or etag in (tag.strip() for tag in header.split(","))
@@ -0,0 +1,545 @@
+"""
+Profiler module - on-demand and rolling sampling profiles.
+
+Python-side CPU work (pydantic serialization, chunk_text, pypdf, ORM
+hydration of large result sets) never shows up in the latency metrics or
+traces, which only see how long a stage took. This module samples Python
+stacks from a background thread with sys._current_frames(), so the code
+being profiled runs unmodified:
+
+- Per request: with PROFILING_ENABLED, an admin sends `X-Profile: return`
+  (or `?profile=return`) to get a speedscope profile of the request instead
+  of its response, or `X-Profile: store` to get the normal response plus an
+  X-Profile-Id header naming a profile saved under PROFILE_DIR (see GET
+  /admin/profiles/{id}). Samples are taken every PROFILE_INTERVAL_MS while a
+  profiled request is in flight, from the event loop thread whenever it is
+  running one of the request's tasks (tasks it creates are followed) and
+  from lane worker threads while they run the request's work
+  (app/lanes.py). Time spent awaiting I/O is not sampled; traces cover it.
+- Rolling: with PROFILER_ROLLING_HZ > 0, every busy thread of the process is
+  sampled at that (low) rate and the last PROFILER_ROLLING_SECONDS are kept
+  in per-second buckets, dumped by GET /admin/profiles/rolling or, in a job
+  worker, by SIGUSR1.
+
+Profiles are written in the speedscope format (https://www.speedscope.app)
+or as collapsed stacks for flamegraph.pl. When profiling is disabled the
+middleware is not installed and no sampling thread runs.
+"""
+import asyncio
+import json
+import os
+import sys
+import threading
+import time
+import uuid
+from collections import Counter, deque
+from contextvars import ContextVar
+from typing import Awaitable, Callable, Dict, List, Optional, Tuple
+from urllib.parse import parse_qs
+
+from app.config import settings
+
+PROFILE_HEADER = "X-Profile"
+PROFILE_ID_HEADER = "X-Profile-Id"
+MODE_RETURN, MODE_STORE = "return", "store"
+FORMAT_SPEEDSCOPE, FORMAT_COLLAPSED = "speedscope", "collapsed"
+
+# (function, file, first line)
+Frame = Tuple[str, str, int]
+Stack = Tuple[Frame, ...]
+
+# Loop thread stacks are cut below the event loop's callback dispatch
+_HANDLE_RUN = asyncio.events.Handle._run.__code__
+# A thread whose innermost Python frame is in one of these is waiting, not working
+_IDLE_FILES = tuple(
+    os.path.join(os.path.dirname(threading.__file__), name)
+    for name in ("threading.py", "selectors.py", "queue.py", os.path.join("concurrent", "futures", "thread.py"))
+)
+
+_frame_cache: Dict[object, Frame] = {}
+_path_prefixes = sorted({p for p in sys.path if p}, key=len, reverse=True)
+
+
+def _frame_key(code) -> Frame:
+    frame = _frame_cache.get(code)
+    if frame is None:
+        filename = code.co_filename
+        for prefix in _path_prefixes:
+            if filename.startswith(prefix + os.sep):
+                filename = filename[len(prefix) + 1:]
+                break
+        frame = _frame_cache[code] = (code.co_qualname, filename, code.co_firstlineno)
+    return frame
+
+
+def _stack(frame, loop_thread: bool = False, root: Optional[str] = None) -> Stack:
+    """Outermost-first stack of `frame`, optionally under a synthetic root frame."""
+    codes = []
+    while frame is not None:
+        if loop_thread and frame.f_code is _HANDLE_RUN:
+            break
+        codes.append(frame.f_code)
+        frame = frame.f_back
+    stack = [_frame_key(code) for code in reversed(codes)]
+    if root is not None:
+        stack.insert(0, (root, "", 0))
+    return tuple(stack)
+
+
+class Profile:
+    """Sampled stacks with their counts."""
+
+    def __init__(self, name: str, interval: float):
+        self.name = name
+        self.interval = interval
+        self.started = time.time()
+        self.duration = 0.0
+        self.samples = 0
+        self.stacks: Counter = Counter()
+        self.finished = False
+
+    def add(self, stack: Stack, count: int = 1) -> None:
+        if stack:
+            self.stacks[stack] += count
+            self.samples += count
+
+    def finish(self) -> None:
+        self.duration = time.time() - self.started
+        self.finished = True
+
+    def to_speedscope(self) -> dict:
+        """The profile in speedscope's file format, weighted in milliseconds."""
+        index: Dict[Frame, int] = {}
+        samples, weights = [], []
+        for stack, count in self.stacks.most_common():
+            samples.append([index.setdefault(frame, len(index)) for frame in stack])
+            weights.append(round(count * self.interval * 1000, 3))
+        return {
+            "$schema": "https://www.speedscope.app/file-format-schema.json",
+            "name": self.name,
+            "exporter": "rag-chatbot app.profiler",
+            "shared": {"frames": [{"name": n, "file": f, "line": line} for n, f, line in index]},
+            "profiles": [{
+                "type": "sampled",
+                "name": self.name,
+                "unit": "milliseconds",
+                "startValue": 0,
+                "endValue": round(sum(weights), 3),
+                "samples": samples,
+                "weights": weights
+            }],
+            "metadata": {
+                "started": self.started,
+                "duration_ms": round(self.duration * 1000, 3),
+                "interval_ms": self.interval * 1000,
+                "samples": self.samples
+            }
+        }
+
+    def to_collapsed(self) -> str:
+        """One `frame;frame;frame count` line per stack, as flamegraph.pl reads."""
+        lines = []
+        for stack, count in self.stacks.most_common():
+            names = ";".join(f"{n} ({f}:{line})" if f else n for n, f, line in stack)
+            lines.append(f"{names} {count}")
+        return "\n".join(lines) + "\n"
+
+    def render(self, fmt: str) -> Tuple[str, str]:
+        """(body, media type) of the profile in `fmt`."""
+        if fmt == FORMAT_COLLAPSED:
+            return self.to_collapsed(), "text/plain"
+        return json.dumps(self.to_speedscope()), "application/json"
+
+    @classmethod
+    def from_speedscope(cls, data: dict) -> "Profile":
+        """Rebuild a profile written by to_speedscope."""
+        meta = data.get("metadata", {})
+        profile = cls(data.get("name", ""), meta.get("interval_ms", 1.0) / 1000)
+        profile.started = meta.get("started", 0.0)
+        profile.duration = meta.get("duration_ms", 0.0) / 1000
+        frames = [(f["name"], f.get("file", ""), f.get("line", 0)) for f in data["shared"]["frames"]]
+        sampled = data["profiles"][0]
+        for sample, weight in zip(sampled["samples"], sampled["weights"]):
+            profile.add(tuple(frames[i] for i in sample), max(1, round(weight / (profile.interval * 1000))))
+        profile.finished = True
+        return profile
+
+
+class Sampler:
+    """
+    The sampling thread, shared by request profiles and the rolling profile.
+
+    Started by the first profiled request (or by start_rolling); it sleeps
+    whenever there is nothing to sample.
+    """
+
+    def __init__(self, interval: float, rolling_hz: float, rolling_seconds: int):
+        self.interval = interval
+        self.rolling_interval = 1.0 / rolling_hz if rolling_hz > 0 else 0.0
+        self.rolling_seconds = rolling_seconds
+        self._lock = threading.Lock()
+        self._wake = threading.Event()
+        self._thread: Optional[threading.Thread] = None
+        self._stopping = False
+        self._loop: Optional[asyncio.AbstractEventLoop] = None
+        self._loop_thread: Optional[int] = None
+        self._tasks: Dict[asyncio.Task, Profile] = {}
+        self._threads: Dict[int, Profile] = {}
+        self._active = 0
+        # (second, Counter of stacks), oldest first
+        self._buckets: deque = deque()
+        self.stats = {"profiles": 0, "request_samples": 0, "rolling_samples": 0, "sample_seconds": 0.0}
+
+    @property
+    def rolling(self) -> bool:
+        return self.rolling_interval > 0
+
+    # -- request profiles (event loop thread) --------------------------------
+
+    def begin(self, profile: Profile) -> None:
+        """Start sampling for `profile`, attached to the current task."""
+        loop = asyncio.get_running_loop()
+        if self._loop is not loop:
+            self._loop, self._loop_thread = loop, threading.get_ident()
+            _install_task_factory(loop)
+        with self._lock:
+            self._active += 1
+        self.attach(asyncio.current_task(), profile)
+        self.stats["profiles"] += 1
+        self._ensure_started()
+        self._wake.set()
+
+    def end(self, profile: Profile) -> None:
+        profile.finish()
+        with self._lock:
+            self._active -= 1
+            for task in [t for t, p in self._tasks.items() if p is profile]:
+                del self._tasks[task]
+
+    def attach(self, task: asyncio.Task, profile: Profile) -> None:
+        """Sample `task` into `profile` whenever it runs."""
+        if task is None or profile.finished:
+            return
+        with self._lock:
+            self._tasks[task] = profile
+        task.add_done_callback(self._detach)
+
+    def _detach(self, task: asyncio.Task) -> None:
+        with self._lock:
+            self._tasks.pop(task, None)
+
+    def bind_thread(self, profile: Profile) -> None:
+        with self._lock:
+            self._threads[threading.get_ident()] = profile
+
+    def unbind_thread(self) -> None:
+        with self._lock:
+            self._threads.pop(threading.get_ident(), None)
+
+    # -- sampling thread ------------------------------------------------------
+
+    def start_rolling(self) -> None:
+        if self.rolling:
+            self._ensure_started()
+
+    def stop(self) -> None:
+        self._stopping = True
+        self._wake.set()
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._stopping = False
+                    self._thread = threading.Thread(target=self._run, name="profiler", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        own = threading.get_ident()
+        next_rolling = time.monotonic()
+        while not self._stopping:
+            if self._active:
+                delay = self.interval
+            elif self.rolling:
+                delay = max(0.0, next_rolling - time.monotonic())
+            else:
+                delay = None  # idle until a request is profiled
+            if delay is None or delay > 0:
+                self._wake.wait(delay)
+                self._wake.clear()
+            if self._stopping:
+                break
+
+            started = time.perf_counter()
+            frames = sys._current_frames()
+            if self._active:
+                self._sample_requests(frames)
+            now = time.monotonic()
+            if self.rolling and now >= next_rolling:
+                self._sample_rolling(frames, own)
+                next_rolling = now + self.rolling_interval
+            del frames
+            self.stats["sample_seconds"] += time.perf_counter() - started
+        self._thread = None
+
+    def _sample_requests(self, frames: dict) -> None:
+        with self._lock:
+            task = asyncio.current_task(self._loop) if self._loop is not None else None
+            profile = self._tasks.get(task) if task is not None else None
+            threads = list(self._threads.items())
+        if profile is not None and not profile.finished:
+            frame = frames.get(self._loop_thread)
+            if frame is not None:
+                profile.add(_stack(frame, loop_thread=True))
+                self.stats["request_samples"] += 1
+        for ident, profile in threads:
+            frame = frames.get(ident)
+            if frame is not None and not profile.finished:
+                profile.add(_stack(frame, root=_thread_name(ident)))
+                self.stats["request_samples"] += 1
+
+    def _sample_rolling(self, frames: dict, own: int) -> None:
+        second = int(time.time())
+        if not self._buckets or self._buckets[-1][0] != second:
+            self._buckets.append((second, Counter()))
+            while self._buckets[0][0] <= second - self.rolling_seconds:
+                self._buckets.popleft()
+        bucket = self._buckets[-1][1]
+        for ident, frame in frames.items():
+            if ident == own or frame.f_code.co_filename.startswith(_IDLE_FILES):
+                continue
+            bucket[_stack(frame, root=_thread_name(ident))] += 1
+            self.stats["rolling_samples"] += 1
+
+    def rolling_profile(self, seconds: Optional[int] = None) -> Profile:
+        """The rolling samples of the last `seconds` (default: all kept)."""
+        seconds = min(seconds or self.rolling_seconds, self.rolling_seconds)
+        now = time.time()
+        profile = Profile(f"rolling profile, pid {os.getpid()}", self.rolling_interval)
+        profile.started = now - seconds
+        for second, bucket in list(self._buckets):
+            if second > now - seconds:
+                for stack, count in bucket.items():
+                    profile.add(stack, count)
+        profile.finish()
+        return profile
+
+    def snapshot(self) -> dict:
+        return {
+            "running": self._thread is not None,
+            "profiling_requests": self._active,
+            "rolling_hz": round(1 / self.rolling_interval, 3) if self.rolling else 0,
+            "rolling_seconds_kept": len(self._buckets),
+            **{k: round(v, 3) if isinstance(v, float) else v for k, v in self.stats.items()}
+        }
+
+
+def _thread_name(ident: int) -> str:
+    for thread in threading.enumerate():
+        if thread.ident == ident:
+            return f"thread {thread.name}"
+    return f"thread {ident}"
+
+
+sampler = Sampler(
+    settings.PROFILE_INTERVAL_MS / 1000, settings.PROFILER_ROLLING_HZ, settings.PROFILER_ROLLING_SECONDS
+)
+
+# Profile of the request the current context belongs to
+_current: ContextVar[Optional[Profile]] = ContextVar("current_profile", default=None)
+
+
+def _install_task_factory(loop: asyncio.AbstractEventLoop) -> None:
+    """Have tasks created by a profiled request sampled into its profile too."""
+    previous = loop.get_task_factory()
+
+    def factory(loop, coro, **kwargs):
+        if previous is not None:
+            task = previous(loop, coro, **kwargs)
+        else:
+            task = asyncio.Task(coro, loop=loop, **kwargs)
+        context = kwargs.get("context")
+        profile = context.get(_current) if context is not None else _current.get()
+        if profile is not None:
+            sampler.attach(task, profile)
+        return task
+
+    loop.set_task_factory(factory)
+
+
+def bind_to_request(fn: Callable) -> Callable:
+    """
+    Wrap `fn`, about to run on a worker thread, so that thread is sampled
+    into the current request's profile while it runs. Returns `fn` itself
+    when the request is not being profiled.
+    """
+    profile = _current.get()
+    if profile is None:
+        return fn
+
+    def call():
+        sampler.bind_thread(profile)
+        try:
+            return fn()
+        finally:
+            sampler.unbind_thread()
+    return call
+
+
+# =============================================================================
+# Stored profiles
+# =============================================================================
+
+def _profile_path(profile_id: str) -> str:
+    return os.path.join(settings.PROFILE_DIR, f"{profile_id}.speedscope.json")
+
+
+def store(profile: Profile, profile_id: str) -> str:
+    """Save a profile under PROFILE_DIR, keeping the newest PROFILE_KEEP."""
+    os.makedirs(settings.PROFILE_DIR, exist_ok=True)
+    path = _profile_path(profile_id)
+    with open(path, "w", encoding="utf-8") as f:
+        json.dump(profile.to_speedscope(), f)
+
+    stored = list_stored()
+    for old in stored[settings.PROFILE_KEEP:]:
+        try:
+            os.remove(_profile_path(old["id"]))
+        except OSError:
+            pass
+    return path
+
+
+def list_stored() -> List[dict]:
+    """Stored profiles, newest first."""
+    try:
+        names = os.listdir(settings.PROFILE_DIR)
+    except FileNotFoundError:
+        return []
+    profiles = []
+    for name in names:
+        if name.endswith(".speedscope.json"):
+            path = os.path.join(settings.PROFILE_DIR, name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                continue
+            profiles.append({
+                "id": name[:-len(".speedscope.json")], "created": stat.st_mtime, "bytes": stat.st_size
+            })
+    profiles.sort(key=lambda p: p["created"], reverse=True)
+    return profiles
+
+
+def load(profile_id: str) -> Optional[Profile]:
+    """A stored profile, or None if there is no such (or no valid) id."""
+    try:
+        uuid.UUID(hex=profile_id)
+        with open(_profile_path(profile_id), encoding="utf-8") as f:
+            return Profile.from_speedscope(json.load(f))
+    except (ValueError, OSError, KeyError):
+        return None
+
+
+def dump_rolling() -> Optional[str]:
+    """Save the rolling profile under PROFILE_DIR (e.g. on SIGUSR1) and return its path."""
+    if not sampler.rolling:
+        print("Rolling profiler is off (PROFILER_ROLLING_HZ=0), nothing to dump")
+        return None
+    path = store(sampler.rolling_profile(), uuid.uuid4().hex)
+    print(f"Rolling profile written to {path}")
+    return path
+
+
+# =============================================================================
+# Middleware
+# =============================================================================
+
+_PROFILE_HEADER_KEY = PROFILE_HEADER.lower().encode()
+_PROFILE_ID_HEADER_KEY = PROFILE_ID_HEADER.lower().encode()
+
+
+def _requested_mode(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == _PROFILE_HEADER_KEY:
+            return value.decode("latin-1").strip().lower()
+    query = scope.get("query_string")
+    if query and b"profile=" in query:
+        values = parse_qs(query.decode("latin-1")).get("profile")
+        if values:
+            return values[0].strip().lower()
+    return None
+
+
+def _bearer_token(scope) -> Optional[str]:
+    for name, value in scope["headers"]:
+        if name == b"authorization":
+            scheme, _, token = value.decode("latin-1").partition(" ")
+            if scheme.lower() == "bearer" and token:
+                return token.strip()
+    return None
+
+
+class ProfilerMiddleware:
+    """
+    ASGI middleware profiling requests that ask for it with X-Profile.
+
+    `authorize(token)` decides whether the bearer token may profile;
+    requests from anyone else are served normally, as if no flag was sent.
+    """
+
+    def __init__(self, app, authorize: Callable[[str], Awaitable[bool]]):
+        self.app = app
+        self.authorize = authorize
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+        mode = _requested_mode(scope)
+        if mode not in (MODE_RETURN, MODE_STORE):
+            await self.app(scope, receive, send)
+            return
+        token = _bearer_token(scope)
+        if token is None or not await self.authorize(token):
+            await self.app(scope, receive, send)
+            return
+
+        profile_id = uuid.uuid4().hex
+        profile = Profile(f"{scope['method']} {scope['path']}", sampler.interval)
+        status_code = 500
+
+        async def send_profiled(message):
+            nonlocal status_code
+            if message["type"] == "http.response.start":
+                status_code = message["status"]
+                if mode == MODE_STORE:
+                    message["headers"] = [*message.get("headers", ()), (_PROFILE_ID_HEADER_KEY, profile_id.encode())]
+            if mode == MODE_STORE:
+                await send(message)
+            # In return mode the response is dropped; the profile replaces it
+
+        context_token = _current.set(profile)
+        sampler.begin(profile)
+        try:
+            await self.app(scope, receive, send_profiled)
+        finally:
+            sampler.end(profile)
+            _current.reset(context_token)
+            if mode == MODE_STORE:
+                await asyncio.to_thread(store, profile, profile_id)
+
+        if mode == MODE_RETURN:
+            body = json.dumps(profile.to_speedscope()).encode()
+            await send({
+                "type": "http.response.start",
+                "status": 200,
+                "headers": [
+                    (b"content-type", b"application/json"),
+                    (b"content-length", str(len(body)).encode()),
+                    (b"content-disposition", f'attachment; filename="{profile_id}.speedscope.json"'.encode()),
+                    (_PROFILE_ID_HEADER_KEY, profile_id.encode()),
+                    (b"x-profiled-status", str(status_code).encode())
+                ]
+            })
+            await send({"type": "http.response.body", "body": body})
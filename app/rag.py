@@ -1,114 +1,114 @@
 """
 RAG module - retrieval and prompt building for RAG pipeline.
 """
-from typing import List, Tuple
+from typing import List, NamedTuple, Optional
 
-from sqlalchemy.orm import Session
+from sqlalchemy.ext.asyncio import AsyncSession
 from sqlalchemy import text
 
+from app import metrics
 from app.config import settings
-from app.models import Chunk
 from app.openai_client import get_embedding
+from app.vector_index import apply_search_settings
 
 
-def retrieve_context(
-    db: Session,
+class RetrievedChunk(NamedTuple):
+    """A single retrieval hit, with enough metadata to cite the source."""
+    chunk_id: int
+    document_id: int
+    filename: str
+    score: float
+    snippet: str
+    content: Optional[str] = None
+    start_offset: Optional[int] = None
+    end_offset: Optional[int] = None
+
+    def as_source(self) -> dict:
+        """Public `sources` entry for a chat response."""
+        return {
+            "chunk_id": self.chunk_id,
+            "document_id": self.document_id,
+            "filename": self.filename,
+            "content": self.snippet,
+            "similarity": round(self.score, 3)
+        }
+
+
+# Shared pgvector query used by every retrieval path.
+# Filters by user_id to ensure multi-tenancy isolation, and cuts the
+# source snippet in the database so only the prompt needs full content.
+RETRIEVAL_SQL = text("""
+    SELECT c.id, c.document_id, d.filename,
+           1 - (c.embedding <=> :embedding) AS similarity,
+           left(c.content, :snippet_chars) AS snippet,
+           CASE WHEN :with_content THEN c.content END AS content
+    FROM chunks c
+    JOIN documents d ON c.document_id = d.id
+    WHERE c.user_id = :user_id
+    ORDER BY c.embedding <=> :embedding
+    LIMIT :k
+""")
+
+
+async def retrieve_chunks(
+    db: AsyncSession,
     user_id: int,
-    query: str,
-    k: int = None
-) -> List[Tuple[str, float]]:
+    query: Optional[str] = None,
+    k: int = None,
+    query_embedding: Optional[List[float]] = None,
+    with_content: bool = True
+) -> List[RetrievedChunk]:
     """
     Retrieve top-k relevant chunks for a user's query using pgvector.
     
     IMPORTANT: Only returns chunks belonging to the specified user (multi-tenancy).
     
+    Pass ``query_embedding`` when the caller already embedded the query so
+    the same text is never sent to the embeddings API twice.
+    
     Args:
-        db: Database session
+        db: Async database session
         user_id: The current user's ID
-        query: The search query
+        query: The search query (ignored if query_embedding is given)
         k: Number of results to return (default from settings)
+        query_embedding: Precomputed embedding of the query
+        with_content: Also return full chunk content (needed for prompts)
         
     Returns:
-        List of (chunk_content, similarity_score) tuples
+        List of RetrievedChunk records, best match first
     """
     if k is None:
         k = settings.RETRIEVAL_TOP_K
     
-    # Get query embedding
-    query_embedding = get_embedding(query)
-    
-    # Use pgvector's cosine similarity search
-    # Filter by user_id to ensure multi-tenancy isolation
-    sql = text("""
-        SELECT content, 1 - (embedding <=> :embedding) as similarity
-        FROM chunks
-        WHERE user_id = :user_id
-        ORDER BY embedding <=> :embedding
-        LIMIT :k
-    """)
-    
-    result = db.execute(
-        sql,
-        {
-            "embedding": str(query_embedding),
-            "user_id": user_id,
-            "k": k
-        }
-    )
-    
-    return [(row.content, row.similarity) for row in result]
-
-
-def retrieve_chunks_with_metadata(
-    db: Session,
-    user_id: int,
-    query: str,
-    k: int = None
-) -> List[dict]:
-    """
-    Retrieve chunks with full metadata for a user's query.
+    if query_embedding is None:
+        if query is None:
+            raise ValueError("Either query or query_embedding is required")
+        query_embedding = await get_embedding(query)
     
-    Args:
-        db: Database session
-        user_id: The current user's ID
-        query: The search query
-        k: Number of results to return
+    with metrics.stage("vector_search"):
+        # Per-query ivfflat.probes / hnsw.ef_search from the recall target
+        await apply_search_settings(db, k)
         
-    Returns:
-        List of dicts with chunk info and similarity
-    """
-    if k is None:
-        k = settings.RETRIEVAL_TOP_K
-    
-    query_embedding = get_embedding(query)
-    
-    sql = text("""
-        SELECT c.id, c.content, c.document_id, d.filename,
-               1 - (c.embedding <=> :embedding) as similarity
-        FROM chunks c
-        JOIN documents d ON c.document_id = d.id
-        WHERE c.user_id = :user_id
-        ORDER BY c.embedding <=> :embedding
-        LIMIT :k
-    """)
-    
-    result = db.execute(
-        sql,
-        {
-            "embedding": str(query_embedding),
-            "user_id": user_id,
-            "k": k
-        }
-    )
+        result = await db.execute(
+            RETRIEVAL_SQL,
+            {
+                "embedding": str(query_embedding),
+                "user_id": user_id,
+                "k": k,
+                "snippet_chars": settings.RETRIEVAL_SNIPPET_CHARS,
+                "with_content": with_content
+            }
+        )
     
     return [
-        {
-            "chunk_id": row.id,
-            "content": row.content,
-            "document_id": row.document_id,
-            "filename": row.filename,
-            "similarity": row.similarity
-        }
+        RetrievedChunk(
+            chunk_id=row.id,
+            document_id=row.document_id,
+            filename=row.filename,
+            score=row.similarity,
+            snippet=row.snippet,
+            content=row.content
+        )
         for row in result
     ]
 
@@ -0,0 +1,336 @@
+"""
+OpenAI scheduler - rate-limit-aware admission, adaptive concurrency and retries.
+
+Every OpenAI call goes through a per-model scheduler that:
+- keeps token buckets for requests/minute and tokens/minute, synced from the
+  x-ratelimit-* response headers, and queues calls until budget is available
+- adapts its concurrency limit AIMD-style (+1 per window on success, halved
+  on a 429)
+- retries 429s, connection errors and 5xx with jittered exponential backoff,
+  honouring Retry-After, until the call's deadline
+- admits interactive work ahead of batch work (see app/lanes.py): batch calls
+  wait while any interactive call is queued, must leave OPENAI_BATCH_RESERVE
+  of each budget untouched, and are capped at their lane's concurrency
+- within a lane, shares slots between tenants by weight (TENANT_WEIGHTS): a
+  tenant waits while another queued tenant has fewer weighted calls in flight
+"""
+import asyncio
+import random
+import re
+import time
+from typing import Any, Awaitable, Callable, Dict, Mapping, Optional
+
+import openai
+
+from app.config import settings
+from app.lanes import BATCH, INTERACTIVE, LANES
+
+_DURATION_PART = re.compile(r"(\d+(?:\.\d+)?)(ms|s|m|h)")
+_DURATION_UNITS = {"ms": 0.001, "s": 1.0, "m": 60.0, "h": 3600.0}
+
+
+def parse_duration(value: Optional[str]) -> Optional[float]:
+    """Parse OpenAI reset durations like '20ms', '1s' or '6m0s' into seconds."""
+    if not value:
+        return None
+    parts = _DURATION_PART.findall(value)
+    if not parts:
+        return None
+    return sum(float(amount) * _DURATION_UNITS[unit] for amount, unit in parts)
+
+
+def retry_after(headers: Mapping[str, str]) -> Optional[float]:
+    """Server-requested wait in seconds from retry-after-ms / retry-after headers."""
+    try:
+        if headers.get("retry-after-ms"):
+            return float(headers["retry-after-ms"]) / 1000
+        if headers.get("retry-after"):
+            return float(headers["retry-after"])
+    except ValueError:
+        pass
+    return None
+
+
+def _header_int(headers: Mapping[str, str], name: str) -> Optional[int]:
+    try:
+        return int(headers[name]) if headers.get(name) else None
+    except ValueError:
+        return None
+
+
+class TokenBucket:
+    """A per-minute budget that refills continuously."""
+
+    def __init__(self, per_minute: int):
+        self.capacity = float(per_minute)
+        self.level = float(per_minute)
+        self.updated = time.monotonic()
+
+    def _refill(self) -> None:
+        now = time.monotonic()
+        self.level = min(self.capacity, self.level + (now - self.updated) * self.capacity / 60)
+        self.updated = now
+
+    def wait_time(self, amount: float) -> float:
+        """Seconds until `amount` can be taken (oversized amounts wait for a full bucket)."""
+        self._refill()
+        amount = min(amount, self.capacity)
+        if self.level >= amount:
+            return 0.0
+        return (amount - self.level) * 60 / self.capacity
+
+    def take(self, amount: float) -> None:
+        self._refill()
+        self.level -= amount
+
+    def refund(self, amount: float) -> None:
+        self._refill()
+        self.level = min(self.capacity, self.level + amount)
+
+    def sync(self, limit: Optional[int], remaining: Optional[int]) -> None:
+        """Adopt the server's view of the budget."""
+        self._refill()
+        if limit:
+            self.capacity = float(limit)
+        if remaining is not None:
+            self.level = min(self.level, float(remaining))
+
+
+class ModelScheduler:
+    """Admission control and retries for one OpenAI model."""
+
+    def __init__(self, model: str):
+        self.model = model
+        self.requests = TokenBucket(settings.OPENAI_RPM)
+        self.tokens = TokenBucket(settings.OPENAI_TPM)
+        self.limit = float(settings.OPENAI_INITIAL_CONCURRENCY)
+        self.in_flight = 0
+        self.waiting = 0
+        self.lane_in_flight = {INTERACTIVE: 0, BATCH: 0}
+        self.lane_waiting = {INTERACTIVE: 0, BATCH: 0}
+        self.tenant_in_flight: Dict[int, int] = {}
+        self.tenant_waiting: Dict[str, Dict[int, int]] = {INTERACTIVE: {}, BATCH: {}}
+        self._paused_until = 0.0
+        self._cond = asyncio.Condition()
+        self.stats = {
+            "calls": 0,
+            "retries": 0,
+            "rate_limited": 0,
+            "failed": 0,
+            "queued_seconds": 0.0
+        }
+
+    def _budget_wait(self, tokens: int, lane: str) -> float:
+        """Seconds until the budgets admit this call; batch must leave the reserve intact."""
+        reserve = settings.OPENAI_BATCH_RESERVE if lane == BATCH else 0.0
+        return max(
+            self._paused_until - time.monotonic(),
+            self.requests.wait_time(1 + reserve * self.requests.capacity),
+            self.tokens.wait_time(tokens + reserve * self.tokens.capacity)
+        )
+
+    def _lane_blocked(self, lane: str) -> bool:
+        """Lane cap reached, or batch work yielding to queued interactive work."""
+        if self.lane_in_flight[lane] >= LANES[lane].max_concurrency:
+            return True
+        return lane == BATCH and self.lane_waiting[INTERACTIVE] > 0
+
+    def _weighted_load(self, tenant: int) -> float:
+        return self.tenant_in_flight.get(tenant, 0) / settings.TENANT_WEIGHTS.get(tenant, 1.0)
+
+    def _tenant_blocked(self, tenant: Optional[int], lane: str) -> bool:
+        """Another tenant queued in this lane is further below its fair share."""
+        if tenant is None:
+            return False
+        load = self._weighted_load(tenant)
+        return any(
+            other != tenant and count > 0 and self._weighted_load(other) < load
+            for other, count in self.tenant_waiting[lane].items()
+        )
+
+    def _count(self, counts: Dict[int, int], tenant: Optional[int], delta: int) -> None:
+        if tenant is None:
+            return
+        value = counts.get(tenant, 0) + delta
+        if value:
+            counts[tenant] = value
+        else:
+            counts.pop(tenant, None)
+
+    async def _acquire(self, tokens: int, deadline: float, lane: str, tenant: Optional[int]) -> None:
+        """Wait for a concurrency slot and request/token budget, or raise at the deadline."""
+        started = time.monotonic()
+        async with self._cond:
+            self.waiting += 1
+            self.lane_waiting[lane] += 1
+            self._count(self.tenant_waiting[lane], tenant, 1)
+            LANES[lane].waiting += 1
+            try:
+                while True:
+                    now = time.monotonic()
+                    wait = self._budget_wait(tokens, lane)
+                    if (wait <= 0 and self.in_flight < int(self.limit)
+                            and not self._lane_blocked(lane) and not self._tenant_blocked(tenant, lane)):
+                        self.requests.take(1)
+                        self.tokens.take(tokens)
+                        self.in_flight += 1
+                        self.lane_in_flight[lane] += 1
+                        LANES[lane].in_flight += 1
+                        self._count(self.tenant_in_flight, tenant, 1)
+                        self.stats["queued_seconds"] += now - started
+                        LANES[lane].record_wait(now - started)
+                        return
+                    remaining = deadline - now
+                    if remaining <= 0:
+                        raise TimeoutError(f"OpenAI {self.model} capacity not available before deadline")
+                    try:
+                        await asyncio.wait_for(self._cond.wait(), min(remaining, wait) if wait > 0 else remaining)
+                    except asyncio.TimeoutError:
+                        pass
+            finally:
+                self.waiting -= 1
+                self.lane_waiting[lane] -= 1
+                self._count(self.tenant_waiting[lane], tenant, -1)
+                LANES[lane].waiting -= 1
+                if tenant is not None:
+                    # Tenants held back by this one's place in the queue may proceed
+                    self._cond.notify_all()
+
+    async def _release(
+        self,
+        lane: str,
+        tenant: Optional[int],
+        rate_limited: bool = False,
+        succeeded: bool = False
+    ) -> None:
+        """Free the slot and adjust the concurrency limit (AIMD)."""
+        async with self._cond:
+            self.in_flight -= 1
+            self.lane_in_flight[lane] -= 1
+            LANES[lane].in_flight -= 1
+            self._count(self.tenant_in_flight, tenant, -1)
+            if rate_limited:
+                self.limit = max(settings.OPENAI_MIN_CONCURRENCY, self.limit / 2)
+            elif succeeded:
+                self.limit = min(settings.OPENAI_MAX_CONCURRENCY, self.limit + 1 / self.limit)
+            self._cond.notify_all()
+
+    def observe(self, headers: Mapping[str, str]) -> None:
+        """Sync the budgets from x-ratelimit-* response headers."""
+        self.requests.sync(
+            _header_int(headers, "x-ratelimit-limit-requests"),
+            _header_int(headers, "x-ratelimit-remaining-requests")
+        )
+        self.tokens.sync(
+            _header_int(headers, "x-ratelimit-limit-tokens"),
+            _header_int(headers, "x-ratelimit-remaining-tokens")
+        )
+
+    def reconcile(self, estimated: int, actual: Optional[int]) -> None:
+        """Correct the token budget once the real usage is known."""
+        if actual is not None:
+            self.tokens.refund(estimated - actual)
+
+    async def run(
+        self,
+        call: Callable[[], Awaitable[Any]],
+        tokens: int,
+        lane: str = INTERACTIVE,
+        tenant: Optional[int] = None,
+        timeout: Optional[float] = None
+    ) -> Any:
+        """
+        Run an OpenAI raw-response call under the model's budgets.
+
+        Args:
+            call: Zero-argument coroutine function returning a raw response
+                (client.<resource>.with_raw_response.create(...))
+            tokens: Estimated tokens the call will consume
+            lane: INTERACTIVE or BATCH (see app/lanes.py)
+            tenant: User id the call is made for, for weighted sharing
+                (None for calls shared between users, e.g. micro-batches)
+            timeout: Deadline in seconds (default OPENAI_REQUEST_DEADLINE_SECONDS)
+
+        Returns:
+            The raw response
+
+        Raises:
+            TimeoutError: If no capacity frees up before the deadline
+            openai.APIError: The last error if retries run out before the deadline
+        """
+        if timeout is None:
+            timeout = settings.OPENAI_REQUEST_DEADLINE_SECONDS
+        deadline = time.monotonic() + timeout
+        self.stats["calls"] += 1
+        attempt = 0
+
+        while True:
+            await self._acquire(tokens, deadline, lane, tenant)
+            pause = None
+            try:
+                raw = await call()
+            except openai.RateLimitError as e:
+                self.stats["rate_limited"] += 1
+                self.observe(e.response.headers)
+                pause = retry_after(e.response.headers)
+                await self._release(lane, tenant, rate_limited=True)
+                error = e
+            except (openai.APIConnectionError, openai.InternalServerError) as e:
+                await self._release(lane, tenant)
+                error = e
+            except BaseException:
+                await self._release(lane, tenant)
+                self.stats["failed"] += 1
+                raise
+            else:
+                self.observe(raw.headers)
+                await self._release(lane, tenant, succeeded=True)
+                return raw
+
+            # Full-jitter exponential backoff, or the server's Retry-After plus jitter
+            attempt += 1
+            backoff = min(settings.OPENAI_RETRY_MAX_SECONDS, settings.OPENAI_RETRY_BASE_SECONDS * 2 ** attempt)
+            if pause is not None:
+                self._paused_until = max(self._paused_until, time.monotonic() + pause)
+                delay = pause + random.uniform(0, settings.OPENAI_RETRY_BASE_SECONDS)
+            else:
+                delay = random.uniform(0, backoff)
+            if time.monotonic() + delay >= deadline:
+                self.stats["failed"] += 1
+                raise error
+            self.stats["retries"] += 1
+            await asyncio.sleep(delay)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "queued_seconds": round(self.stats["queued_seconds"], 3),
+            "concurrency_limit": round(self.limit, 2),
+            "in_flight": self.in_flight,
+            "waiting": self.waiting,
+            "lane_in_flight": dict(self.lane_in_flight),
+            "lane_waiting": dict(self.lane_waiting),
+            "tenants_in_flight": len(self.tenant_in_flight),
+            "requests_budget": round(self.requests.level, 1),
+            "tokens_budget": round(self.tokens.level, 1)
+        }
+
+
+_schedulers: Dict[str, ModelScheduler] = {}
+
+
+def get_scheduler(model: str) -> ModelScheduler:
+    """Scheduler for a model, created on first use."""
+    scheduler = _schedulers.get(model)
+    if scheduler is None:
+        scheduler = _schedulers[model] = ModelScheduler(model)
+    return scheduler
+
+
+def scheduler_stats() -> Dict[str, dict]:
+    return {model: s.snapshot() for model, s in _schedulers.items()}
+
+
+def estimate_tokens(text: str) -> int:
+    """Rough token count (~4 characters per token) for budgeting before the call."""
+    return max(1, len(text) // 4)
@@ -1,17 +1,24 @@
 """
-S3 utilities - upload and retrieve PDFs from AWS S3.
+S3 utilities - upload, retrieve and delete PDFs in AWS S3.
+
+boto3 is blocking, so each call runs in a worker thread to keep the event
+loop free. A single client is shared (boto3 clients are thread-safe).
 """
+import asyncio
 import uuid
-from typing import Optional
+from functools import lru_cache
+from typing import Dict, List, Optional
 
 import boto3
-from botocore.exceptions import ClientError
+from botocore.exceptions import BotoCoreError, ClientError
 
+from app import metrics
 from app.config import settings
 
 
+@lru_cache(maxsize=1)
 def get_s3_client():
-    """Create and return an S3 client."""
+    """Create (once) and return the shared S3 client."""
     return boto3.client(
         "s3",
         region_name=settings.AWS_REGION,
@@ -20,7 +27,13 @@ def get_s3_client():
     )
 
 
-def upload_pdf_to_s3(file_bytes: bytes, filename: str, user_id: int) -> str:
+async def _in_thread(fn, *args, **kwargs):
+    """Run a blocking boto3 call in a worker thread, timed as the s3 stage."""
+    with metrics.stage("s3", **{"s3.operation": fn.__name__}):
+        return await asyncio.to_thread(fn, *args, **kwargs)
+
+
+async def upload_pdf_to_s3(file_bytes: bytes, filename: str, user_id: int) -> str:
     """
     Upload a PDF file to S3.
     
@@ -38,7 +51,8 @@ def upload_pdf_to_s3(file_bytes: bytes, filename: str, user_id: int) -> str:
     unique_id = str(uuid.uuid4())[:8]
     s3_key = f"users/{user_id}/{unique_id}_{filename}"
     
-    s3_client.put_object(
+    await _in_thread(
+        s3_client.put_object,
         Bucket=settings.AWS_S3_BUCKET,
         Key=s3_key,
         Body=file_bytes,
@@ -48,7 +62,26 @@ def upload_pdf_to_s3(file_bytes: bytes, filename: str, user_id: int) -> str:
     return s3_key
 
 
-def get_pdf_presigned_url(s3_key: str, expiration: int = 3600) -> Optional[str]:
+async def download_pdf_from_s3(s3_key: str) -> bytes:
+    """
+    Download a PDF file from S3.
+    
+    Args:
+        s3_key: The S3 key of the file
+        
+    Returns:
+        The PDF file content as bytes
+    """
+    s3_client = get_s3_client()
+    
+    def get_object() -> bytes:
+        response = s3_client.get_object(Bucket=settings.AWS_S3_BUCKET, Key=s3_key)
+        return response["Body"].read()
+    
+    return await _in_thread(get_object)
+
+
+async def get_pdf_presigned_url(s3_key: str, expiration: int = 3600) -> Optional[str]:
     """
     Generate a presigned URL for downloading a PDF.
     
@@ -62,7 +95,8 @@ def get_pdf_presigned_url(s3_key: str, expiration: int = 3600) -> Optional[str]:
     s3_client = get_s3_client()
     
     try:
-        url = s3_client.generate_presigned_url(
+        url = await _in_thread(
+            s3_client.generate_presigned_url,
             "get_object",
             Params={
                 "Bucket": settings.AWS_S3_BUCKET,
@@ -75,7 +109,7 @@ def get_pdf_presigned_url(s3_key: str, expiration: int = 3600) -> Optional[str]:
         return None
 
 
-def delete_pdf_from_s3(s3_key: str) -> bool:
+async def delete_pdf_from_s3(s3_key: str) -> bool:
     """
     Delete a PDF file from S3.
     
@@ -88,10 +122,40 @@ def delete_pdf_from_s3(s3_key: str) -> bool:
     s3_client = get_s3_client()
     
     try:
-        s3_client.delete_object(
+        await _in_thread(
+            s3_client.delete_object,
             Bucket=settings.AWS_S3_BUCKET,
             Key=s3_key
         )
         return True
     except ClientError:
         return False
+
+
+async def delete_pdfs_from_s3(s3_keys: List[str]) -> Dict[str, str]:
+    """
+    Delete up to 1000 PDF files from S3 in one request.
+    
+    Args:
+        s3_keys: The S3 keys of the files to delete
+        
+    Returns:
+        Error message by S3 key for the objects that could not be deleted
+        (empty if all were deleted)
+    """
+    s3_client = get_s3_client()
+    
+    try:
+        response = await _in_thread(
+            s3_client.delete_objects,
+            Bucket=settings.AWS_S3_BUCKET,
+            Delete={"Objects": [{"Key": key} for key in s3_keys], "Quiet": True}
+        )
+    except (ClientError, BotoCoreError) as e:
+        # BotoCoreError: endpoint unreachable, timeouts, credentials
+        return {key: str(e) for key in s3_keys}
+    
+    return {
+        error["Key"]: f"{error.get('Code')}: {error.get('Message')}"
+        for error in response.get("Errors", [])
+    }
@@ -1,21 +1,42 @@
 """
-Security module - password hashing and JWT token management.
+Security module - password hashing, JWT token management and the
+authenticated principal.
+
+bcrypt runs in a small process pool (PASSWORD_HASH_WORKERS) so a login
+spike cannot occupy the event loop's threads; once PASSWORD_HASH_MAX_QUEUE
+calls are waiting, further calls fail fast with PasswordHasherBusy (503).
+
+Authenticated requests resolve to a Principal (id, email) rather than an
+ORM User. Principals are cached per process for AUTH_PRINCIPAL_CACHE_TTL_SECONDS,
+so most requests authenticate without a DB round trip. The cache entry is
+dropped when the user row is deleted or its password changes through the
+ORM; bulk DELETE/UPDATE statements must call invalidate_principal()
+themselves. Other workers catch up when their entries expire.
 """
+import asyncio
+import multiprocessing
+import time
+from collections import OrderedDict
+from concurrent.futures import ProcessPoolExecutor
 from datetime import datetime, timedelta
-from typing import Optional
+from typing import NamedTuple, Optional
 
 from passlib.context import CryptContext
 from jose import JWTError, jwt
 from fastapi import Depends, HTTPException, status
 from fastapi.security import HTTPBearer, HTTPAuthorizationCredentials
-from sqlalchemy.orm import Session
+from sqlalchemy import event, inspect
 
 from app.config import settings
-from app.db import get_db
+from app.db import get_async_db_context
 from app.models import User
 
-# Password hashing context
-pwd_context = CryptContext(schemes=["bcrypt"], deprecated="auto")
+# Password hashing context (hashes with a different cost still verify)
+pwd_context = CryptContext(
+    schemes=["bcrypt"],
+    deprecated="auto",
+    bcrypt__rounds=settings.BCRYPT_ROUNDS
+)
 
 # HTTP Bearer token scheme
 security = HTTPBearer()
@@ -31,13 +52,111 @@ def verify_password(plain_password: str, hashed_password: str) -> bool:
     return pwd_context.verify(plain_password, hashed_password)
 
 
-def create_access_token(user_id: int, expires_delta: Optional[timedelta] = None) -> str:
+def _warm_worker() -> None:
+    """Runs once per pool process at startup so the first login pays no spawn cost."""
+
+
+class PasswordHasherBusy(Exception):
+    """Too many password hashes are already queued."""
+
+
+class PasswordPool:
+    """
+    Bounded process pool for bcrypt.
+    
+    At most `workers` hashes run at once and `max_queue` more may wait;
+    anything beyond that is rejected instead of queueing without bound.
+    """
+
+    def __init__(self, workers: int, max_queue: int):
+        self.workers = workers
+        self.max_queue = max_queue
+        self.in_flight = 0
+        self._executor = None
+        self.stats = {"calls": 0, "rejected": 0, "seconds": 0.0}
+
+    def _get_executor(self) -> ProcessPoolExecutor:
+        # Created on first use; spawn avoids forking a process that runs threads
+        if self._executor is None:
+            self._executor = ProcessPoolExecutor(
+                max_workers=self.workers,
+                mp_context=multiprocessing.get_context("spawn")
+            )
+        return self._executor
+
+    def start(self) -> None:
+        """Spawn the worker processes ahead of the first login."""
+        executor = self._get_executor()
+        for _ in range(self.workers):
+            executor.submit(_warm_worker)
+
+    async def run(self, fn, *args):
+        """
+        Run a password function in the pool.
+        
+        Raises:
+            PasswordHasherBusy: If the queue is already full
+        """
+        if self.in_flight >= self.workers + self.max_queue:
+            self.stats["rejected"] += 1
+            raise PasswordHasherBusy()
+        self.in_flight += 1
+        self.stats["calls"] += 1
+        started = time.perf_counter()
+        try:
+            loop = asyncio.get_running_loop()
+            return await loop.run_in_executor(self._get_executor(), fn, *args)
+        finally:
+            self.in_flight -= 1
+            self.stats["seconds"] += time.perf_counter() - started
+
+    @property
+    def queue_depth(self) -> int:
+        """Calls admitted but waiting for a free worker process."""
+        return max(0, self.in_flight - self.workers)
+
+    def shutdown(self) -> None:
+        if self._executor is not None:
+            self._executor.shutdown(wait=False, cancel_futures=True)
+            self._executor = None
+
+    def snapshot(self) -> dict:
+        return {
+            "workers": self.workers,
+            "max_queue": self.max_queue,
+            "in_flight": self.in_flight,
+            "queue_depth": self.queue_depth,
+            "calls": self.stats["calls"],
+            "rejected": self.stats["rejected"],
+            "avg_ms": round(self.stats["seconds"] / max(self.stats["calls"], 1) * 1000, 1)
+        }
+
+
+password_pool = PasswordPool(settings.PASSWORD_HASH_WORKERS, settings.PASSWORD_HASH_MAX_QUEUE)
+
+
+async def hash_password_async(password: str) -> str:
+    """hash_password in the password pool."""
+    return await password_pool.run(hash_password, password)
+
+
+async def verify_password_async(plain_password: str, hashed_password: str) -> bool:
+    """verify_password in the password pool."""
+    return await password_pool.run(verify_password, plain_password, hashed_password)
+
+
+def create_access_token(
+    user_id: int,
+    expires_delta: Optional[timedelta] = None,
+    email: Optional[str] = None
+) -> str:
     """
     Create a JWT access token for a user.
     
     Args:
         user_id: The user's database ID
         expires_delta: Optional custom expiration time
+        email: Included as a claim for endpoints that trust token claims
         
     Returns:
         Encoded JWT token string
@@ -52,6 +171,8 @@ def create_access_token(user_id: int, expires_delta: Optional[timedelta] = None)
         "exp": expire,
         "iat": datetime.utcnow()
     }
+    if email:
+        to_encode["email"] = email
     
     encoded_jwt = jwt.encode(
         to_encode,
@@ -61,7 +182,13 @@ def create_access_token(user_id: int, expires_delta: Optional[timedelta] = None)
     return encoded_jwt
 
 
-def decode_token(token: str) -> Optional[int]:
+class Principal(NamedTuple):
+    """The authenticated user, as much of it as request handlers need."""
+    id: int
+    email: Optional[str]
+
+
+def decode_token(token: str) -> Optional[dict]:
     """
     Decode and validate a JWT token.
     
@@ -69,7 +196,7 @@ def decode_token(token: str) -> Optional[int]:
         token: The JWT token string
         
     Returns:
-        User ID if valid, None otherwise
+        The token's claims if valid (with an integer "sub"), None otherwise
     """
     try:
         payload = jwt.decode(
@@ -80,35 +207,161 @@ def decode_token(token: str) -> Optional[int]:
         user_id = payload.get("sub")
         if user_id is None:
             return None
-        return int(user_id)
-    except JWTError:
+        payload["sub"] = int(user_id)
+        return payload
+    except (JWTError, ValueError):
         return None
 
 
-def get_current_user(
-    credentials: HTTPAuthorizationCredentials = Depends(security),
-    db: Session = Depends(get_db)
-) -> User:
+class PrincipalCache:
+    """TTL- and size-bounded cache of principals keyed by user id."""
+
+    def __init__(self, ttl_seconds: float, max_size: int):
+        self.ttl = ttl_seconds
+        self.max_size = max_size
+        self._entries: "OrderedDict[int, tuple]" = OrderedDict()
+        self.stats = {"hits": 0, "misses": 0, "invalidations": 0}
+
+    def get(self, user_id: int) -> Optional[Principal]:
+        entry = self._entries.get(user_id)
+        if entry is None or entry[1] < time.monotonic():
+            self.stats["misses"] += 1
+            return None
+        self._entries.move_to_end(user_id)
+        self.stats["hits"] += 1
+        return entry[0]
+
+    def put(self, principal: Principal) -> None:
+        if self.ttl <= 0:
+            return
+        self._entries[principal.id] = (principal, time.monotonic() + self.ttl)
+        self._entries.move_to_end(principal.id)
+        while len(self._entries) > self.max_size:
+            self._entries.popitem(last=False)
+
+    def invalidate(self, user_id: int) -> None:
+        if self._entries.pop(user_id, None) is not None:
+            self.stats["invalidations"] += 1
+
+    def snapshot(self) -> dict:
+        return {**self.stats, "size": len(self._entries), "ttl_seconds": self.ttl}
+
+
+principal_cache = PrincipalCache(
+    settings.AUTH_PRINCIPAL_CACHE_TTL_SECONDS,
+    settings.AUTH_PRINCIPAL_CACHE_SIZE
+)
+
+
+def invalidate_principal(user_id: int) -> None:
+    """Drop a user's cached principal (after deleting the user or changing credentials)."""
+    principal_cache.invalidate(user_id)
+
+
+@event.listens_for(User, "after_delete")
+def _invalidate_deleted_user(mapper, connection, target):
+    invalidate_principal(target.id)
+
+
+@event.listens_for(User, "after_update")
+def _invalidate_changed_user(mapper, connection, target):
+    state = inspect(target)
+    if state.attrs.hashed_password.history.has_changes() or state.attrs.email.history.has_changes():
+        invalidate_principal(target.id)
+
+
+credentials_exception = HTTPException(
+    status_code=status.HTTP_401_UNAUTHORIZED,
+    detail="Could not validate credentials",
+    headers={"WWW-Authenticate": "Bearer"},
+)
+
+
+async def get_current_user(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
     """
     FastAPI dependency to get the current authenticated user.
     
+    The user row is only read on a principal cache miss.
+    
     Raises:
         HTTPException: 401 if token is invalid or user not found
     """
-    credentials_exception = HTTPException(
-        status_code=status.HTTP_401_UNAUTHORIZED,
-        detail="Could not validate credentials",
-        headers={"WWW-Authenticate": "Bearer"},
-    )
+    principal = await authenticate(credentials.credentials)
+    if principal is None:
+        raise credentials_exception
+    return principal
+
+
+async def authenticate(token: str) -> Optional[Principal]:
+    """
+    Resolve a bearer token to the principal it was issued to.
     
-    token = credentials.credentials
-    user_id = decode_token(token)
+    The user row is only read on a principal cache miss.
     
-    if user_id is None:
-        raise credentials_exception
+    Returns:
+        The principal, or None if the token is invalid or the user is gone
+    """
+    claims = decode_token(token)
+    if claims is None:
+        return None
+    user_id = claims["sub"]
+    
+    principal = principal_cache.get(user_id)
+    if principal is not None:
+        return principal
+    
+    async with get_async_db_context() as db:
+        user = await db.get(User, user_id)
+        if user is None:
+            return None
+        principal = Principal(id=user.id, email=user.email)
+    
+    principal_cache.put(principal)
+    return principal
+
+
+def is_admin(principal: Principal) -> bool:
+    """Admins are the users whose email is listed in ADMIN_EMAILS."""
+    return principal.email.lower() in settings.ADMIN_EMAILS
+
+
+async def get_current_reader(
+    credentials: HTTPAuthorizationCredentials = Depends(security)
+) -> Principal:
+    """
+    FastAPI dependency for read-only endpoints.
+    
+    With AUTH_TRUST_TOKEN_CLAIMS on, the verified token's claims are trusted
+    without checking that the user still exists: a deleted user's token
+    keeps working until it expires, but only ever sees that user's own
+    (already deleted) data. Otherwise behaves like get_current_user.
     
-    user = db.query(User).filter(User.id == user_id).first()
-    if user is None:
+    Raises:
+        HTTPException: 401 if token is invalid or user not found
+    """
+    if not settings.AUTH_TRUST_TOKEN_CLAIMS:
+        return await get_current_user(credentials)
+    
+    claims = decode_token(credentials.credentials)
+    if claims is None:
         raise credentials_exception
+    return Principal(id=claims["sub"], email=claims.get("email"))
+
+
+async def get_current_admin(current_user: Principal = Depends(get_current_user)) -> Principal:
+    """
+    FastAPI dependency for admin-only endpoints.
     
-    return user
+    Admins are the users whose email is listed in ADMIN_EMAILS.
+    
+    Raises:
+        HTTPException: 403 if the current user is not an admin
+    """
+    if not is_admin(current_user):
+        raise HTTPException(
+            status_code=status.HTTP_403_FORBIDDEN,
+            detail="Admin access required"
+        )
+    return current_user
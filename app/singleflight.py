@@ -0,0 +1,57 @@
+"""
+Single-flight - share one in-flight call between concurrent identical requests.
+
+When several coroutines ask for the same key at once (a popular question
+hitting a shared corpus, or a client retrying on timeout), only the first
+runs the upstream call; the rest wait for and share its result.
+"""
+import asyncio
+import hashlib
+import json
+from typing import Any, Awaitable, Callable, Dict, Hashable
+
+
+class SingleFlight:
+    """
+    Deduplicates concurrent calls by key.
+
+    A key is only shared while its call is in flight; results are not cached
+    afterwards. A waiter that is cancelled does not cancel the shared call.
+    """
+
+    def __init__(self):
+        self._inflight: Dict[Hashable, asyncio.Task] = {}
+        self.stats = {"calls": 0, "upstream": 0, "coalesced": 0}
+
+    async def do(self, key: Hashable, fn: Callable[[], Awaitable[Any]]) -> Any:
+        """
+        Run `fn` for `key`, or join the identical call already in flight.
+
+        Args:
+            key: Identity of the call (model, normalized input, context hash)
+            fn: Zero-argument coroutine function making the upstream call
+
+        Returns:
+            The shared result
+        """
+        self.stats["calls"] += 1
+        task = self._inflight.get(key)
+        if task is None:
+            self.stats["upstream"] += 1
+            task = asyncio.ensure_future(fn())
+            self._inflight[key] = task
+            task.add_done_callback(lambda _: self._inflight.pop(key, None))
+        else:
+            self.stats["coalesced"] += 1
+        return await asyncio.shield(task)
+
+
+def normalize_text(text: str) -> str:
+    """Collapse whitespace so trivially different inputs share a key."""
+    return " ".join(text.split())
+
+
+def content_hash(value: Any) -> str:
+    """Stable hash of a JSON-serializable value (e.g. a prompt with its context)."""
+    encoded = json.dumps(value, sort_keys=True, separators=(",", ":")).encode()
+    return hashlib.sha256(encoded).hexdigest()
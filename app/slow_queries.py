@@ -0,0 +1,323 @@
+"""
+Slow query module - per-statement timing, sampled EXPLAIN capture and
+top offenders per query shape.
+
+Every SQL statement run on an instrumented engine is timed and counted
+under its fingerprint: the statement with literals and bind parameters
+replaced by `?` and IN lists collapsed, so all executions of the same
+query shape share one entry whatever their parameters.
+
+A SELECT slower than SLOW_QUERY_MS is, with probability
+SLOW_QUERY_EXPLAIN_SAMPLE_RATE and at most once per shape every
+SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS, explained again on the same
+connection, right after the original statement, so it sees the same
+transaction and the same `SET LOCAL ivfflat.probes` / `hnsw.ef_search`
+(app/vector_index.py). Only pgvector searches are re-executed, as
+`EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON)`; other slow reads get a plain
+`EXPLAIN (FORMAT JSON)`, which plans without running them. Statements with
+side effects or locks (`nextval`, `setval`, `set_config`, `FOR UPDATE` /
+`FOR SHARE`, data-modifying CTEs) are never explained. The EXPLAIN runs
+inside a savepoint that is always rolled back, so neither its effects nor
+a failure can leak into the caller's transaction; an EXPLAIN ANALYZE does
+add its own execution time to that one request. From the plan we record
+whether a vector index scan served the `ORDER BY embedding <=> ...` (a
+pgvector search that fell back to a sequential scan shows up as
+`vector_index_used: false`), the sequential scans, buffer hits and reads.
+
+Statistics are kept per worker process, like the /admin statistics, and
+listed by GET /admin/slow-queries.
+"""
+import hashlib
+import json
+import random
+import re
+import threading
+import time
+from typing import Dict, List, Optional
+
+from sqlalchemy import event
+
+from app.config import settings
+
+# pgvector distance operators (cosine, L2, inner product)
+_VECTOR_OPERATORS = ("<=>", "<->", "<#>")
+
+# Reads with side effects or row locks, which must never run a second time
+_NOT_EXPLAINABLE = re.compile(
+    r"\b(?:nextval|setval|set_config)\s*\(|\bFOR\s+(?:NO\s+KEY\s+)?(?:UPDATE|SHARE|KEY\s+SHARE)\b"
+    r"|\b(?:INSERT|UPDATE|DELETE|MERGE)\b",
+    re.I
+)
+
+_COMMENT = re.compile(r"--[^\n]*|/\*.*?\*/", re.S)
+_STRING = re.compile(r"'(?:[^']|'')*'")
+_BIND = re.compile(r"%\(\w+\)s|%s|\$\d+|(?<![:\w]):\w+")
+_NUMBER = re.compile(r"(?<![\w.])-?\d+(?:\.\d+)?(?:e[-+]?\d+)?\b", re.I)
+_LIST = re.compile(r"\?(?:\s*,\s*\?)+")
+_SPACE = re.compile(r"\s+")
+
+# statement -> (fingerprint, normalized statement); the same compiled SQL
+# strings recur, so normalizing is paid once per distinct statement
+_fingerprints: Dict[str, tuple] = {}
+_FINGERPRINT_CACHE_SIZE = 2000
+
+
+def normalize(statement: str) -> str:
+    """The query shape of a statement: literals and bind parameters become `?`."""
+    shape = _COMMENT.sub(" ", statement)
+    shape = _STRING.sub("?", shape)
+    shape = _BIND.sub("?", shape)
+    shape = _NUMBER.sub("?", shape)
+    shape = _LIST.sub("?, ...", shape)
+    return _SPACE.sub(" ", shape).strip()
+
+
+def fingerprint(statement: str) -> tuple:
+    """(fingerprint, normalized statement) of a statement."""
+    cached = _fingerprints.get(statement)
+    if cached is None:
+        if len(_fingerprints) >= _FINGERPRINT_CACHE_SIZE:
+            _fingerprints.clear()
+        shape = normalize(statement)
+        cached = _fingerprints[statement] = (hashlib.sha1(shape.encode()).hexdigest()[:16], shape)
+    return cached
+
+
+def summarize_plan(plan: dict, statement: str) -> dict:
+    """
+    What an EXPLAIN (FORMAT JSON) plan says about a query.
+
+    Timings, buffers and row counts are None unless the plan came from
+    EXPLAIN (ANALYZE, BUFFERS, ...).
+
+    Args:
+        plan: The plan document (the first element of EXPLAIN's JSON output)
+        statement: The statement explained, to tell whether it is a vector search
+
+    Returns:
+        Timings, buffers, node types, index and sequential scans, and
+        `vector_index_used` (None for queries that are not vector searches)
+    """
+    nodes: List[dict] = []
+
+    def walk(node: dict) -> None:
+        nodes.append(node)
+        for child in node.get("Plans", ()):
+            walk(child)
+
+    root = plan["Plan"]
+    walk(root)
+
+    vector_search = any(op in statement for op in _VECTOR_OPERATORS)
+    vector_index_used = None
+    if vector_search:
+        vector_index_used = any(
+            "Index" in node["Node Type"] and any(op in node.get("Order By", "") for op in _VECTOR_OPERATORS)
+            for node in nodes
+        )
+    return {
+        "execution_ms": plan.get("Execution Time"),
+        "planning_ms": plan.get("Planning Time"),
+        "vector_index_used": vector_index_used,
+        "index_scans": sorted({
+            f"{node['Index Name']} on {node.get('Relation Name', '?')}" for node in nodes if "Index Name" in node
+        }),
+        "seq_scans": sorted({node.get("Relation Name", "?") for node in nodes if node["Node Type"] == "Seq Scan"}),
+        "node_types": sorted({node["Node Type"] for node in nodes}),
+        "shared_hit_blocks": root.get("Shared Hit Blocks"),
+        "shared_read_blocks": root.get("Shared Read Blocks"),
+        "rows": root.get("Actual Rows")
+    }
+
+
+class QueryShape:
+    """Timings of one query shape, and its last captured plan."""
+
+    def __init__(self, fp: str, statement: str):
+        self.fingerprint = fp
+        self.statement = statement
+        self.pools = set()
+        self.calls = 0
+        self.total = 0.0
+        self.max = 0.0
+        self.slow_calls = 0
+        self.slow_total = 0.0
+        self.last_slow_at: Optional[float] = None
+        self.explains = 0
+        self.vector_index_misses = 0
+        self.last_explain_at = 0.0
+        self.last_plan: Optional[dict] = None
+        self.last_plan_summary: Optional[dict] = None
+
+    def snapshot(self, with_plan: bool = False) -> dict:
+        data = {
+            "fingerprint": self.fingerprint,
+            "statement": self.statement[:2000],
+            "pools": sorted(self.pools),
+            "calls": self.calls,
+            "avg_ms": round(self.total / max(self.calls, 1) * 1000, 3),
+            "max_ms": round(self.max * 1000, 3),
+            "slow_calls": self.slow_calls,
+            "slow_total_ms": round(self.slow_total * 1000, 3),
+            "last_slow_at": self.last_slow_at,
+            "explains": self.explains,
+            "vector_index_misses": self.vector_index_misses,
+            "last_plan_summary": self.last_plan_summary
+        }
+        if with_plan:
+            data["last_plan"] = self.last_plan
+        return data
+
+
+class SlowQueryLog:
+    """Per-shape statement timings with sampled EXPLAIN of slow SELECTs."""
+
+    def __init__(self, threshold_ms: float, explain_sample_rate: float, explain_interval: float, max_shapes: int):
+        self.threshold = threshold_ms / 1000
+        self.explain_sample_rate = explain_sample_rate
+        self.explain_interval = explain_interval
+        self.max_shapes = max_shapes
+        self._shapes: Dict[str, QueryShape] = {}
+        self._lock = threading.Lock()
+        self.stats = {"statements": 0, "slow": 0, "explained": 0, "explain_failures": 0, "untracked_shapes": 0}
+
+    def _shape(self, statement: str) -> Optional[QueryShape]:
+        fp, shape_text = fingerprint(statement)
+        shape = self._shapes.get(fp)
+        if shape is None:
+            with self._lock:
+                shape = self._shapes.get(fp)
+                if shape is None:
+                    if len(self._shapes) >= self.max_shapes:
+                        self.stats["untracked_shapes"] += 1
+                        return None
+                    shape = self._shapes[fp] = QueryShape(fp, shape_text)
+        return shape
+
+    def record(self, conn, statement: str, parameters, seconds: float, pool_name: str, executemany: bool) -> None:
+        """Record one execution; capture a plan if it was slow and is sampled."""
+        self.stats["statements"] += 1
+        shape = self._shape(statement)
+        if shape is None:
+            return
+        shape.calls += 1
+        shape.total += seconds
+        shape.max = max(shape.max, seconds)
+        shape.pools.add(pool_name)
+        if seconds < self.threshold:
+            return
+
+        self.stats["slow"] += 1
+        shape.slow_calls += 1
+        shape.slow_total += seconds
+        shape.last_slow_at = time.time()
+        explain = None if executemany else self._explain_command(statement)
+        if explain is None:
+            return
+        now = time.monotonic()
+        if now - shape.last_explain_at < self.explain_interval or random.random() >= self.explain_sample_rate:
+            return
+        shape.last_explain_at = now
+        self._explain(conn, shape, explain, statement, parameters, seconds, pool_name)
+
+    @staticmethod
+    def _explain_command(statement: str) -> Optional[str]:
+        """The EXPLAIN prefix to use for a slow statement, or None to leave it alone."""
+        head = statement.lstrip()[:6].upper()
+        if not (head == "SELECT" or (head.startswith("WITH") and "SELECT" in statement.upper())):
+            return None
+        if _NOT_EXPLAINABLE.search(_STRING.sub("''", _COMMENT.sub(" ", statement))):
+            return None
+        # ANALYZE executes the statement again: only worth it for vector searches,
+        # where the plan alone cannot show how many rows the index scan returned
+        if any(op in statement for op in _VECTOR_OPERATORS):
+            return "EXPLAIN (ANALYZE, BUFFERS, FORMAT JSON) "
+        return "EXPLAIN (FORMAT JSON) "
+
+    def _explain(
+        self, conn, shape: QueryShape, explain: str, statement: str, parameters, seconds: float, pool_name: str
+    ) -> None:
+        cursor = conn.connection.cursor()
+        try:
+            cursor.execute("SAVEPOINT slow_query_explain")
+            try:
+                cursor.execute(explain + statement, parameters)
+                output = cursor.fetchone()[0]
+            finally:
+                cursor.execute("ROLLBACK TO SAVEPOINT slow_query_explain")
+                cursor.execute("RELEASE SAVEPOINT slow_query_explain")
+        except Exception as e:
+            self.stats["explain_failures"] += 1
+            print(f"Slow query {shape.fingerprint}: EXPLAIN failed: {e}")
+            return
+        finally:
+            cursor.close()
+
+        plan = (json.loads(output) if isinstance(output, str) else output)[0]
+        summary = summarize_plan(plan, statement)
+        shape.explains += 1
+        shape.last_plan = plan
+        shape.last_plan_summary = summary
+        if summary["vector_index_used"] is False:
+            shape.vector_index_misses += 1
+        self.stats["explained"] += 1
+
+        index_note = ""
+        if summary["vector_index_used"] is not None:
+            index_note = ", vector index used" if summary["vector_index_used"] else ", vector index NOT used"
+        explained = "planned" if summary["execution_ms"] is None else f"explained: {summary['execution_ms']} ms"
+        seq_note = f", seq scan on {', '.join(summary['seq_scans'])}" if summary["seq_scans"] else ""
+        print(
+            f"Slow query {shape.fingerprint} on {pool_name}: {seconds * 1000:.1f} ms "
+            f"({explained}{index_note}{seq_note}): {shape.statement[:200]}"
+        )
+
+    def top(self, limit: int = 20, order_by: str = "slow_total") -> List[dict]:
+        """The query shapes with the most slow time (or `order_by` another attribute), worst first."""
+        shapes = sorted(list(self._shapes.values()), key=lambda s: getattr(s, order_by), reverse=True)
+        return [s.snapshot() for s in shapes[:limit]]
+
+    def get(self, fp: str) -> Optional[dict]:
+        shape = self._shapes.get(fp)
+        return shape.snapshot(with_plan=True) if shape is not None else None
+
+    def reset(self) -> None:
+        with self._lock:
+            self._shapes.clear()
+        for key in self.stats:
+            self.stats[key] = 0
+
+    def snapshot(self) -> dict:
+        return {
+            "threshold_ms": self.threshold * 1000,
+            "explain_sample_rate": self.explain_sample_rate,
+            "explain_interval_seconds": self.explain_interval,
+            "tracked_shapes": len(self._shapes),
+            **self.stats
+        }
+
+
+slow_query_log = SlowQueryLog(
+    settings.SLOW_QUERY_MS,
+    settings.SLOW_QUERY_EXPLAIN_SAMPLE_RATE,
+    settings.SLOW_QUERY_EXPLAIN_INTERVAL_SECONDS,
+    settings.SLOW_QUERY_MAX_SHAPES
+)
+
+
+def instrument_engine(engine, pool_name: str) -> None:
+    """Time every SQL statement run on a (sync) engine, when the slow query log is on."""
+    if not settings.SLOW_QUERY_LOG_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._slow_query_started = time.perf_counter()
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        started = getattr(context, "_slow_query_started", None)
+        if started is not None:
+            slow_query_log.record(
+                conn, statement, parameters, time.perf_counter() - started, pool_name, executemany
+            )
@@ -0,0 +1,395 @@
+"""
+Tracing module - request-scoped spans with tail-based sampling.
+
+With TRACING_ENABLED, every HTTP request (and every background job) gets a
+root span, and spans are recorded under it for:
+- each pipeline stage timed by app/metrics.py (embedding, vector_search,
+  llm, db_write, s3, pdf_extract, chunking)
+- each OpenAI HTTP attempt, each SQL statement and each wait for a pool
+  connection
+
+Spans are kept in memory until the root span ends, then the whole trace is
+either exported or dropped:
+- kept if the request failed or took longer than TRACE_SLOW_MS (tail rule)
+- otherwise kept with probability TRACE_SAMPLE_RATE, or when the caller's
+  W3C traceparent header marks it as sampled
+
+Traces are exported from a background thread in the OTLP/HTTP JSON
+encoding: POSTed to TRACE_OTLP_ENDPOINT when a collector is configured,
+otherwise (or when the collector is unreachable) appended to
+TRACE_JSONL_PATH, one export request per line. That file can be replayed
+into a collector with its otlpjsonfile receiver, so tracing works without
+a network.
+"""
+import json
+import os
+import queue
+import random
+import threading
+import time
+import urllib.request
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import List, Optional
+
+from sqlalchemy import event
+
+from app.config import settings
+
+SERVICE_NAME = "rag-chatbot"
+TRACE_ID_HEADER = "X-Trace-Id"
+
+# OTLP span kinds and status codes
+KIND_INTERNAL, KIND_SERVER, KIND_CLIENT = 1, 2, 3
+_STATUS_OK, _STATUS_ERROR = 1, 2
+
+
+class _Trace:
+    """Spans of one request, held until its root span ends."""
+
+    __slots__ = ("trace_id", "sampled", "spans", "dropped_spans")
+
+    def __init__(self, trace_id: str, sampled: bool):
+        self.trace_id = trace_id
+        self.sampled = sampled
+        self.spans: List["Span"] = []
+        self.dropped_spans = 0
+
+
+class Span:
+    __slots__ = ("trace", "span_id", "parent_id", "name", "kind", "start_ns", "end_ns", "attributes", "error")
+
+    def __init__(self, trace: _Trace, parent_id: Optional[str], name: str, kind: int, attributes: dict):
+        self.trace = trace
+        self.span_id = os.urandom(8).hex()
+        self.parent_id = parent_id
+        self.name = name
+        self.kind = kind
+        self.attributes = attributes
+        self.error: Optional[str] = None
+        self.start_ns = time.time_ns()
+        self.end_ns = 0
+
+    def set(self, **attributes) -> None:
+        self.attributes.update(attributes)
+
+    def to_otlp(self) -> dict:
+        span = {
+            "traceId": self.trace.trace_id,
+            "spanId": self.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns),
+            "attributes": [_otlp_attribute(k, v) for k, v in self.attributes.items()],
+            "status": {"code": _STATUS_ERROR, "message": self.error} if self.error else {"code": _STATUS_OK}
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        return span
+
+
+def _otlp_attribute(key: str, value) -> dict:
+    if isinstance(value, bool):
+        return {"key": key, "value": {"boolValue": value}}
+    if isinstance(value, int):
+        return {"key": key, "value": {"intValue": str(value)}}
+    if isinstance(value, float):
+        return {"key": key, "value": {"doubleValue": value}}
+    return {"key": key, "value": {"stringValue": str(value)}}
+
+
+# The span new spans are children of; None outside a traced request
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def start_span(name: str, kind: int = KIND_INTERNAL, **attributes) -> Optional[Span]:
+    """
+    Start a child of the current span without making it current (for
+    event-based instrumentation). Returns None when not tracing.
+    """
+    parent = _current.get()
+    if parent is None:
+        return None
+    trace = parent.trace
+    if len(trace.spans) >= settings.TRACE_MAX_SPANS:
+        trace.dropped_spans += 1
+        return None
+    child = Span(trace, parent.span_id, name, kind, attributes)
+    trace.spans.append(child)
+    return child
+
+
+def end_span(span: Optional[Span], error: Optional[BaseException] = None) -> None:
+    if span is None:
+        return
+    span.end_ns = time.time_ns()
+    if error is not None:
+        span.error = f"{type(error).__name__}: {error}"
+
+
+def enter_span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """
+    Start a child span and make it current; pass the result to exit_span.
+    Returns None (and costs one context lookup) when not tracing.
+    """
+    child = start_span(name, kind, **attributes)
+    if child is None:
+        return None
+    return child, _current.set(child)
+
+
+def exit_span(entered, error: Optional[BaseException] = None) -> None:
+    if entered is None:
+        return
+    child, token = entered
+    _current.reset(token)
+    end_span(child, error)
+
+
+@contextmanager
+def span(name: str, kind: int = KIND_INTERNAL, **attributes):
+    """Trace the block as a child of the current span (no-op when not tracing)."""
+    entered = enter_span(name, kind, **attributes)
+    try:
+        yield entered[0] if entered else None
+    except BaseException as e:
+        exit_span(entered, e)
+        raise
+    else:
+        exit_span(entered)
+
+
+async def traced(name: str, awaitable, **attributes):
+    """Await `awaitable` inside a client span (e.g. one upstream HTTP call)."""
+    with span(name, KIND_CLIENT, **attributes):
+        return await awaitable
+
+
+def _parse_traceparent(header: Optional[str]):
+    """(trace_id, parent_span_id, sampled) from a W3C traceparent header, or None."""
+    if not header:
+        return None
+    parts = header.strip().split("-")
+    if len(parts) != 4 or len(parts[1]) != 32 or len(parts[2]) != 16:
+        return None
+    try:
+        sampled = bool(int(parts[3], 16) & 1)
+    except ValueError:
+        return None
+    return parts[1], parts[2], sampled
+
+
+@contextmanager
+def root_span(name: str, traceparent: Optional[str] = None, kind: int = KIND_SERVER, **attributes):
+    """
+    Trace a request or job. Its spans are exported when the root ends if
+    the trace is sampled, failed, or was slow.
+
+    Args:
+        name: Span name, e.g. "POST /chat"
+        traceparent: Incoming W3C traceparent header, to join the caller's trace
+        kind: OTLP span kind (server for HTTP requests)
+        **attributes: Span attributes
+    """
+    if not settings.TRACING_ENABLED:
+        yield None
+        return
+
+    parent = _parse_traceparent(traceparent)
+    if parent:
+        trace_id, parent_id, sampled = parent
+        sampled = sampled or random.random() < settings.TRACE_SAMPLE_RATE
+    else:
+        trace_id, parent_id = os.urandom(16).hex(), None
+        sampled = random.random() < settings.TRACE_SAMPLE_RATE
+
+    trace = _Trace(trace_id, sampled)
+    root = Span(trace, parent_id, name, kind, attributes)
+    trace.spans.append(root)
+    token = _current.set(root)
+    try:
+        yield root
+    except BaseException as e:
+        end_span(root, e)
+        raise
+    else:
+        end_span(root)
+    finally:
+        _current.reset(token)
+        _finish(trace, root)
+
+
+def _finish(trace: _Trace, root: Span) -> None:
+    slow = (root.end_ns - root.start_ns) / 1e6 >= settings.TRACE_SLOW_MS
+    if not (trace.sampled or slow or root.error):
+        exporter.stats["dropped_unsampled"] += 1
+        return
+    if trace.dropped_spans:
+        root.set(**{"trace.dropped_spans": trace.dropped_spans})
+    if slow:
+        root.set(**{"trace.kept_as_slow": True})
+    exporter.submit(trace)
+
+
+class TracingMiddleware:
+    """
+    ASGI middleware opening a root span per HTTP request. Responses carry
+    the trace id in X-Trace-Id, so a slow request can be found in the export.
+    """
+
+    def __init__(self, app):
+        self.app = app
+
+    async def __call__(self, scope, receive, send):
+        if scope["type"] != "http" or not settings.TRACING_ENABLED:
+            await self.app(scope, receive, send)
+            return
+
+        method = scope["method"]
+        traceparent = next((v.decode("latin-1") for k, v in scope["headers"] if k == b"traceparent"), None)
+        with root_span(f"{method} {scope['path']}", traceparent,
+                       **{"http.method": method, "http.target": scope["path"]}) as root:
+
+            async def send_with_trace_id(message):
+                if message["type"] == "http.response.start":
+                    root.set(**{"http.status_code": message["status"]})
+                    if message["status"] >= 500:
+                        root.error = f"HTTP {message['status']}"
+                    message["headers"] = [
+                        *message.get("headers", ()), (TRACE_ID_HEADER.lower().encode(), root.trace.trace_id.encode())
+                    ]
+                await send(message)
+
+            try:
+                await self.app(scope, receive, send_with_trace_id)
+            finally:
+                # Name the span by route template once routing has matched
+                route = scope.get("route")
+                if route is not None:
+                    root.name = f"{method} {route.path}"
+                    root.set(**{"http.route": route.path})
+
+
+def instrument_engine(engine, pool_name: str) -> None:
+    """Trace every SQL statement run on a (sync) engine, when tracing is on."""
+    if not settings.TRACING_ENABLED:
+        return
+
+    @event.listens_for(engine, "before_cursor_execute")
+    def _before(conn, cursor, statement, parameters, context, executemany):
+        context._trace_span = start_span("db.query", KIND_CLIENT, **{
+            "db.system": "postgresql",
+            "db.statement": statement[:2000],
+            "db.pool": pool_name
+        })
+
+    @event.listens_for(engine, "after_cursor_execute")
+    def _after(conn, cursor, statement, parameters, context, executemany):
+        end_span(getattr(context, "_trace_span", None))
+
+    @event.listens_for(engine, "handle_error")
+    def _error(exception_context):
+        context = exception_context.execution_context
+        if context is not None:
+            end_span(getattr(context, "_trace_span", None), exception_context.original_exception)
+
+
+# =============================================================================
+# Export
+# =============================================================================
+
+class SpanExporter:
+    """Exports finished traces from a background thread, never blocking requests."""
+
+    def __init__(self, jsonl_path: str, otlp_endpoint: str, max_queue: int = 1000):
+        self.jsonl_path = jsonl_path
+        self.otlp_endpoint = otlp_endpoint
+        self._queue: "queue.Queue[_Trace]" = queue.Queue(maxsize=max_queue)
+        self._thread: Optional[threading.Thread] = None
+        self._lock = threading.Lock()
+        self.stats = {
+            "exported_traces": 0, "exported_spans": 0, "dropped_unsampled": 0,
+            "dropped_queue_full": 0, "otlp_failures": 0
+        }
+
+    def submit(self, trace: _Trace) -> None:
+        self._ensure_started()
+        try:
+            self._queue.put_nowait(trace)
+        except queue.Full:
+            self.stats["dropped_queue_full"] += 1
+
+    def _ensure_started(self) -> None:
+        if self._thread is None:
+            with self._lock:
+                if self._thread is None:
+                    self._thread = threading.Thread(target=self._run, name="span-exporter", daemon=True)
+                    self._thread.start()
+
+    def _run(self) -> None:
+        while True:
+            batch = [self._queue.get()]
+            # Gather what else is waiting, up to a second's worth
+            deadline = time.monotonic() + 1.0
+            while len(batch) < 100:
+                try:
+                    batch.append(self._queue.get(timeout=max(0.0, deadline - time.monotonic())))
+                except queue.Empty:
+                    break
+            try:
+                self._export(batch)
+            except Exception as e:
+                print(f"Span export failed: {e}")
+            for _ in batch:
+                self._queue.task_done()
+
+    def _export(self, traces: List[_Trace]) -> None:
+        body = {"resourceSpans": [{
+            "resource": {"attributes": [
+                _otlp_attribute("service.name", SERVICE_NAME),
+                _otlp_attribute("process.pid", os.getpid())
+            ]},
+            "scopeSpans": [{
+                "scope": {"name": "app.tracing"},
+                "spans": [s.to_otlp() for trace in traces for s in trace.spans if s.end_ns]
+            }]
+        }]}
+        payload = json.dumps(body, separators=(",", ":"))
+        span_count = len(body["resourceSpans"][0]["scopeSpans"][0]["spans"])
+
+        if self.otlp_endpoint:
+            try:
+                request = urllib.request.Request(
+                    self.otlp_endpoint, data=payload.encode(), headers={"Content-Type": "application/json"}
+                )
+                urllib.request.urlopen(request, timeout=5).close()
+                self._exported(len(traces), span_count)
+                return
+            except OSError as e:
+                self.stats["otlp_failures"] += 1
+                print(f"OTLP export to {self.otlp_endpoint} failed, writing to {self.jsonl_path}: {e}")
+
+        with open(self.jsonl_path, "a", encoding="utf-8") as f:
+            f.write(payload + "\n")
+        self._exported(len(traces), span_count)
+
+    def _exported(self, traces: int, spans: int) -> None:
+        self.stats["exported_traces"] += traces
+        self.stats["exported_spans"] += spans
+
+    def flush(self, timeout: float = 5.0) -> None:
+        """Wait (up to `timeout`) for queued traces to be exported, e.g. on shutdown."""
+        deadline = time.monotonic() + timeout
+        while self._thread is not None and self._queue.unfinished_tasks and time.monotonic() < deadline:
+            time.sleep(0.05)
+
+    def snapshot(self) -> dict:
+        return {
+            **self.stats,
+            "queue_depth": self._queue.qsize(),
+            "destination": self.otlp_endpoint or self.jsonl_path
+        }
+
+
+exporter = SpanExporter(settings.TRACE_JSONL_PATH, settings.TRACE_OTLP_ENDPOINT)
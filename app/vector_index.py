@@ -0,0 +1,411 @@
+"""
+Vector index lifecycle - build after load, rebuild on drift, tune search params.
+
+ivfflat picks its centroids when the index is built, so an index created by
+init_db() on an empty table never learns the real data distribution. This
+module builds the index once a table holds enough rows, tracks growth and
+delete churn since the last build, rebuilds concurrently when either crosses
+a threshold, and derives per-query `ivfflat.probes` / `hnsw.ef_search` from a
+recall target.
+
+The build state behind those search settings is cached per process and
+reloaded from vector_index_state at most every
+VECTOR_INDEX_STATE_TTL_SECONDS, so a worker picks up an index another
+worker built or rebuilt within seconds.
+"""
+import math
+import time
+from datetime import datetime
+from typing import Dict, List, NamedTuple, Optional
+
+from sqlalchemy import select, text
+from sqlalchemy.ext.asyncio import AsyncSession
+from sqlalchemy.orm import Session
+
+from app.config import settings
+from app.db import engine, get_db_context
+from app.models import VectorIndexState
+
+
+class ManagedIndex(NamedTuple):
+    """A vector index owned by the lifecycle manager."""
+    name: str
+    table: str
+    column: str
+    ops: str = "vector_cosine_ops"
+
+
+# Indexes maintained by this module. A partitioned deployment registers one
+# entry per partition so each is tracked and rebuilt independently.
+MANAGED_INDEXES: List[ManagedIndex] = [
+    ManagedIndex(name="ix_chunks_embedding", table="chunks", column="embedding"),
+]
+
+# Fixed key for pg_try_advisory_lock so only one worker rebuilds at a time
+_REBUILD_LOCK_KEY = 727_001
+
+# Last known build state per index name, refreshed by refresh_state() and,
+# once older than VECTOR_INDEX_STATE_TTL_SECONDS, by apply_search_settings()
+_active: Dict[str, dict] = {}
+_state_loaded_at = 0.0
+
+
+# =============================================================================
+# Parameter selection
+# =============================================================================
+
+def choose_lists(rows: int) -> int:
+    """
+    Choose the ivfflat `lists` parameter from a row count.
+
+    Follows the pgvector guidance: rows / 1000 up to 1M rows, sqrt(rows) above.
+    """
+    if rows <= 1_000_000:
+        return max(1, rows // 1000)
+    return int(math.sqrt(rows))
+
+
+def choose_probes(lists: int, recall_target: Optional[float] = None) -> int:
+    """
+    Choose `ivfflat.probes` for a recall target.
+
+    sqrt(lists) probes gives roughly 0.9 recall; each step closer to 1.0
+    scales probes by the inverse of the remaining miss rate. The result is
+    capped by VECTOR_SEARCH_MAX_PROBES to bound query latency.
+    """
+    if recall_target is None:
+        recall_target = settings.VECTOR_SEARCH_RECALL_TARGET
+    miss = max(1.0 - recall_target, 0.001)
+    probes = math.ceil(math.sqrt(lists) * 0.1 / miss)
+    return max(1, min(probes, lists, settings.VECTOR_SEARCH_MAX_PROBES))
+
+
+def choose_ef_search(k: int, recall_target: Optional[float] = None) -> int:
+    """
+    Choose `hnsw.ef_search` for a recall target.
+
+    The pgvector default of 40 gives roughly 0.9 recall; scaled the same way
+    as probes, never below k, capped by VECTOR_SEARCH_MAX_EF.
+    """
+    if recall_target is None:
+        recall_target = settings.VECTOR_SEARCH_RECALL_TARGET
+    miss = max(1.0 - recall_target, 0.001)
+    ef = math.ceil(40 * 0.1 / miss)
+    return max(k, min(ef, settings.VECTOR_SEARCH_MAX_EF))
+
+
+def search_settings(k: int, recall_target: Optional[float] = None) -> Dict[str, str]:
+    """
+    Planner settings to apply to a vector query.
+
+    Returns an empty dict when no managed index is built (exact scan).
+    """
+    state = _active.get(MANAGED_INDEXES[0].name)
+    if not state:
+        return {}
+    if state["index_type"] == "hnsw":
+        return {"hnsw.ef_search": str(choose_ef_search(k, recall_target))}
+    return {"ivfflat.probes": str(choose_probes(state["lists"] or 1, recall_target))}
+
+
+async def _reload_stale_state(db: AsyncSession) -> None:
+    """Reload the cached build state on the request's session once it is older than the TTL."""
+    global _state_loaded_at
+    now = time.monotonic()
+    if now - _state_loaded_at < settings.VECTOR_INDEX_STATE_TTL_SECONDS:
+        return
+    _state_loaded_at = now  # concurrent requests keep using the old state meanwhile
+    names = [index.name for index in MANAGED_INDEXES]
+    rows = await db.execute(
+        select(VectorIndexState.index_name, VectorIndexState.index_type, VectorIndexState.lists)
+        .where(VectorIndexState.index_name.in_(names))
+    )
+    # Dropping an index deletes its row, so a missing row means an exact scan
+    loaded = {row.index_name: {"index_type": row.index_type, "lists": row.lists} for row in rows}
+    for name in names:
+        if name in loaded:
+            _active[name] = loaded[name]
+        else:
+            _active.pop(name, None)
+
+
+async def apply_search_settings(db: AsyncSession, k: int, recall_target: Optional[float] = None) -> None:
+    """
+    Apply search settings for the current transaction only.
+
+    Uses set_config(..., is_local => true) so pooled connections never
+    carry settings over to the next checkout.
+    """
+    await _reload_stale_state(db)
+    for name, value in search_settings(k, recall_target).items():
+        await db.execute(
+            text("SELECT set_config(:name, :value, true)"),
+            {"name": name, "value": value}
+        )
+
+
+# =============================================================================
+# Health
+# =============================================================================
+
+def table_stats(db: Session, table: str) -> List[dict]:
+    """
+    Row and delete counters for a table and any of its partitions.
+
+    Counters come from pg_stat_user_tables and are cumulative since the
+    last statistics reset.
+    """
+    sql = text("""
+        SELECT s.relname, s.n_live_tup, s.n_tup_ins, s.n_tup_del
+        FROM pg_stat_user_tables s
+        WHERE s.relid = to_regclass(:table)
+           OR s.relid IN (
+               SELECT inhrelid FROM pg_inherits WHERE inhparent = to_regclass(:table)
+           )
+        ORDER BY s.relname
+    """)
+    return [
+        {
+            "table": row.relname,
+            "live_rows": row.n_live_tup,
+            "inserts": row.n_tup_ins,
+            "deletes": row.n_tup_del
+        }
+        for row in db.execute(sql, {"table": table})
+    ]
+
+
+def _index_info(db: Session, name: str) -> Optional[dict]:
+    """Access method, validity and size of an existing index, or None."""
+    sql = text("""
+        SELECT am.amname, i.indisvalid, pg_relation_size(c.oid) AS size_bytes
+        FROM pg_class c
+        JOIN pg_index i ON i.indexrelid = c.oid
+        JOIN pg_am am ON am.oid = c.relam
+        WHERE c.oid = to_regclass(:name)
+    """)
+    row = db.execute(sql, {"name": name}).first()
+    if row is None:
+        return None
+    return {"type": row.amname, "valid": row.indisvalid, "size_bytes": row.size_bytes}
+
+
+def index_health(db: Session, index: ManagedIndex) -> dict:
+    """
+    Report the state of a managed index and whether it needs maintenance.
+
+    Returns:
+        Dict with counters, drift ratios and an `action` of
+        None, "build", "rebuild" or "drop"
+    """
+    stats = table_stats(db, index.table)
+    live_rows = sum(s["live_rows"] for s in stats)
+    deletes = sum(s["deletes"] for s in stats)
+    info = _index_info(db, index.name)
+    state = db.get(VectorIndexState, index.name)
+
+    health = {
+        "index": index.name,
+        "table": index.table,
+        "partitions": stats,
+        "live_rows": live_rows,
+        "exists": info is not None,
+        "valid": info["valid"] if info else None,
+        "index_type": info["type"] if info else None,
+        "size_bytes": info["size_bytes"] if info else None,
+        "lists": state.lists if state else None,
+        "rows_at_build": state.rows_at_build if state else None,
+        "built_at": state.built_at.isoformat() if state and state.built_at else None,
+        "build_seconds": state.build_seconds if state else None,
+        "growth": None,
+        "churn": None,
+        "action": None,
+        "reason": None
+    }
+
+    if info is None:
+        if live_rows >= settings.VECTOR_INDEX_MIN_ROWS:
+            health["action"] = "build"
+            health["reason"] = f"{live_rows} rows and no index"
+        return health
+
+    if state is None:
+        # Index predates the manager (e.g. built by init_db on an empty table)
+        if live_rows >= settings.VECTOR_INDEX_MIN_ROWS:
+            health["action"] = "rebuild"
+        else:
+            health["action"] = "drop"
+        health["reason"] = "untracked index with unknown training data"
+        return health
+
+    # Counters go backwards after a stats reset; count from zero in that case
+    deletes_since = deletes - state.deletes_at_build
+    if deletes_since < 0:
+        deletes_since = deletes
+    baseline = max(state.rows_at_build, 1)
+    health["growth"] = round(live_rows / baseline, 3)
+    health["churn"] = round(deletes_since / baseline, 3)
+
+    if not info["valid"]:
+        health["action"] = "rebuild"
+        health["reason"] = "index is invalid"
+    elif info["type"] != settings.VECTOR_INDEX_TYPE:
+        health["action"] = "rebuild"
+        health["reason"] = f"configured type is {settings.VECTOR_INDEX_TYPE}"
+    elif health["churn"] >= settings.VECTOR_INDEX_CHURN_RATIO:
+        health["action"] = "rebuild"
+        health["reason"] = f"delete churn {health['churn']} since last build"
+    elif info["type"] == "ivfflat" and health["growth"] >= settings.VECTOR_INDEX_GROWTH_FACTOR:
+        # HNSW absorbs inserts without retraining; only ivfflat drifts on growth
+        health["action"] = "rebuild"
+        health["reason"] = f"table grew {health['growth']}x since last build"
+
+    return health
+
+
+# =============================================================================
+# Build / rebuild
+# =============================================================================
+
+def _create_index_sql(index: ManagedIndex, name: str, lists: int) -> str:
+    """CREATE INDEX CONCURRENTLY statement for the configured index type."""
+    if settings.VECTOR_INDEX_TYPE == "hnsw":
+        params = (
+            f"m = {settings.VECTOR_INDEX_HNSW_M}, "
+            f"ef_construction = {settings.VECTOR_INDEX_HNSW_EF_CONSTRUCTION}"
+        )
+        method = "hnsw"
+    else:
+        params = f"lists = {lists}"
+        method = "ivfflat"
+    return (
+        f"CREATE INDEX CONCURRENTLY {name} ON {index.table} "
+        f"USING {method} ({index.column} {index.ops}) WITH ({params})"
+    )
+
+
+def rebuild_index(index: ManagedIndex, drop_only: bool = False) -> Optional[dict]:
+    """
+    Build or rebuild an index without blocking writes.
+
+    The new index is created CONCURRENTLY under a temporary name and swapped
+    in by two renames in one short transaction, so queries keep using the
+    old index until the new one is ready and never run without one; the old
+    index is then dropped CONCURRENTLY.
+    An advisory lock makes this a no-op if another worker is already
+    rebuilding.
+
+    Args:
+        index: The managed index to (re)build
+        drop_only: Drop the index instead of building it
+
+    Returns:
+        Dict describing the build, or None if another worker holds the lock
+    """
+    tmp_name = f"{index.name}_new"
+    old_name = f"{index.name}_old"
+
+    # CREATE/DROP INDEX CONCURRENTLY cannot run inside a transaction block
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        locked = conn.execute(
+            text("SELECT pg_try_advisory_lock(:key)"), {"key": _REBUILD_LOCK_KEY}
+        ).scalar()
+        if not locked:
+            return None
+
+        try:
+            if drop_only:
+                conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {index.name}"))
+                with get_db_context() as db:
+                    state = db.get(VectorIndexState, index.name)
+                    if state is not None:
+                        db.delete(state)
+                _active.pop(index.name, None)
+                return {"index": index.name, "action": "drop"}
+
+            with get_db_context() as db:
+                stats = table_stats(db, index.table)
+            rows = sum(s["live_rows"] for s in stats)
+            deletes = sum(s["deletes"] for s in stats)
+            lists = choose_lists(rows)
+
+            # A failed earlier attempt leaves an INVALID index (or the swapped-out one) behind
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {tmp_name}"))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {old_name}"))
+
+            started = time.perf_counter()
+            conn.execute(text(_create_index_sql(index, tmp_name, lists)))
+            build_seconds = time.perf_counter() - started
+
+            # Both renames commit together: if either fails, the old index stays in place
+            with engine.begin() as swap:
+                swap.execute(text(f"ALTER INDEX IF EXISTS {index.name} RENAME TO {old_name}"))
+                swap.execute(text(f"ALTER INDEX {tmp_name} RENAME TO {index.name}"))
+            conn.execute(text(f"DROP INDEX CONCURRENTLY IF EXISTS {old_name}"))
+
+            with get_db_context() as db:
+                state = db.get(VectorIndexState, index.name)
+                if state is None:
+                    state = VectorIndexState(index_name=index.name, table_name=index.table)
+                    db.add(state)
+                state.index_type = settings.VECTOR_INDEX_TYPE
+                state.lists = lists if settings.VECTOR_INDEX_TYPE == "ivfflat" else None
+                state.rows_at_build = rows
+                state.deletes_at_build = deletes
+                state.build_seconds = build_seconds
+                state.built_at = datetime.utcnow()
+
+            _active[index.name] = {
+                "index_type": settings.VECTOR_INDEX_TYPE,
+                "lists": lists
+            }
+            return {
+                "index": index.name,
+                "action": "build",
+                "index_type": settings.VECTOR_INDEX_TYPE,
+                "lists": lists,
+                "rows": rows,
+                "build_seconds": round(build_seconds, 3)
+            }
+        finally:
+            conn.execute(text("SELECT pg_advisory_unlock(:key)"), {"key": _REBUILD_LOCK_KEY})
+
+
+def health_report() -> List[dict]:
+    """Health of every managed index (runs on the sync engine)."""
+    with get_db_context() as db:
+        return [index_health(db, index) for index in MANAGED_INDEXES]
+
+
+def refresh_state() -> None:
+    """Reload the cached build state used to pick per-query search settings."""
+    global _state_loaded_at
+    _state_loaded_at = time.monotonic()
+    with get_db_context() as db:
+        for index in MANAGED_INDEXES:
+            state = db.get(VectorIndexState, index.name)
+            if state is None or _index_info(db, index.name) is None:
+                _active.pop(index.name, None)
+            else:
+                _active[index.name] = {"index_type": state.index_type, "lists": state.lists}
+
+
+def maintain() -> List[dict]:
+    """
+    Check every managed index and build, rebuild or drop it as needed.
+
+    Returns:
+        List of actions taken
+    """
+    actions: List[dict] = []
+    for index in MANAGED_INDEXES:
+        with get_db_context() as db:
+            health = index_health(db, index)
+        if health["action"] is None:
+            continue
+        result = rebuild_index(index, drop_only=health["action"] == "drop")
+        if result is not None:
+            result["reason"] = health["reason"]
+            actions.append(result)
+    refresh_state()
+    return actions
@@ -0,0 +1,154 @@
+"""
+Worker module - standalone consumer of the jobs queue (app/jobs.py).
+
+Runs document ingestion outside the API process, so PDF parsing and
+embedding scale separately from HTTP serving. Start any number of workers
+next to the API, against the same database:
+
+    python -m app.worker --concurrency 4
+
+Each worker runs `concurrency` jobs at a time. SIGTERM/SIGINT stop claiming
+new jobs and let the running ones finish; a job cut short by a hard kill is
+picked up again by another worker once its lease expires. With
+PROFILER_ROLLING_HZ set, SIGUSR1 writes the rolling profile of the last
+PROFILER_ROLLING_SECONDS to PROFILE_DIR (app/profiler.py).
+"""
+import argparse
+import asyncio
+import os
+import signal
+import socket
+import time
+from typing import Awaitable, Callable, Dict
+
+from app import jobs, profiler, tracing
+from app.config import settings
+from app.db import async_engine, batch_engine, init_db
+from app.ingestion import INGEST_JOB, run_ingest_job
+
+HANDLERS: Dict[str, Callable[[dict], Awaitable[None]]] = {
+    INGEST_JOB: run_ingest_job,
+}
+
+# How often finished jobs past JOB_RETENTION_HOURS are pruned
+_PRUNE_INTERVAL_SECONDS = 600
+
+
+class Worker:
+    """Claims and runs jobs until stopped."""
+
+    def __init__(self, concurrency: int, handlers: Dict[str, Callable[[dict], Awaitable[None]]] = HANDLERS):
+        self.concurrency = concurrency
+        self.handlers = handlers
+        self.worker_id = f"{socket.gethostname()}:{os.getpid()}"
+        self._stopping: asyncio.Event = None
+        self.stats = {"done": 0, "retried": 0, "dead": 0, "lease_lost": 0, "unrecorded": 0}
+
+    def stop(self) -> None:
+        print(f"Worker {self.worker_id} stopping after running jobs finish")
+        self._stopping.set()
+
+    async def _sleep(self, seconds: float) -> None:
+        """Sleep, waking early if the worker is stopped."""
+        try:
+            await asyncio.wait_for(self._stopping.wait(), seconds)
+        except asyncio.TimeoutError:
+            pass
+
+    async def _heartbeat(self, job: jobs.ClaimedJob) -> None:
+        while True:
+            await asyncio.sleep(settings.JOB_HEARTBEAT_SECONDS)
+            if not await jobs.heartbeat(job.id, self.worker_id):
+                self.stats["lease_lost"] += 1
+                print(f"Job {job.id}: lease lost, another worker may run it again")
+                return
+
+    async def _execute(self, job: jobs.ClaimedJob) -> None:
+        # A database error while recording the outcome must not take down
+        # the worker and its other jobs: the job is left claimed, and once
+        # its lease expires another worker picks it up again
+        try:
+            await self._run_job(job)
+        except Exception as e:
+            self.stats["unrecorded"] += 1
+            print(f"Job {job.id} ({job.kind}): could not record the outcome, left to its lease: {e}")
+
+    async def _run_job(self, job: jobs.ClaimedJob) -> None:
+        if job.attempts > job.max_attempts:
+            # Its last worker let the lease expire on the final attempt
+            await jobs.fail(job, self.worker_id, "Lease expired on the final attempt")
+            self.stats["dead"] += 1
+            return
+
+        heartbeat = asyncio.create_task(self._heartbeat(job))
+        started = time.perf_counter()
+        try:
+            with tracing.root_span(f"job {job.kind}", kind=tracing.KIND_INTERNAL,
+                                   **{"job.id": job.id, "job.attempt": job.attempts}):
+                await self.handlers[job.kind](job.payload)
+        except Exception as e:
+            status = await jobs.fail(job, self.worker_id, f"{type(e).__name__}: {e}")
+            self.stats["dead" if status == jobs.DEAD else "retried"] += 1
+            print(f"Job {job.id} ({job.kind}) failed on attempt {job.attempts}/{job.max_attempts}, now {status}: {e}")
+        else:
+            if await jobs.complete(job.id, self.worker_id):
+                self.stats["done"] += 1
+            print(f"Job {job.id} ({job.kind}) done in {time.perf_counter() - started:.2f}s")
+        finally:
+            heartbeat.cancel()
+
+    async def _slot(self) -> None:
+        """Run jobs one after another; the worker runs `concurrency` of these."""
+        while not self._stopping.is_set():
+            try:
+                job = await jobs.claim(self.worker_id, list(self.handlers))
+            except Exception as e:
+                print(f"Job claim failed: {e}")
+                await self._sleep(settings.JOB_POLL_SECONDS)
+                continue
+            if job is None:
+                await self._sleep(settings.JOB_POLL_SECONDS)
+            else:
+                await self._execute(job)
+
+    async def _prune(self) -> None:
+        while not self._stopping.is_set():
+            try:
+                pruned = await jobs.prune_finished()
+                if pruned:
+                    print(f"Pruned {pruned} finished jobs")
+            except Exception as e:
+                print(f"Job pruning failed: {e}")
+            await self._sleep(_PRUNE_INTERVAL_SECONDS)
+
+    async def run(self) -> None:
+        self._stopping = asyncio.Event()
+        loop = asyncio.get_running_loop()
+        for sig in (signal.SIGTERM, signal.SIGINT):
+            loop.add_signal_handler(sig, self.stop)
+        loop.add_signal_handler(signal.SIGUSR1, profiler.dump_rolling)
+        profiler.sampler.start_rolling()
+
+        print(f"Worker {self.worker_id} started: {self.concurrency} slots, jobs {sorted(self.handlers)}")
+        try:
+            await asyncio.gather(self._prune(), *(self._slot() for _ in range(self.concurrency)))
+        finally:
+            await async_engine.dispose()
+            await batch_engine.dispose()
+            profiler.sampler.stop()
+            tracing.exporter.flush()
+        print(f"Worker {self.worker_id} stopped: {self.stats}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Run background jobs (document ingestion)")
+    parser.add_argument("--concurrency", type=int, default=settings.WORKER_CONCURRENCY,
+                        help="Jobs run at the same time by this process")
+    args = parser.parse_args()
+
+    init_db()
+    asyncio.run(Worker(args.concurrency).run())
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,196 @@
+"""
+Benchmark concurrent in-flight chats per API worker: the sync request
+path the API used to have vs the async one it has now.
+
+One uvicorn worker serves two routes in front of the fake OpenAI server
+(benchmarks/fake_openai.py), so only the concurrency model differs:
+
+    sync   `def` route calling the blocking openai.OpenAI client, as the
+           routes did before the request path went async: Starlette runs
+           it in AnyIO's thread pool, so at most --threads requests
+           (40 by default, as in Starlette) are in flight at once
+    async  `async def` route awaiting app.openai_client.chat_completion:
+           waiting on OpenAI holds no thread
+
+For each --levels value N, N chats are sent at once. The fake server
+reports the peak number of chat completions it was serving at the same
+time, which is the number of chats actually in flight in the worker;
+latency percentiles and throughput are measured client-side. The app's
+OpenAI budgets (OPENAI_RPM, OPENAI_MAX_CONCURRENCY, ...) are raised out of
+the way for the async path, so the numbers show the concurrency model
+alone. Retrieval and history writes are left out: they take a pooled
+database connection in both versions and do not change the picture.
+
+Usage:
+    python -m benchmarks.async_concurrency --levels 50,200,1000,2000
+"""
+import argparse
+import asyncio
+import json
+import os
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from contextlib import asynccontextmanager
+from typing import List
+
+from fastapi import FastAPI
+
+from benchmarks import fake_openai
+from benchmarks.embedding_batching import percentile
+
+MODEL = "fake-chat"
+MAX_TOKENS = 1024
+
+
+@asynccontextmanager
+async def lifespan(app: FastAPI):
+    import anyio.to_thread
+
+    # Starlette runs `def` routes in AnyIO's default thread pool
+    anyio.to_thread.current_default_thread_limiter().total_tokens = int(os.environ["BENCH_THREADS"])
+    yield
+
+
+app = FastAPI(title="Concurrency benchmark", lifespan=lifespan)
+_sync_client = None
+
+
+def _messages(question: str) -> List[dict]:
+    return [{"role": "user", "content": question}]
+
+
+@app.post("/sync-chat")
+def sync_chat(body: dict):
+    from openai import OpenAI
+
+    global _sync_client
+    if _sync_client is None:
+        _sync_client = OpenAI(max_retries=0)
+    response = _sync_client.chat.completions.create(
+        model=MODEL, messages=_messages(body["message"]), max_tokens=MAX_TOKENS
+    )
+    return {"response": response.choices[0].message.content}
+
+
+@app.post("/async-chat")
+async def async_chat(body: dict):
+    from app.openai_client import chat_completion
+
+    return {"response": await chat_completion(_messages(body["message"]), model=MODEL, max_tokens=MAX_TOKENS)}
+
+
+def start_worker(port: int, threads: int, openai_url: str) -> subprocess.Popen:
+    """One uvicorn worker serving both routes."""
+    unlimited = "1000000000"
+    env = {
+        **os.environ,
+        "BENCH_THREADS": str(threads),
+        "OPENAI_BASE_URL": openai_url,
+        "OPENAI_API_KEY": os.environ.get("OPENAI_API_KEY", "sk-fake"),
+        "SINGLE_FLIGHT_ENABLED": "false",
+        "OPENAI_RPM": unlimited,
+        "OPENAI_TPM": unlimited,
+        "OPENAI_INITIAL_CONCURRENCY": unlimited,
+        "OPENAI_MAX_CONCURRENCY": unlimited,
+        "OPENAI_INTERACTIVE_MAX_CONCURRENCY": unlimited
+    }
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "benchmarks.async_concurrency:app", "--port", str(port),
+         "--log-level", "warning", "--backlog", "4096"],
+        env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            urllib.request.urlopen(f"http://127.0.0.1:{port}/docs", timeout=1).close()
+            return proc
+        except (urllib.error.URLError, ConnectionError):
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("Benchmark worker did not start")
+
+
+async def burst(port: int, path: str, count: int) -> dict:
+    """Send `count` chats at once; returns latency percentiles and throughput."""
+    import httpx
+
+    latencies: List[float] = []
+    errors = 0
+    limits = httpx.Limits(max_connections=None, max_keepalive_connections=None)
+
+    async with httpx.AsyncClient(base_url=f"http://127.0.0.1:{port}", limits=limits, timeout=600) as client:
+        async def one(i: int):
+            nonlocal errors
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json={"message": f"question {i}"})
+                response.raise_for_status()
+            except httpx.HTTPError:
+                errors += 1
+                return
+            latencies.append((time.perf_counter() - started) * 1000)
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(i) for i in range(count)))
+        seconds = time.perf_counter() - started
+
+    return {
+        "ok": len(latencies),
+        "errors": errors,
+        "seconds": round(seconds, 2),
+        "chats_per_s": round(len(latencies) / seconds, 1),
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark in-flight chats per worker, sync vs async")
+    parser.add_argument("--levels", default="50,200,1000", help="Comma-separated concurrent chat counts")
+    parser.add_argument("--threads", type=int, default=40, help="Thread pool size for the sync route")
+    parser.add_argument("--chat-first-token-ms", type=float, default=300)
+    parser.add_argument("--chat-per-token-ms", type=float, default=10)
+    parser.add_argument("--chat-tokens", type=int, default=50)
+    parser.add_argument("--openai-port", type=int, default=8771)
+    parser.add_argument("--port", type=int, default=8783, help="Benchmark worker port")
+    args = parser.parse_args()
+
+    server = fake_openai.FakeOpenAIServer(
+        args.openai_port,
+        chat_first_token_ms=args.chat_first_token_ms,
+        chat_per_token_ms=args.chat_per_token_ms,
+        chat_tokens=args.chat_tokens
+    )
+    proc = None
+    results = {}
+    try:
+        proc = start_worker(args.port, args.threads, f"{server.base_url}/v1")
+        for level in (int(n) for n in args.levels.split(",")):
+            for name, path in (("sync", "/sync-chat"), ("async", "/async-chat")):
+                server.reset()
+                print(f"Running {name} with {level} concurrent chats...")
+                result = asyncio.run(burst(args.port, path, level))
+                result["in_flight_peak"] = server.stats()["chat_max_in_flight"]
+                results[f"{name}_{level}"] = result
+    finally:
+        if proc is not None:
+            proc.terminate()
+            proc.wait()
+        server.stop()
+
+    print(json.dumps({
+        "threads": args.threads,
+        "fake_openai": {
+            "chat_first_token_ms": args.chat_first_token_ms,
+            "chat_per_token_ms": args.chat_per_token_ms,
+            "chat_tokens": args.chat_tokens
+        },
+        **results
+    }, indent=2))
+
+
+if __name__ == "__main__":
+    main()
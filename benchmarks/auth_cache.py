@@ -0,0 +1,121 @@
+"""
+Benchmark authenticated request throughput with and without the principal cache.
+
+Starts the API under uvicorn once per scenario (needs DATABASE_URL pointing
+at a reachable Postgres), registers a throwaway user and hammers a cheap
+authenticated endpoint (GET /chat/sessions) from keep-alive client threads.
+
+Scenarios:
+    no_cache: AUTH_PRINCIPAL_CACHE_TTL_SECONDS=0 (user lookup on every request)
+    cache:    principal cache on
+    trusted:  cache on and AUTH_TRUST_TOKEN_CLAIMS=true
+
+Usage:
+    python -m benchmarks.auth_cache --clients 32 --seconds 15
+"""
+import argparse
+import http.client
+import json
+import os
+import subprocess
+import sys
+import threading
+import time
+import uuid
+from typing import Dict
+
+from benchmarks.embedding_batching import percentile
+
+SCENARIOS: Dict[str, Dict[str, str]] = {
+    "no_cache": {"AUTH_PRINCIPAL_CACHE_TTL_SECONDS": "0", "AUTH_TRUST_TOKEN_CLAIMS": "false"},
+    "cache": {"AUTH_PRINCIPAL_CACHE_TTL_SECONDS": "60", "AUTH_TRUST_TOKEN_CLAIMS": "false"},
+    "trusted": {"AUTH_PRINCIPAL_CACHE_TTL_SECONDS": "60", "AUTH_TRUST_TOKEN_CLAIMS": "true"},
+}
+
+
+def start_api(port: int, env_overrides: Dict[str, str]) -> subprocess.Popen:
+    env = {**os.environ, "API_GATEWAY_HEADER_SECRET": "", **env_overrides}
+    env.setdefault("OPENAI_API_KEY", "sk-fake")
+    proc = subprocess.Popen(
+        [sys.executable, "-m", "uvicorn", "app.main:app", "--port", str(port), "--log-level", "warning"],
+        env=env
+    )
+    deadline = time.monotonic() + 30
+    while time.monotonic() < deadline:
+        try:
+            conn = http.client.HTTPConnection("127.0.0.1", port, timeout=1)
+            conn.request("GET", "/health")
+            if conn.getresponse().status == 200:
+                return proc
+        except OSError:
+            time.sleep(0.2)
+    proc.terminate()
+    raise RuntimeError("API did not start")
+
+
+def register(port: int) -> str:
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = json.dumps({"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "bench-password"})
+    conn.request("POST", "/auth/register", body, {"Content-Type": "application/json"})
+    return json.loads(conn.getresponse().read())["access_token"]
+
+
+def hammer(port: int, token: str, clients: int, seconds: float) -> dict:
+    """Send GET /chat/sessions from `clients` threads for `seconds`."""
+    latencies = []
+    errors = [0]
+    lock = threading.Lock()
+    stop_at = time.monotonic() + seconds
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port)
+        headers = {"Authorization": f"Bearer {token}"}
+        local = []
+        while time.monotonic() < stop_at:
+            started = time.perf_counter()
+            conn.request("GET", "/chat/sessions", headers=headers)
+            response = conn.getresponse()
+            response.read()
+            if response.status == 200:
+                local.append((time.perf_counter() - started) * 1000)
+            else:
+                with lock:
+                    errors[0] += 1
+        with lock:
+            latencies.extend(local)
+
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return {
+        "requests_per_s": round(len(latencies) / seconds, 1),
+        "errors": errors[0],
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the authenticated principal cache")
+    parser.add_argument("--clients", type=int, default=32)
+    parser.add_argument("--seconds", type=float, default=15)
+    parser.add_argument("--port", type=int, default=8781)
+    args = parser.parse_args()
+
+    results = {}
+    for name, overrides in SCENARIOS.items():
+        proc = start_api(args.port, overrides)
+        try:
+            token = register(args.port)
+            hammer(args.port, token, args.clients, 2)  # warm-up
+            results[name] = hammer(args.port, token, args.clients, args.seconds)
+        finally:
+            proc.terminate()
+            proc.wait()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,88 @@
+"""
+Benchmark query-embedding micro-batching against the local fake OpenAI server.
+
+Sends the same open-loop stream of get_embedding() calls with batching off
+and on, and reports upstream call counts and latency percentiles.
+
+Usage:
+    python -m benchmarks.embedding_batching --requests 1000 --rate 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import random
+import time
+from typing import List
+
+from benchmarks import fake_openai
+
+
+def percentile(values: List[float], pct: float) -> float:
+    ordered = sorted(values)
+    index = min(len(ordered) - 1, int(round(pct / 100 * (len(ordered) - 1))))
+    return ordered[index]
+
+
+async def run_scenario(server, get_embedding, requests: int, rate: float) -> dict:
+    """Fire `requests` calls with Poisson arrivals at `rate`/s and time each one."""
+    latencies: List[float] = []
+
+    async def one(i: int):
+        started = time.perf_counter()
+        await get_embedding(f"benchmark question number {i}")
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    tasks = []
+    started = time.perf_counter()
+    for i in range(requests):
+        tasks.append(asyncio.create_task(one(i)))
+        await asyncio.sleep(random.expovariate(rate))
+    await asyncio.gather(*tasks)
+    elapsed = time.perf_counter() - started
+
+    return {
+        "requests": requests,
+        "upstream_calls": server.stats()["embedding_calls"],
+        "throughput_rps": round(requests / elapsed, 1),
+        "p50_ms": round(percentile(latencies, 50), 2),
+        "p99_ms": round(percentile(latencies, 99), 2),
+        "max_ms": round(max(latencies), 2)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark query embedding micro-batching")
+    parser.add_argument("--requests", type=int, default=1000)
+    parser.add_argument("--rate", type=float, default=300, help="Arrival rate (requests/second)")
+    parser.add_argument("--port", type=int, default=8765)
+    parser.add_argument("--latency-ms", type=float, default=50, help="Fake upstream base latency")
+    args = parser.parse_args()
+
+    server = fake_openai.FakeOpenAIServer(args.port, embedding_base_ms=args.latency_ms)
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from app.config import settings
+    from app.openai_client import get_embedding
+
+    async def run_all() -> dict:
+        # One event loop for both runs: the OpenAI client's connection pool is loop-bound
+        results = {}
+        for enabled in (False, True):
+            settings.EMBEDDING_BATCH_ENABLED = enabled
+            server.reset()
+            random.seed(0)
+            results["batched" if enabled else "unbatched"] = await run_scenario(
+                server, get_embedding, args.requests, args.rate
+            )
+        return results
+
+    try:
+        print(json.dumps(asyncio.run(run_all()), indent=2))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,422 @@
+"""
+End-to-end benchmark suite: the API under uvicorn with local stand-ins for
+everything it calls.
+
+- Postgres + pgvector: DATABASE_URL must point at a reachable local one,
+  e.g. `docker run -p 5432:5432 -e POSTGRES_PASSWORD=postgres pgvector/pgvector:pg16`
+- OpenAI: the fake server (benchmarks/fake_openai.py) with the latencies
+  given on the command line and deterministic embeddings
+- S3: a local moto server (`pip install "moto[server]"`), or the bucket
+  in the AWS_* settings with --real-s3
+
+Scenarios (each against a freshly started API, with one throwaway user):
+    upload     POST /documents/upload with INGESTION_MODE=queue: S3 put,
+               document row and job enqueue; then --upload-workers
+               `python -m app.worker` processes drain the jobs, timed until
+               every job is done or dead (worker start-up included)
+    ingest     POST /documents/upload with INGESTION_MODE=inline: parse,
+               chunk, embed and store each PDF; builds the corpus used by
+               the next two
+    retrieval  query embedding + pgvector search (app.rag.retrieve_chunks)
+               in-process, as there is no retrieval-only endpoint
+    chat       POST /chat: embedding, retrieval, LLM and history writes
+
+Results (latency percentiles, throughput, errors by status, upstream calls
+and the server's per-stage times from /metrics) are written as JSON to
+--output, tagged with the git commit. Pass a previous result file as
+--baseline to print the relative change of every number.
+
+Usage:
+    python -m benchmarks.end_to_end --output results.json
+    python -m benchmarks.end_to_end --scenarios retrieval,chat --baseline results.json
+"""
+import argparse
+import asyncio
+import http.client
+import json
+import os
+import random
+import subprocess
+import threading
+import time
+import uuid
+from collections import Counter
+from datetime import datetime, timezone
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from benchmarks import fake_openai
+from benchmarks.auth_cache import start_api
+from benchmarks.embedding_batching import percentile
+from benchmarks.ingest_workers import run_workers, start_moto
+from benchmarks.pdfs import WORDS, make_pdfs
+
+SCENARIOS = ("upload", "ingest", "retrieval", "chat")
+
+QUESTIONS = [
+    f"What does the report say about {a} and {b}?"
+    for a in WORDS[:8] for b in WORDS[8:16]
+]
+
+
+# =============================================================================
+# HTTP helpers
+# =============================================================================
+
+def _call(conn: http.client.HTTPConnection, method: str, path: str, body: bytes = None,
+          headers: Optional[dict] = None) -> Tuple[int, bytes]:
+    conn.request(method, path, body, headers or {})
+    response = conn.getresponse()
+    return response.status, response.read()
+
+
+def register(port: int) -> Tuple[str, int]:
+    """Register a throwaway user; returns (token, user id)."""
+    from app.security import decode_token
+
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    body = json.dumps({"email": f"bench-{uuid.uuid4().hex[:8]}@example.com", "password": "bench-password"})
+    status, data = _call(conn, "POST", "/auth/register", body.encode(), {"Content-Type": "application/json"})
+    if status != 200:
+        raise RuntimeError(f"Registration failed: {status} {data[:200]!r}")
+    token = json.loads(data)["access_token"]
+    return token, decode_token(token)["sub"]
+
+
+def _multipart(filename: str, content: bytes) -> Tuple[bytes, str]:
+    boundary = uuid.uuid4().hex
+    body = (
+        f"--{boundary}\r\n"
+        f'Content-Disposition: form-data; name="file"; filename="{filename}"\r\n'
+        "Content-Type: application/pdf\r\n\r\n"
+    ).encode() + content + f"\r\n--{boundary}--\r\n".encode()
+    return body, f"multipart/form-data; boundary={boundary}"
+
+
+def stage_times(port: int) -> Dict[str, dict]:
+    """Per-stage call counts and mean times from the API's /metrics."""
+    conn = http.client.HTTPConnection("127.0.0.1", port)
+    status, data = _call(conn, "GET", "/metrics")
+    return parse_stage_times(data.decode()) if status == 200 else {}
+
+
+def parse_stage_times(exposition: str) -> Dict[str, dict]:
+    """Per-stage call counts and mean times from rag_stage_seconds in Prometheus text."""
+    sums: Dict[str, float] = {}
+    counts: Dict[str, float] = {}
+    for line in exposition.splitlines():
+        for suffix, target in (("_sum", sums), ("_count", counts)):
+            prefix = f"rag_stage_seconds{suffix}{{stage=\""
+            if line.startswith(prefix):
+                name, _, value = line[len(prefix):].partition("\"} ")
+                target[name] = float(value)
+    return {
+        name: {"calls": int(counts[name]), "avg_ms": round(sums[name] / counts[name] * 1000, 2)}
+        for name in sorted(counts) if counts[name]
+    }
+
+
+def run_clients(port: int, clients: int, items: Iterable, send: Callable) -> dict:
+    """
+    Send every item from `clients` keep-alive connections, closed loop.
+
+    `send(conn, item)` makes one request and returns its HTTP status.
+    """
+    work = iter(items)
+    lock = threading.Lock()
+    latencies: List[float] = []
+    statuses: Counter = Counter()
+
+    def client():
+        conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+        while True:
+            with lock:
+                item = next(work, None)
+            if item is None:
+                return
+            started = time.perf_counter()
+            try:
+                status = send(conn, item)
+            except (OSError, http.client.HTTPException) as e:
+                status = type(e).__name__
+                conn.close()
+                conn = http.client.HTTPConnection("127.0.0.1", port, timeout=300)
+            elapsed = (time.perf_counter() - started) * 1000
+            with lock:
+                statuses[str(status)] += 1
+                if status == 200:
+                    latencies.append(elapsed)
+
+    started = time.perf_counter()
+    threads = [threading.Thread(target=client) for _ in range(clients)]
+    for t in threads:
+        t.start()
+    for t in threads:
+        t.join()
+    return summarize(latencies, statuses, time.perf_counter() - started)
+
+
+def summarize(latencies: List[float], statuses: Counter, seconds: float) -> dict:
+    ok = len(latencies)
+    return {
+        "requests": sum(statuses.values()),
+        "ok": ok,
+        "errors": {status: n for status, n in statuses.items() if status != "200"},
+        "seconds": round(seconds, 2),
+        "throughput_per_s": round(ok / seconds, 2) if seconds else None,
+        "p50_ms": round(percentile(latencies, 50), 2) if latencies else None,
+        "p90_ms": round(percentile(latencies, 90), 2) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 2) if latencies else None,
+        "max_ms": round(max(latencies), 2) if latencies else None
+    }
+
+
+# =============================================================================
+# Scenarios
+# =============================================================================
+
+def upload_pdfs(port: int, token: str, pdfs: List[bytes], clients: int) -> dict:
+    def send(conn, item):
+        i, pdf = item
+        body, content_type = _multipart(f"bench_{i}.pdf", pdf)
+        status, _ = _call(conn, "POST", "/documents/upload", body, {
+            "Authorization": f"Bearer {token}", "Content-Type": content_type
+        })
+        return status
+
+    return run_clients(port, clients, enumerate(pdfs), send)
+
+
+def chat(port: int, token: str, requests: int, clients: int, seed: int) -> dict:
+    rng = random.Random(seed)
+    questions = [rng.choice(QUESTIONS) for _ in range(requests)]
+
+    def send(conn, question):
+        status, _ = _call(conn, "POST", "/chat", json.dumps({"message": question}).encode(), {
+            "Authorization": f"Bearer {token}", "Content-Type": "application/json"
+        })
+        return status
+
+    return run_clients(port, clients, questions, send)
+
+
+def retrieval(user_id: int, requests: int, clients: int, seed: int) -> dict:
+    """Embed and search `requests` questions in-process, `clients` at a time."""
+    from app import metrics
+    from app.db import async_engine, batch_engine, get_async_db_context
+    from app.rag import retrieve_chunks
+
+    rng = random.Random(seed)
+    questions = [rng.choice(QUESTIONS) for _ in range(requests)]
+
+    async def run() -> dict:
+        latencies: List[float] = []
+        statuses: Counter = Counter()
+        semaphore = asyncio.Semaphore(clients)
+
+        async def one(question: str):
+            async with semaphore:
+                started = time.perf_counter()
+                try:
+                    async with get_async_db_context() as db:
+                        hits = await retrieve_chunks(db, user_id, query=question, with_content=False)
+                except Exception as e:
+                    statuses[type(e).__name__] += 1
+                    return
+                latencies.append((time.perf_counter() - started) * 1000)
+                statuses["200" if hits else "no_hits"] += 1
+
+        started = time.perf_counter()
+        await asyncio.gather(*(one(q) for q in questions))
+        elapsed = time.perf_counter() - started
+        await async_engine.dispose()
+        await batch_engine.dispose()
+        return summarize(latencies, statuses, elapsed)
+
+    result = asyncio.run(run())
+    result["stages"] = parse_stage_times(metrics.render())
+    return result
+
+
+def corpus_size(user_id: int) -> dict:
+    from sqlalchemy import func, select
+
+    from app.db import get_db_context
+    from app.models import Chunk, Document
+
+    with get_db_context() as db:
+        return {
+            "documents": db.scalar(select(func.count()).select_from(Document).where(Document.user_id == user_id)),
+            "chunks": db.scalar(select(func.count()).select_from(Chunk).where(Chunk.user_id == user_id))
+        }
+
+
+# =============================================================================
+# Results
+# =============================================================================
+
+def git_commit() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def compare(baseline, current, path: str = "") -> List[str]:
+    """Relative change of every number present in both result trees."""
+    lines = []
+    if isinstance(baseline, dict) and isinstance(current, dict):
+        for key in current:
+            if key in baseline and key != "meta":
+                lines.extend(compare(baseline[key], current[key], f"{path}.{key}" if path else key))
+    elif isinstance(baseline, (int, float)) and isinstance(current, (int, float)) \
+            and not isinstance(current, bool) and baseline:
+        change = (current - baseline) / baseline * 100
+        lines.append(f"{path}: {baseline} -> {current} ({change:+.1f}%)")
+    return lines
+
+
+def main():
+    parser = argparse.ArgumentParser(description="End-to-end API benchmark with local OpenAI and S3 stand-ins")
+    parser.add_argument("--scenarios", default=",".join(SCENARIOS), help="Comma-separated, from: " + ", ".join(SCENARIOS))
+    parser.add_argument("--clients", type=int, default=8, help="Concurrent clients per scenario")
+    parser.add_argument("--documents", type=int, default=50, help="PDFs uploaded by upload and ingest")
+    parser.add_argument("--words", type=int, default=2000, help="Words per PDF")
+    parser.add_argument("--requests", type=int, default=200, help="Queries for retrieval and chat")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--embedding-base-ms", type=float, default=50)
+    parser.add_argument("--embedding-per-item-ms", type=float, default=0.2)
+    parser.add_argument("--chat-first-token-ms", type=float, default=300)
+    parser.add_argument("--chat-per-token-ms", type=float, default=10)
+    parser.add_argument("--chat-tokens", type=int, default=50)
+    parser.add_argument("--upload-workers", type=int, default=2, help="Worker processes draining the upload jobs")
+    parser.add_argument("--worker-concurrency", type=int, default=2, help="Jobs per worker process")
+    parser.add_argument("--worker-timeout", type=float, default=600, help="Seconds to wait for the upload jobs")
+    parser.add_argument("--real-s3", action="store_true", help="Use the AWS_* S3 settings instead of a local moto server")
+    parser.add_argument("--moto-port", type=int, default=8790)
+    parser.add_argument("--openai-port", type=int, default=8769)
+    parser.add_argument("--port", type=int, default=8782, help="API port")
+    parser.add_argument("--output", default="benchmark_results.json")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    args = parser.parse_args()
+
+    scenarios = [s.strip() for s in args.scenarios.split(",") if s.strip()]
+    unknown = set(scenarios) - set(SCENARIOS)
+    if unknown:
+        parser.error(f"Unknown scenarios: {', '.join(sorted(unknown))}")
+
+    latency = {
+        "embedding_base_ms": args.embedding_base_ms,
+        "embedding_per_item_ms": args.embedding_per_item_ms,
+        "chat_first_token_ms": args.chat_first_token_ms,
+        "chat_per_token_ms": args.chat_per_token_ms,
+        "chat_tokens": args.chat_tokens
+    }
+    moto = None if args.real_s3 else start_moto(args.moto_port)
+    server = fake_openai.FakeOpenAIServer(args.openai_port, **latency)
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    # Per-tenant limits would otherwise throttle the single benchmark user
+    os.environ.update({
+        "TENANT_RPM": "0", "TENANT_TPM": "0", "TENANT_MAX_CONCURRENCY": str(max(args.clients, 1))
+    })
+
+    from sqlalchemy import delete
+
+    from app.config import settings
+    from app.db import get_db_context, init_db
+    from app.models import User
+    from app.s3_utils import get_s3_client
+
+    init_db()
+    if moto:
+        get_s3_client().create_bucket(Bucket=settings.AWS_S3_BUCKET)
+
+    pdfs = make_pdfs(args.documents, args.words, seed=args.seed)
+    results: Dict[str, dict] = {}
+    user_id = None
+    try:
+        # One user for every scenario, so retrieval and chat search the ingested corpus
+        proc = start_api(args.port, {})
+        try:
+            token, user_id = register(args.port)
+        finally:
+            proc.terminate()
+            proc.wait()
+
+        for scenario in SCENARIOS:
+            needs_corpus = scenario == "ingest" and {"retrieval", "chat"} & set(scenarios)
+            if scenario not in scenarios and not needs_corpus:
+                continue
+            server.reset()
+            print(f"Running {scenario}...")
+
+            if scenario == "retrieval":
+                result = retrieval(user_id, args.requests, args.clients, args.seed)
+            else:
+                mode = "queue" if scenario == "upload" else "inline"
+                proc = start_api(args.port, {"INGESTION_MODE": mode})
+                try:
+                    if scenario == "chat":
+                        result = chat(args.port, token, args.requests, args.clients, args.seed)
+                    else:
+                        result = upload_pdfs(args.port, token, pdfs, args.clients)
+                        if scenario == "ingest":
+                            result["documents_per_minute"] = round(result["throughput_per_s"] * 60, 1)
+                    result["stages"] = stage_times(args.port)
+                finally:
+                    proc.terminate()
+                    proc.wait()
+                if scenario == "upload":
+                    result["workers"] = run_workers(
+                        args.upload_workers, args.worker_concurrency, user_id, result["ok"], args.worker_timeout
+                    )
+                    total = result["seconds"] + result["workers"]["seconds"]
+                    result["upload_to_done_seconds"] = round(total, 2)
+                    result["documents_per_minute"] = round(result["workers"]["done"] / total * 60, 1) if total else None
+                if scenario == "ingest":
+                    result["corpus"] = corpus_size(user_id)
+
+            result["upstream"] = server.stats()
+            if scenario in scenarios:
+                results[scenario] = result
+    finally:
+        if user_id is not None:
+            with get_db_context() as db:
+                db.execute(delete(User).where(User.id == user_id))
+        server.stop()
+        if moto:
+            moto.stop()
+
+    report = {
+        "meta": {
+            "commit": git_commit(),
+            "finished_at": datetime.now(timezone.utc).isoformat(),
+            "clients": args.clients,
+            "documents": args.documents,
+            "words_per_document": args.words,
+            "requests": args.requests,
+            "upload_workers": args.upload_workers,
+            "worker_concurrency": args.worker_concurrency,
+            "s3": "real" if args.real_s3 else "moto",
+            "seed": args.seed,
+            "fake_openai": latency
+        },
+        **results
+    }
+    with open(args.output, "w", encoding="utf-8") as f:
+        json.dump(report, f, indent=2)
+    print(json.dumps(report, indent=2))
+    print(f"Results written to {args.output}")
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as f:
+            baseline = json.load(f)
+        print(f"\nChange vs {args.baseline} (commit {baseline.get('meta', {}).get('commit')}):")
+        for line in compare(baseline, report):
+            print(f"  {line}")
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,282 @@
+"""
+Fake OpenAI server - deterministic embeddings and completions with
+configurable latency and rate limits.
+
+Implements just enough of the OpenAI HTTP API for offline benchmarks.
+Point the app at it with OPENAI_BASE_URL=http://127.0.0.1:<port>/v1.
+Runs in its own process so it does not compete with the code under test
+for the GIL; counters and latency are read/set over HTTP.
+"""
+import array
+import asyncio
+import base64
+import hashlib
+import json
+import os
+import random
+import subprocess
+import sys
+import time
+import urllib.error
+import urllib.request
+from functools import lru_cache
+from typing import List, Optional
+
+from fastapi import FastAPI, Request
+from fastapi.responses import JSONResponse, StreamingResponse
+
+EMBEDDING_DIM = 1536
+
+app = FastAPI(title="Fake OpenAI")
+
+# Simulated upstream behaviour, adjustable at runtime via POST /_config.
+# rpm/tpm of 0 mean unlimited; error_rate_429 injects random 429s.
+latency = {
+    "embedding_base_ms": float(os.getenv("FAKE_EMBEDDING_BASE_MS", "50")),
+    "embedding_per_item_ms": float(os.getenv("FAKE_EMBEDDING_PER_ITEM_MS", "0.2")),
+    "chat_first_token_ms": float(os.getenv("FAKE_CHAT_FIRST_TOKEN_MS", "300")),
+    "chat_per_token_ms": float(os.getenv("FAKE_CHAT_PER_TOKEN_MS", "10")),
+    "chat_tokens": float(os.getenv("FAKE_CHAT_TOKENS", "50")),
+    "rpm": float(os.getenv("FAKE_RPM", "0")),
+    "tpm": float(os.getenv("FAKE_TPM", "0")),
+    "error_rate_429": float(os.getenv("FAKE_ERROR_RATE_429", "0"))
+}
+
+# Upstream call counters, read by the benchmarks via GET /_stats
+stats = {
+    "embedding_calls": 0,
+    "embedding_inputs": 0,
+    "chat_calls": 0,
+    "chat_in_flight": 0,
+    "chat_max_in_flight": 0,  # peak concurrent chat completions since the last reset
+    "rate_limited": 0
+}
+
+# Server-side per-minute budgets, mirroring OpenAI's x-ratelimit-* semantics
+_budget = {"requests": 0.0, "tokens": 0.0, "updated": time.monotonic(), "primed": False}
+
+
+def _admit(tokens: int):
+    """Charge the request to the fake quota; returns (headers, retry_after_ms or None)."""
+    now = time.monotonic()
+    rpm, tpm = latency["rpm"], latency["tpm"]
+    if not _budget["primed"]:
+        _budget.update(requests=rpm, tokens=tpm, primed=True)
+    elapsed = now - _budget["updated"]
+    _budget["updated"] = now
+    _budget["requests"] = min(rpm, _budget["requests"] + elapsed * rpm / 60)
+    _budget["tokens"] = min(tpm, _budget["tokens"] + elapsed * tpm / 60)
+
+    retry_ms = None
+    if rpm and _budget["requests"] < 1:
+        retry_ms = (1 - _budget["requests"]) * 60000 / rpm
+    elif tpm and _budget["tokens"] < tokens:
+        retry_ms = (tokens - _budget["tokens"]) * 60000 / tpm
+    elif random.random() < latency["error_rate_429"]:
+        retry_ms = 100.0
+    else:
+        _budget["requests"] -= 1
+        _budget["tokens"] -= tokens
+
+    headers = {}
+    if rpm:
+        headers["x-ratelimit-limit-requests"] = str(int(rpm))
+        headers["x-ratelimit-remaining-requests"] = str(max(0, int(_budget["requests"])))
+        headers["x-ratelimit-reset-requests"] = f"{(rpm - _budget['requests']) * 60 / rpm:.3f}s"
+    if tpm:
+        headers["x-ratelimit-limit-tokens"] = str(int(tpm))
+        headers["x-ratelimit-remaining-tokens"] = str(max(0, int(_budget["tokens"])))
+        headers["x-ratelimit-reset-tokens"] = f"{(tpm - _budget['tokens']) * 60 / tpm:.3f}s"
+    if retry_ms is not None:
+        stats["rate_limited"] += 1
+        headers["retry-after-ms"] = str(int(retry_ms))
+    return headers, retry_ms
+
+
+def _rate_limited(headers: dict) -> JSONResponse:
+    return JSONResponse(
+        status_code=429,
+        headers=headers,
+        content={"error": {"message": "Rate limit reached", "type": "requests", "code": "rate_limit_exceeded"}}
+    )
+
+
+@lru_cache(maxsize=4096)
+def fake_embedding(text: str) -> List[float]:
+    """Deterministic pseudo-random unit vector derived from the text."""
+    seed = int.from_bytes(hashlib.sha256(text.encode()).digest()[:8], "big")
+    rng = random.Random(seed)
+    vec = [rng.random() - 0.5 for _ in range(EMBEDDING_DIM)]
+    norm = sum(v * v for v in vec) ** 0.5
+    return [v / norm for v in vec]
+
+
+@lru_cache(maxsize=4096)
+def fake_embedding_base64(text: str) -> str:
+    """The same vector as packed little-endian float32, as the real API returns it."""
+    return base64.b64encode(array.array("f", fake_embedding(text)).tobytes()).decode()
+
+
+@app.post("/v1/embeddings")
+async def embeddings(request: Request):
+    body = await request.json()
+    inputs = body["input"]
+    if isinstance(inputs, str):
+        inputs = [inputs]
+
+    tokens = sum(len(t.split()) for t in inputs)
+    headers, retry_ms = _admit(tokens)
+    if retry_ms is not None:
+        return _rate_limited(headers)
+
+    stats["embedding_calls"] += 1
+    stats["embedding_inputs"] += len(inputs)
+    await asyncio.sleep(
+        (latency["embedding_base_ms"] + latency["embedding_per_item_ms"] * len(inputs)) / 1000
+    )
+
+    encode = fake_embedding_base64 if body.get("encoding_format") == "base64" else fake_embedding
+    return JSONResponse(headers=headers, content={
+        "object": "list",
+        "data": [
+            {"object": "embedding", "index": i, "embedding": encode(t)}
+            for i, t in enumerate(inputs)
+        ],
+        "model": body.get("model", "fake-embedding"),
+        "usage": {"prompt_tokens": tokens, "total_tokens": tokens}
+    })
+
+
+def _chat_started() -> None:
+    stats["chat_in_flight"] += 1
+    stats["chat_max_in_flight"] = max(stats["chat_max_in_flight"], stats["chat_in_flight"])
+
+
+@app.post("/v1/chat/completions")
+async def chat_completions(request: Request):
+    body = await request.json()
+    prompt = " ".join(m.get("content") or "" for m in body["messages"])
+    prompt_tokens = len(prompt.split())
+    completion_tokens = min(int(latency["chat_tokens"]), body.get("max_tokens") or 1024)
+    headers, retry_ms = _admit(prompt_tokens + completion_tokens)
+    if retry_ms is not None:
+        return _rate_limited(headers)
+
+    stats["chat_calls"] += 1
+    _chat_started()
+    words = [f"token{i}" for i in range(completion_tokens)]
+    usage = {
+        "prompt_tokens": prompt_tokens,
+        "completion_tokens": completion_tokens,
+        "total_tokens": prompt_tokens + completion_tokens
+    }
+    base = {"id": "chatcmpl-fake", "created": int(time.time()), "model": body.get("model", "fake-chat")}
+
+    if not body.get("stream"):
+        try:
+            await asyncio.sleep(
+                (latency["chat_first_token_ms"] + latency["chat_per_token_ms"] * completion_tokens) / 1000
+            )
+        finally:
+            stats["chat_in_flight"] -= 1
+        return JSONResponse(headers=headers, content={
+            **base,
+            "object": "chat.completion",
+            "choices": [{
+                "index": 0,
+                "message": {"role": "assistant", "content": " ".join(words)},
+                "finish_reason": "stop"
+            }],
+            "usage": usage
+        })
+
+    async def stream():
+        try:
+            await asyncio.sleep(latency["chat_first_token_ms"] / 1000)
+            for i, word in enumerate(words):
+                delta = {"content": word if i == 0 else " " + word}
+                chunk = {**base, "object": "chat.completion.chunk",
+                         "choices": [{"index": 0, "delta": delta, "finish_reason": None}]}
+                yield f"data: {json.dumps(chunk)}\n\n"
+                await asyncio.sleep(latency["chat_per_token_ms"] / 1000)
+        finally:
+            stats["chat_in_flight"] -= 1
+        final = {**base, "object": "chat.completion.chunk",
+                 "choices": [{"index": 0, "delta": {}, "finish_reason": "stop"}]}
+        yield f"data: {json.dumps(final)}\n\n"
+        if (body.get("stream_options") or {}).get("include_usage"):
+            usage_chunk = {**base, "object": "chat.completion.chunk", "choices": [], "usage": usage}
+            yield f"data: {json.dumps(usage_chunk)}\n\n"
+        yield "data: [DONE]\n\n"
+
+    return StreamingResponse(stream(), media_type="text/event-stream", headers=headers)
+
+
+@app.get("/_stats")
+async def get_stats():
+    return stats
+
+
+@app.post("/_reset")
+async def reset_stats():
+    for key in stats:
+        if key != "chat_in_flight":  # a gauge: calls still running keep counting
+            stats[key] = 0
+    _budget["primed"] = False
+    return stats
+
+
+@app.post("/_config")
+async def configure(request: Request):
+    latency.update(await request.json())
+    return latency
+
+
+class FakeOpenAIServer:
+    """Handle for a fake server subprocess."""
+
+    def __init__(self, port: int = 8765, **latency_overrides: float):
+        self.port = port
+        self.base_url = f"http://127.0.0.1:{port}"
+        env = dict(os.environ)
+        for key, value in latency_overrides.items():
+            env[f"FAKE_{key.upper()}"] = str(value)
+        self.process = subprocess.Popen(
+            [sys.executable, "-m", "uvicorn", "benchmarks.fake_openai:app",
+             "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning"],
+            env=env
+        )
+        self._wait_ready()
+
+    def _call(self, path: str, body: Optional[dict] = None) -> dict:
+        request = urllib.request.Request(
+            f"{self.base_url}{path}",
+            data=json.dumps(body).encode() if body is not None else None,
+            headers={"Content-Type": "application/json"}
+        )
+        with urllib.request.urlopen(request, timeout=5) as response:
+            return json.loads(response.read())
+
+    def _wait_ready(self, timeout: float = 15.0) -> None:
+        deadline = time.monotonic() + timeout
+        while time.monotonic() < deadline:
+            try:
+                self._call("/_stats")
+                return
+            except (urllib.error.URLError, ConnectionError):
+                time.sleep(0.1)
+        self.stop()
+        raise RuntimeError("Fake OpenAI server did not start")
+
+    def stats(self) -> dict:
+        return self._call("/_stats")
+
+    def reset(self) -> None:
+        self._call("/_reset", {})
+
+    def configure(self, **values: float) -> None:
+        self._call("/_config", values)
+
+    def stop(self) -> None:
+        self.process.terminate()
+        self.process.wait(timeout=10)
@@ -0,0 +1,378 @@
+"""
+Retrieval quality vs latency benchmark for vector index configurations.
+
+Loads a synthetic corpus into `chunks` for many simulated tenants
+(benchmarks/synthetic_corpus.py, clustered embeddings), computes the exact
+top-k neighbours of every query with NumPy, then, for each index
+configuration, builds `ix_chunks_embedding` and runs the queries through
+the production `RETRIEVAL_SQL` (app/rag.py), per-tenant filter included,
+with `ivfflat.probes` / `hnsw.ef_search` set per transaction exactly as
+app/vector_index.py does. For every (index, search setting) it reports:
+
+    recall@k     mean fraction of the exact top-k returned, overall and for
+                 the smaller / larger half of the tenants (ivfflat filters
+                 the tenant after the index scan, so small tenants suffer)
+    short        queries that returned fewer than k rows
+    qps          queries per second at --concurrency
+    p50/p95 ms   latency per query, transaction included
+    build_s      index build time, and the index size
+
+Every index also gets an `auto` row: the probes / ef_search the app itself
+would choose for VECTOR_SEARCH_RECALL_TARGET.
+
+The embedding column is `vector(1536)` in the schema and RETRIEVAL_SQL
+orders by `embedding <=> :embedding`, so the dimension is fixed and
+quantized (halfvec / bit expression) indexes are not swept: the real query
+would never use them. Change the schema and the query first, then add the
+configuration here.
+
+DATABASE_URL must point at a scratch Postgres + pgvector database: the
+harness refuses to run on a non-empty `chunks` table, drops and rebuilds
+ix_chunks_embedding, and removes its tenants at the end (unless --keep).
+Needs numpy.
+
+Config syntax (--configs, `;`-separated; comma lists are swept):
+    exact
+    ivfflat lists=500 probes=1,5,10,20
+    hnsw m=16 ef_construction=64 ef_search=20,40,100
+
+Usage:
+    python -m benchmarks.index_recall --tenants 200 --chunks 100000
+    python -m benchmarks.index_recall --configs "hnsw m=16 ef_construction=64 ef_search=40,100" --output hnsw.json
+"""
+import argparse
+import asyncio
+import json
+import math
+import os
+import time
+import uuid
+from datetime import datetime, timezone
+from typing import Dict, List, Optional, Tuple
+
+from benchmarks import synthetic_corpus
+from benchmarks.embedding_batching import percentile
+from benchmarks.end_to_end import git_commit
+from benchmarks.synthetic_corpus import CorpusSpec
+
+SEARCH_PARAMS = {"ivfflat": "ivfflat.probes", "hnsw": "hnsw.ef_search"}
+
+
+# =============================================================================
+# Corpus
+# =============================================================================
+
+def load_corpus(spec: CorpusSpec, workers: int) -> dict:
+    """Generate and COPY the corpus, leaving the vector index to the sweep."""
+    return synthetic_corpus.generate(spec, workers=workers, index="drop")
+
+
+def ground_truth(spec: CorpusSpec, manifest: dict, query_tenants: List[int],
+                 queries: "np.ndarray", k: int) -> List[List[int]]:
+    """
+    Exact top-k chunk ids per query by cosine distance (vectors are unit length).
+
+    Each queried tenant's vectors are regenerated from the spec; its chunk
+    ids run consecutively from first_chunk_id in the same order.
+    """
+    import numpy as np
+
+    truth: List[Optional[List[int]]] = [None] * len(query_tenants)
+    by_tenant: Dict[int, List[int]] = {}
+    for i, tenant in enumerate(query_tenants):
+        by_tenant.setdefault(tenant, []).append(i)
+    for tenant, indexes in by_tenant.items():
+        entry = manifest["tenants"][tenant]
+        plan = synthetic_corpus.plan_tenant(spec, tenant, entry["chunks"])
+        vectors = synthetic_corpus.tenant_vectors(spec, tenant, plan)
+        for i in indexes:
+            similarity = vectors @ queries[i]
+            top = min(k, len(similarity))
+            best = np.argpartition(-similarity, top - 1)[:top]
+            best = best[np.argsort(-similarity[best])]
+            truth[i] = [entry["first_chunk_id"] + int(j) for j in best]
+    return truth
+
+
+# =============================================================================
+# Index configurations
+# =============================================================================
+
+def parse_configs(spec: str) -> List[dict]:
+    """Parse `;`-separated configurations: a method, then key=value[,value...]."""
+    configs = []
+    for part in spec.split(";"):
+        words = part.split()
+        if not words:
+            continue
+        method, options = words[0], {}
+        if method not in ("exact", "ivfflat", "hnsw"):
+            raise ValueError(f"Unknown index method {method!r}")
+        for word in words[1:]:
+            key, _, values = word.partition("=")
+            options[key] = [int(v) for v in values.split(",")]
+        config = {"method": method, "build": {}, "search": []}
+        search_key = SEARCH_PARAMS.get(method, "").split(".")[-1]
+        for key, values in options.items():
+            if key == search_key:
+                config["search"] = values
+            elif len(values) == 1:
+                config["build"][key] = values[0]
+            else:
+                raise ValueError(f"Only {search_key} can take several values: {part.strip()!r}")
+        configs.append(config)
+    return configs
+
+
+def default_configs(rows: int, k: int) -> List[dict]:
+    """Exact scan, ivfflat at the app's lists and twice that, HNSW at two sizes."""
+    from app.vector_index import choose_lists
+
+    configs = [{"method": "exact", "build": {}, "search": []}]
+    for lists in (choose_lists(rows), choose_lists(rows) * 2):
+        root = math.sqrt(lists)
+        probes = sorted({1, max(1, int(root / 2)), max(1, int(root)), min(lists, int(root * 2)), min(lists, int(root * 4))})
+        configs.append({"method": "ivfflat", "build": {"lists": lists}, "search": probes})
+    for m, ef_construction in ((16, 64), (32, 128)):
+        configs.append({
+            "method": "hnsw",
+            "build": {"m": m, "ef_construction": ef_construction},
+            "search": sorted({k, 20, 40, 100, 200})
+        })
+    return configs
+
+
+def build_index(config: dict, maintenance_work_mem: Optional[str]) -> dict:
+    """Drop ix_chunks_embedding and build it as `config` says; returns build time and size."""
+    from sqlalchemy import text
+
+    from app.db import engine, get_db_context
+    from app.vector_index import MANAGED_INDEXES, _index_info
+
+    index = MANAGED_INDEXES[0]
+    with engine.connect().execution_options(isolation_level="AUTOCOMMIT") as conn:
+        conn.execute(text(f"DROP INDEX IF EXISTS {index.name}"))
+        if config["method"] == "exact":
+            return {"build_seconds": 0.0, "size_bytes": 0}
+        if maintenance_work_mem:
+            conn.execute(text("SELECT set_config('maintenance_work_mem', :value, false)"), {"value": maintenance_work_mem})
+        params = ", ".join(f"{key} = {value}" for key, value in config["build"].items())
+        started = time.perf_counter()
+        conn.execute(text(
+            f"CREATE INDEX {index.name} ON {index.table} "
+            f"USING {config['method']} ({index.column} {index.ops})" + (f" WITH ({params})" if params else "")
+        ))
+        build_seconds = time.perf_counter() - started
+        conn.execute(text(f"ANALYZE {index.table}"))
+    with get_db_context() as db:
+        info = _index_info(db, index.name)
+    return {"build_seconds": round(build_seconds, 3), "size_bytes": info["size_bytes"] if info else None}
+
+
+def search_variants(config: dict, k: int) -> List[Tuple[str, Dict[str, str]]]:
+    """(label, planner settings) for each search parameter swept, plus the app's own choice."""
+    from app.vector_index import choose_ef_search, choose_probes
+
+    if config["method"] == "exact":
+        return [("exact", {})]
+    name = SEARCH_PARAMS[config["method"]]
+    key = name.split(".")[-1]
+    variants = [(f"{key}={value}", {name: str(value)}) for value in config["search"]]
+    if config["method"] == "hnsw":
+        auto = choose_ef_search(k)
+    else:
+        auto = choose_probes(config["build"].get("lists", 100))
+    variants.append((f"auto ({key}={auto})", {name: str(auto)}))
+    return variants
+
+
+# =============================================================================
+# Queries
+# =============================================================================
+
+async def run_queries(queries: List[Tuple[int, str]], planner: Dict[str, str],
+                      k: int, concurrency: int) -> Tuple[List[List[int]], List[float], float]:
+    """
+    Run every (user id, embedding) query through RETRIEVAL_SQL on the request pool.
+
+    Returns:
+        (chunk ids per query, latency ms per query, elapsed seconds)
+    """
+    from sqlalchemy import text
+
+    from app.config import settings
+    from app.db import async_engine, get_async_db_context
+    from app.rag import RETRIEVAL_SQL
+
+    results: List[Optional[List[int]]] = [None] * len(queries)
+    latencies: List[float] = [0.0] * len(queries)
+    semaphore = asyncio.Semaphore(concurrency)
+
+    async def one(i: int):
+        user_id, embedding = queries[i]
+        async with semaphore:
+            started = time.perf_counter()
+            async with get_async_db_context() as db:
+                # As apply_search_settings does: this transaction only
+                for name, value in planner.items():
+                    await db.execute(text("SELECT set_config(:name, :value, true)"), {"name": name, "value": value})
+                rows = await db.execute(RETRIEVAL_SQL, {
+                    "embedding": embedding,
+                    "user_id": user_id,
+                    "k": k,
+                    "snippet_chars": settings.RETRIEVAL_SNIPPET_CHARS,
+                    "with_content": False
+                })
+                results[i] = [row.id for row in rows]
+            latencies[i] = (time.perf_counter() - started) * 1000
+
+    # Warm the pool and the index pages, then measure
+    await asyncio.gather(*(one(i) for i in range(min(len(queries), concurrency * 2))))
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(len(queries))))
+    elapsed = time.perf_counter() - started
+    # Each variant runs in its own event loop; pooled connections cannot outlive it
+    await async_engine.dispose()
+    return results, latencies, elapsed
+
+
+def score(results: List[List[int]], truth: List[List[int]], query_tenants: List[int],
+          small: set, k: int) -> dict:
+    """recall@k overall and for small / large tenants, and short result counts."""
+    recalls = {"all": [], "small_tenants": [], "large_tenants": []}
+    short = 0
+    for found, expected, tenant in zip(results, truth, query_tenants):
+        recall = len(set(found) & set(expected)) / len(expected)
+        recalls["all"].append(recall)
+        recalls["small_tenants" if tenant in small else "large_tenants"].append(recall)
+        if len(found) < len(expected):
+            short += 1
+    return {
+        f"recall@{k}": round(sum(recalls["all"]) / len(recalls["all"]), 4),
+        **{
+            f"recall@{k}_{group}": round(sum(values) / len(values), 4) if values else None
+            for group, values in recalls.items() if group != "all"
+        },
+        "short_results": short
+    }
+
+
+# =============================================================================
+# Main
+# =============================================================================
+
+def print_table(rows: List[dict], k: int) -> None:
+    print(f"\n{'index':<36} {'search':<22} {'recall@' + str(k):>9} {'small':>7} {'qps':>8} "
+          f"{'p50 ms':>8} {'p95 ms':>8} {'build s':>8} {'size MB':>8}")
+    for row in rows:
+        size = row["index_size_bytes"]
+        print(
+            f"{row['index']:<36} {row['search']:<22} {row[f'recall@{k}']:>9.4f} "
+            f"{row[f'recall@{k}_small_tenants'] or 0:>7.3f} {row['qps']:>8.1f} {row['p50_ms']:>8.2f} "
+            f"{row['p95_ms']:>8.2f} {row['index_build_seconds']:>8.2f} {(size or 0) / 1e6:>8.1f}"
+        )
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Recall vs latency of vector index configurations on RETRIEVAL_SQL")
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--chunks", type=int, default=50000, help="Total chunks across all tenants")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of tenant sizes")
+    parser.add_argument("--chunks-per-document", type=int, default=20, help="Median")
+    parser.add_argument("--clusters", type=int, default=200, help="Shared topics")
+    parser.add_argument("--topics", type=int, default=5, help="Topics per tenant")
+    parser.add_argument("--spread", type=float, default=0.8, help="Noise around a topic, relative to its norm")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4, help="Corpus loader processes")
+    parser.add_argument("--queries", type=int, default=500)
+    parser.add_argument("--k", type=int, default=None, help="Default: RETRIEVAL_TOP_K")
+    parser.add_argument("--concurrency", type=int, default=8)
+    parser.add_argument("--configs", help="Index configurations (see module docstring); default: a sweep sized to --chunks")
+    parser.add_argument("--maintenance-work-mem", default="1GB", help="For index builds")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--keep", action="store_true", help="Leave the corpus and the last index in place")
+    parser.add_argument("--output", default="index_recall.json")
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from sqlalchemy import func, select
+
+    from app.config import settings
+    from app.db import get_db_context, init_db
+    from app.models import Chunk
+
+    k = args.k or settings.RETRIEVAL_TOP_K
+    configs = parse_configs(args.configs) if args.configs else default_configs(args.chunks, k)
+
+    init_db()
+    with get_db_context() as db:
+        existing = db.execute(select(func.count()).select_from(Chunk)).scalar()
+    if existing:
+        raise SystemExit(f"chunks already holds {existing} rows: run this against a scratch database")
+
+    spec = CorpusSpec(
+        tenants=args.tenants, chunks=args.chunks, skew=args.skew,
+        chunks_per_document=args.chunks_per_document, clusters=args.clusters,
+        topics=args.topics, spread=args.spread, sessions=0, seed=args.seed,
+        email_prefix=f"bench-index-{uuid.uuid4().hex[:8]}"
+    )
+    manifest = load_corpus(spec, args.workers)
+    print(f"Loaded {manifest['rows']['chunks']} chunks for {args.tenants} tenants in {manifest['load_seconds']}s")
+
+    sizes = [tenant["chunks"] for tenant in manifest["tenants"]]
+    query_tenants, query_vectors = synthetic_corpus.query_vectors(spec, sizes, args.queries, args.seed)
+    truth = ground_truth(spec, manifest, query_tenants, query_vectors, k)
+    queries = [
+        (manifest["tenants"][tenant]["user_id"], str(vector.tolist()))
+        for tenant, vector in zip(query_tenants, query_vectors)
+    ]
+
+    median = sorted(sizes)[len(sizes) // 2]
+    small = {t for t, size in enumerate(sizes) if size < median}
+
+    rows = []
+    try:
+        for config in configs:
+            label = config["method"] + "".join(f" {key}={value}" for key, value in config["build"].items())
+            print(f"Building {label}...")
+            build = build_index(config, args.maintenance_work_mem)
+            for search_label, planner in search_variants(config, k):
+                results, latencies, elapsed = asyncio.run(run_queries(queries, planner, k, args.concurrency))
+                rows.append({
+                    "index": label,
+                    "search": search_label,
+                    "planner_settings": planner,
+                    **score(results, truth, query_tenants, small, k),
+                    "qps": round(len(latencies) / elapsed, 1),
+                    "p50_ms": round(percentile(latencies, 50), 2),
+                    "p95_ms": round(percentile(latencies, 95), 2),
+                    "index_build_seconds": build["build_seconds"],
+                    "index_size_bytes": build["size_bytes"]
+                })
+    finally:
+        if not args.keep:
+            build_index({"method": "exact"}, None)
+            synthetic_corpus.remove(manifest)
+
+    print_table(rows, k)
+    report = {
+        "git_commit": git_commit(),
+        "finished_at": datetime.now(timezone.utc).isoformat(),
+        "corpus": {
+            **spec._asdict(),
+            "rows": manifest["rows"],
+            "largest_tenant": max(sizes),
+            "median_tenant": median,
+            "queries": args.queries,
+            "load_seconds": manifest["load_seconds"]
+        },
+        "k": k,
+        "concurrency": args.concurrency,
+        "results": rows
+    }
+    with open(args.output, "w") as f:
+        json.dump(report, f, indent=2)
+    print(f"\nWrote {args.output}")
+
+
+if __name__ == "__main__":
+    main()
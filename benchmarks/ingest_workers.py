@@ -0,0 +1,155 @@
+"""
+Benchmark document ingestion throughput as background workers are added.
+
+Needs DATABASE_URL pointing at a reachable Postgres with pgvector, and an
+S3 bucket: either the AWS_* settings, or --moto to start a local moto
+server (`pip install "moto[server]"`). OpenAI is the fake server.
+
+For each worker count, enqueues --documents ingestion jobs for a throwaway
+user, starts that many `python -m app.worker` processes and measures
+documents/minute until the queue drains (worker start-up included).
+
+Usage:
+    python -m benchmarks.ingest_workers --workers 1,2,4 --documents 200 --moto
+"""
+import argparse
+import json
+import os
+import signal
+import subprocess
+import sys
+import time
+import uuid
+from typing import Dict, List
+
+from benchmarks import fake_openai
+from benchmarks.pdfs import make_pdfs
+
+
+def start_moto(port: int):
+    from moto.server import ThreadedMotoServer  # optional dependency, only needed for --moto
+
+    server = ThreadedMotoServer(port=port)
+    server.start()
+    os.environ.update({
+        "AWS_ENDPOINT_URL_S3": f"http://127.0.0.1:{port}",
+        "AWS_ACCESS_KEY_ID": "testing",
+        "AWS_SECRET_ACCESS_KEY": "testing",
+        "AWS_REGION": "us-east-1",
+        "AWS_S3_BUCKET": "rag-benchmark",
+    })
+    return server
+
+
+def run_workers(count: int, concurrency: int, user_id: int, job_count: int, timeout: float) -> dict:
+    """Start `count` workers and wait until this user's jobs are finished."""
+    from sqlalchemy import func, select
+
+    from app.db import get_db_context
+    from app.models import Job
+
+    started = time.perf_counter()
+    procs = [
+        subprocess.Popen(
+            [sys.executable, "-m", "app.worker", "--concurrency", str(concurrency)],
+            stdout=subprocess.DEVNULL
+        )
+        for _ in range(count)
+    ]
+    try:
+        while time.perf_counter() - started < timeout:
+            with get_db_context() as db:
+                by_status: Dict[str, int] = dict(db.execute(
+                    select(Job.status, func.count()).where(Job.user_id == user_id).group_by(Job.status)
+                ).all())
+            if by_status.get("done", 0) + by_status.get("dead", 0) >= job_count:
+                break
+            time.sleep(0.25)
+        elapsed = time.perf_counter() - started
+    finally:
+        for proc in procs:
+            proc.send_signal(signal.SIGTERM)
+        for proc in procs:
+            proc.wait(timeout=60)
+
+    return {
+        "seconds": round(elapsed, 2),
+        "documents_per_minute": round(by_status.get("done", 0) / elapsed * 60, 1),
+        "done": by_status.get("done", 0),
+        "dead": by_status.get("dead", 0),
+        "unfinished": job_count - by_status.get("done", 0) - by_status.get("dead", 0)
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark ingestion documents/minute vs worker count")
+    parser.add_argument("--workers", default="1,2,4", help="Comma-separated worker counts")
+    parser.add_argument("--concurrency", type=int, default=2, help="Jobs per worker process")
+    parser.add_argument("--documents", type=int, default=100)
+    parser.add_argument("--words", type=int, default=3000, help="Words per PDF")
+    parser.add_argument("--timeout", type=float, default=600)
+    parser.add_argument("--moto", action="store_true", help="Start a local moto S3 server")
+    parser.add_argument("--moto-port", type=int, default=8790)
+    parser.add_argument("--port", type=int, default=8768, help="Fake OpenAI port")
+    args = parser.parse_args()
+
+    moto = start_moto(args.moto_port) if args.moto else None
+    server = fake_openai.FakeOpenAIServer(args.port)
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from sqlalchemy import delete
+
+    from app.config import settings
+    from app.db import get_db_context, init_db
+    from app.ingestion import INGEST_JOB
+    from app.models import Document, Job, User
+    from app.s3_utils import get_s3_client
+
+    init_db()
+    s3 = get_s3_client()
+    if moto:
+        s3.create_bucket(Bucket=settings.AWS_S3_BUCKET)
+
+    with get_db_context() as db:
+        user = User(email=f"bench-{uuid.uuid4().hex[:8]}@example.com", hashed_password="!")
+        db.add(user)
+        db.flush()
+        user_id = user.id
+
+    keys: List[str] = []
+    for i, pdf in enumerate(make_pdfs(args.documents, args.words)):
+        key = f"users/{user_id}/bench_{i}.pdf"
+        s3.put_object(Bucket=settings.AWS_S3_BUCKET, Key=key, Body=pdf, ContentType="application/pdf")
+        keys.append(key)
+
+    results = {}
+    try:
+        for count in (int(n) for n in args.workers.split(",")):
+            with get_db_context() as db:
+                db.execute(delete(Document).where(Document.user_id == user_id))
+                db.execute(delete(Job).where(Job.user_id == user_id))
+                docs = [Document(user_id=user_id, filename=k.rsplit("/", 1)[1], s3_key=k) for k in keys]
+                db.add_all(docs)
+                db.flush()
+                db.add_all([
+                    Job(kind=INGEST_JOB, payload={"document_id": d.id}, user_id=user_id,
+                        max_attempts=settings.JOB_MAX_ATTEMPTS)
+                    for d in docs
+                ])
+            server.reset()
+            results[f"{count}_workers"] = {
+                **run_workers(count, args.concurrency, user_id, len(keys), args.timeout),
+                "embedding_calls": server.stats()["embedding_calls"]
+            }
+    finally:
+        with get_db_context() as db:
+            db.execute(delete(User).where(User.id == user_id))
+        server.stop()
+        if moto:
+            moto.stop()
+    print(json.dumps(results, indent=2))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,110 @@
+"""
+Benchmark interactive latency while a bulk ingestion competes for the quota.
+
+Starts many document ingestions at once against a fake server with a
+request quota, and meanwhile sends query embeddings at a steady rate. The
+ingestion runs first on equal terms with chat (every sub-batch in the
+interactive lane, as before lanes existed), then through the batch lane.
+Reports interactive latency percentiles and how long ingestion took.
+
+Usage:
+    python -m benchmarks.lanes --documents 50 --chunks 64 --rpm 300
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+from benchmarks import fake_openai
+from benchmarks.embedding_batching import percentile
+
+
+async def run_scenario(ingest_document, get_embedding, documents: int, chunks: int,
+                       probes: int, probe_rate: float) -> dict:
+    """Ingest `documents` concurrently while timing `probes` interactive calls."""
+    latencies: List[float] = []
+    timeouts = 0
+
+    async def probe(i: int):
+        nonlocal timeouts
+        started = time.perf_counter()
+        try:
+            await get_embedding(f"interactive question {i}")
+        except TimeoutError:
+            timeouts += 1
+            return
+        latencies.append((time.perf_counter() - started) * 1000)
+
+    async def probe_stream():
+        tasks = []
+        for i in range(probes):
+            tasks.append(asyncio.create_task(probe(i)))
+            await asyncio.sleep(1 / probe_rate)
+        await asyncio.gather(*tasks)
+
+    started = time.perf_counter()
+    ingestion = asyncio.gather(*(
+        ingest_document([f"document {d} chunk {c}" for c in range(chunks)])
+        for d in range(documents)
+    ))
+    await probe_stream()
+    await ingestion
+    return {
+        "ingestion_s": round(time.perf_counter() - started, 2),
+        "interactive_timeouts": timeouts,
+        "interactive_p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "interactive_p95_ms": round(percentile(latencies, 95), 1) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark interactive vs batch priority lanes")
+    parser.add_argument("--documents", type=int, default=50)
+    parser.add_argument("--chunks", type=int, default=64, help="Chunks per document")
+    parser.add_argument("--sub-batch", type=int, default=8, help="EMBEDDING_DOCUMENT_BATCH_SIZE")
+    parser.add_argument("--probes", type=int, default=40, help="Interactive calls")
+    parser.add_argument("--probe-rate", type=float, default=2.0, help="Interactive calls per second")
+    parser.add_argument("--rpm", type=int, default=300, help="Request quota per minute")
+    parser.add_argument("--port", type=int, default=8767)
+    args = parser.parse_args()
+
+    server = fake_openai.FakeOpenAIServer(args.port, rpm=args.rpm)
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+    os.environ["OPENAI_RPM"] = str(args.rpm)
+    os.environ["EMBEDDING_DOCUMENT_BATCH_SIZE"] = str(args.sub_batch)
+    os.environ["SINGLE_FLIGHT_ENABLED"] = "false"
+
+    from app import rate_limit
+    from app.lanes import INTERACTIVE, lane_stats
+    from app.openai_client import _create_embeddings, get_embedding, get_embeddings_batch
+
+    async def ingest_shared(texts):
+        # Pre-lanes behaviour: ingestion calls queue alongside chat on equal terms
+        await asyncio.gather(*(
+            _create_embeddings(texts[i:i + args.sub_batch], lane=INTERACTIVE)
+            for i in range(0, len(texts), args.sub_batch)
+        ))
+
+    async def run_all() -> dict:
+        results = {}
+        for name, ingest in (("shared", ingest_shared), ("lanes", get_embeddings_batch)):
+            server.reset()
+            rate_limit._schedulers.clear()
+            results[name] = await run_scenario(
+                ingest, get_embedding, args.documents, args.chunks, args.probes, args.probe_rate
+            )
+            results[name]["upstream_429s"] = server.stats()["rate_limited"]
+        results["lanes"]["lane_stats"] = lane_stats()
+        return results
+
+    try:
+        print(json.dumps(asyncio.run(run_all()), indent=2))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
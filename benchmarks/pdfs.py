@@ -0,0 +1,69 @@
+"""
+Generate text PDFs with pypdf for ingestion benchmarks.
+
+The pages use a standard Type 1 font, so pypdf's extract_text (as used by
+app/pdf_utils.py) gets the text back.
+"""
+import random
+import textwrap
+from io import BytesIO
+from typing import List
+
+from pypdf import PdfWriter
+from pypdf.generic import DecodedStreamObject, DictionaryObject, NameObject
+
+_LINE_CHARS = 90
+_LINES_PER_PAGE = 50
+
+WORDS = (
+    "vector index query tenant document chunk embedding latency throughput "
+    "cluster region storage request response model cache worker batch queue "
+    "policy invoice contract revenue quarter report customer support release"
+).split()
+
+
+def _escape(line: str) -> str:
+    return line.replace("\\", "\\\\").replace("(", "\\(").replace(")", "\\)")
+
+
+def make_pdf(text: str) -> bytes:
+    """Lay `text` out over as many Letter pages as it needs."""
+    lines = [
+        wrapped
+        for paragraph in text.split("\n")
+        for wrapped in (textwrap.wrap(paragraph, _LINE_CHARS) or [""])
+    ]
+    font = DictionaryObject({
+        NameObject("/Type"): NameObject("/Font"),
+        NameObject("/Subtype"): NameObject("/Type1"),
+        NameObject("/BaseFont"): NameObject("/Helvetica"),
+    })
+    writer = PdfWriter()
+    for start in range(0, max(len(lines), 1), _LINES_PER_PAGE):
+        page = writer.add_blank_page(width=612, height=792)
+        page[NameObject("/Resources")] = DictionaryObject({
+            NameObject("/Font"): DictionaryObject({NameObject("/F1"): font})
+        })
+        body = "\n".join(f"({_escape(line)}) Tj T*" for line in lines[start:start + _LINES_PER_PAGE])
+        stream = DecodedStreamObject()
+        stream.set_data(f"BT /F1 10 Tf 14 TL 50 760 Td\n{body}\nET".encode("latin-1", "replace"))
+        page.replace_contents(stream)
+    out = BytesIO()
+    writer.write(out)
+    return out.getvalue()
+
+
+def random_text(words: int, rng: random.Random) -> str:
+    """Paragraphs of filler text, about `words` words long."""
+    paragraphs = []
+    while words > 0:
+        n = min(words, rng.randint(40, 120))
+        paragraphs.append(" ".join(rng.choice(WORDS) for _ in range(n)).capitalize() + ".")
+        words -= n
+    return "\n".join(paragraphs)
+
+
+def make_pdfs(count: int, words: int, seed: int = 0) -> List[bytes]:
+    """`count` distinct PDFs of about `words` words each."""
+    rng = random.Random(seed)
+    return [make_pdf(random_text(words, rng)) for _ in range(count)]
@@ -0,0 +1,89 @@
+"""
+Benchmark the OpenAI scheduler against a fake server that enforces a quota
+and injects 429s.
+
+Fires a burst of ingestion-style embedding calls larger than the quota,
+first straight through a bare client (no retries), then through the app's
+scheduler, and reports failures, retries and latency.
+
+Usage:
+    python -m benchmarks.rate_limit --requests 800 --rpm 600 --error-rate 0.05
+"""
+import argparse
+import asyncio
+import json
+import os
+import time
+from typing import List
+
+from benchmarks import fake_openai
+from benchmarks.embedding_batching import percentile
+
+
+async def burst(fn, requests: int) -> dict:
+    """Start `requests` calls at once and time each one."""
+    latencies: List[float] = []
+    failures = {}
+
+    async def one(i: int):
+        started = time.perf_counter()
+        try:
+            await fn([f"ingested chunk {i} part {j}" for j in range(8)])
+            latencies.append((time.perf_counter() - started) * 1000)
+        except Exception as e:
+            failures[type(e).__name__] = failures.get(type(e).__name__, 0) + 1
+
+    started = time.perf_counter()
+    await asyncio.gather(*(one(i) for i in range(requests)))
+    return {
+        "requests": requests,
+        "succeeded": len(latencies),
+        "failures": failures,
+        "elapsed_s": round(time.perf_counter() - started, 2),
+        "p50_ms": round(percentile(latencies, 50), 1) if latencies else None,
+        "p99_ms": round(percentile(latencies, 99), 1) if latencies else None
+    }
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Benchmark the rate-limit-aware OpenAI scheduler")
+    parser.add_argument("--requests", type=int, default=800)
+    parser.add_argument("--rpm", type=int, default=600, help="Fake server request quota per minute")
+    parser.add_argument("--error-rate", type=float, default=0.05, help="Random 429 rate")
+    parser.add_argument("--port", type=int, default=8766)
+    args = parser.parse_args()
+
+    server = fake_openai.FakeOpenAIServer(args.port, rpm=args.rpm, error_rate_429=args.error_rate)
+    os.environ["OPENAI_BASE_URL"] = f"{server.base_url}/v1"
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from openai import AsyncOpenAI
+    from app import rate_limit
+    from app.config import settings
+    from app.openai_client import _create_embeddings
+
+    bare = AsyncOpenAI(max_retries=0)
+
+    async def direct(texts):
+        await bare.embeddings.create(model=settings.OPENAI_EMBEDDING_MODEL, input=texts)
+
+    async def run_all() -> dict:
+        results = {}
+        server.reset()
+        results["direct"] = await burst(direct, args.requests)
+        results["direct"]["upstream_429s"] = server.stats()["rate_limited"]
+
+        server.reset()
+        results["scheduled"] = await burst(_create_embeddings, args.requests)
+        results["scheduled"]["upstream_429s"] = server.stats()["rate_limited"]
+        results["scheduled"]["scheduler"] = rate_limit.scheduler_stats()
+        return results
+
+    try:
+        print(json.dumps(asyncio.run(run_all()), indent=2))
+    finally:
+        server.stop()
+
+
+if __name__ == "__main__":
+    main()
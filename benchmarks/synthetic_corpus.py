@@ -0,0 +1,559 @@
+"""
+Synthetic corpus and tenant generator for scale tests.
+
+Creates users, documents, chunks, chat sessions and messages straight in
+Postgres with COPY, without calling the embeddings API or uploading PDFs:
+
+- Tenant sizes follow a Zipf law (--skew): a few tenants own most chunks
+- Documents have log-normally distributed chunk counts (median
+  --chunks-per-document); chunks are CHUNK_SIZE characters less a sentence
+  break, as app/chunking.py cuts them, except each document's last one
+- Embeddings are either `clustered` (each tenant writes about --topics of
+  --clusters shared topics, every document about one of them: centre plus
+  Gaussian noise of relative size --spread; needs numpy) or `hash` (the
+  vector the fake OpenAI server returns for the chunk text, so searching a
+  chunk's exact text finds it)
+- Chat sessions (exponential count, mean --sessions) hold question/answer
+  pairs (geometric count, mean --turns)
+
+Everything is a pure function of --seed and the tenant / document number,
+so a run can be reproduced and benchmarks/index_recall.py can regenerate a
+tenant's vectors for ground truth instead of reading them back. Ids are
+reserved up front from each table's sequence, which lets --workers processes
+COPY disjoint slices of the corpus in parallel (millions of rows per minute
+on a local database). Every user gets the --password, so the load
+generator in Client/ can log in as any of them; the documents' s3_keys
+point at objects that do not exist.
+
+With --pdfs DIR, the documents of the first --pdf-tenants tenants are also
+written as PDFs (benchmarks/pdfs.py) holding their chunks' text, for tests
+of the upload and ingestion path.
+
+The vector index is dropped before loading and rebuilt by
+app/vector_index.py afterwards (--index rebuild), as inserting into an
+ivfflat or HNSW index is much slower than building it once.
+
+Usage:
+    python -m benchmarks.synthetic_corpus --tenants 10000 --chunks 100000000 --workers 16
+    python -m benchmarks.synthetic_corpus --tenants 20 --chunks 20000 --embeddings hash --pdfs pdfs/
+"""
+import argparse
+import json
+import math
+import os
+import random
+import time
+from array import array
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from datetime import datetime, timedelta
+from functools import lru_cache
+from typing import Dict, List, NamedTuple, Optional, Tuple
+
+from benchmarks.pdfs import WORDS
+
+DIMENSIONS = 1536
+
+# Tables loaded, in foreign key order
+TABLES = ("users", "documents", "chunks", "chat_sessions", "chat_messages")
+
+
+class CorpusSpec(NamedTuple):
+    """What to generate; together with the seed it fixes every row."""
+    tenants: int
+    chunks: int
+    skew: float = 1.0
+    chunks_per_document: int = 20
+    embeddings: str = "clustered"  # clustered or hash
+    clusters: int = 1000
+    topics: int = 8
+    spread: float = 0.8
+    sessions: float = 3.0
+    turns: float = 4.0
+    days: int = 90
+    seed: int = 42
+    email_prefix: str = "synthetic"
+
+
+class TenantPlan(NamedTuple):
+    """Chunks per document and messages per chat session of one tenant."""
+    documents: array
+    sessions: array
+
+
+class Segment(NamedTuple):
+    """Consecutive documents of one tenant (and, for its first segment, its sessions) with their ids."""
+    tenant: int
+    user_id: int
+    first_document: int
+    document_sizes: Tuple[int, ...]
+    first_document_id: int
+    first_chunk_id: int
+    session_sizes: Tuple[int, ...]
+    first_session_id: int
+    first_message_id: int
+
+
+# =============================================================================
+# Plan
+# =============================================================================
+
+def tenant_sizes(spec: CorpusSpec) -> List[int]:
+    """Chunks per tenant, Zipf-distributed, in random rank order."""
+    ranks = list(range(1, spec.tenants + 1))
+    random.Random(f"{spec.seed}:sizes").shuffle(ranks)
+    weights = [1.0 / rank ** spec.skew for rank in ranks]
+    total = sum(weights)
+    return [max(1, round(w / total * spec.chunks)) for w in weights]
+
+
+def plan_tenant(spec: CorpusSpec, tenant: int, chunks: int) -> TenantPlan:
+    """Split a tenant's chunks into documents and draw its chat sessions."""
+    rng = random.Random(f"{spec.seed}:plan:{tenant}")
+    documents = array("i")
+    remaining = chunks
+    while remaining > 0:
+        size = max(1, int(rng.lognormvariate(math.log(spec.chunks_per_document), 1.0)))
+        documents.append(min(size, remaining))
+        remaining -= documents[-1]
+
+    sessions = array("i")
+    if spec.sessions > 0:
+        for _ in range(round(rng.expovariate(1 / spec.sessions))):
+            turns = 1 + int(rng.expovariate(1 / max(spec.turns - 1, 0.01)))
+            sessions.append(2 * turns)
+    return TenantPlan(documents, sessions)
+
+
+def email(spec: CorpusSpec, tenant: int) -> str:
+    return f"{spec.email_prefix}-{tenant:05d}@example.com"
+
+
+def filename(document: int) -> str:
+    return f"report-{document:05d}.pdf"
+
+
+# =============================================================================
+# Text
+# =============================================================================
+
+@lru_cache(maxsize=4)
+def text_pool(seed: int, chars: int = 1 << 20) -> str:
+    """About `chars` characters of filler sentences to cut chunk text from."""
+    rng = random.Random(f"{seed}:text")
+    sentences, size = [], 0
+    while size < chars:
+        sentence = " ".join(rng.choice(WORDS) for _ in range(rng.randint(6, 18))).capitalize() + "."
+        sentences.append(sentence)
+        size += len(sentence) + 1
+    return " ".join(sentences)
+
+
+def cut_text(pool: str, rng: random.Random, length: int) -> str:
+    """`length` characters of the pool from a random word start."""
+    start = pool.find(" ", rng.randrange(len(pool) - length - 100)) + 1
+    return pool[start:start + length].rstrip()
+
+
+def document_chunks(spec: CorpusSpec, tenant: int, document: int, count: int) -> Tuple[datetime, List[str]]:
+    """Upload time and chunk texts of a document."""
+    from app.config import settings
+
+    rng = random.Random(f"{spec.seed}:{tenant}:{document}")
+    pool = text_pool(spec.seed)
+    created_at = datetime.utcnow() - timedelta(days=rng.uniform(0, spec.days))
+    # chunk_text cuts at a sentence break in the last 20% of each window
+    lengths = [rng.randint(int(settings.CHUNK_SIZE * 0.8), settings.CHUNK_SIZE) for _ in range(count - 1)]
+    lengths.append(rng.randint(20, settings.CHUNK_SIZE))
+    return created_at, [cut_text(pool, rng, n) for n in lengths]
+
+
+def session_messages(spec: CorpusSpec, tenant: int, session: int,
+                     count: int) -> Tuple[datetime, str, List[Tuple[str, str, datetime]]]:
+    """Start time, title and (role, content, created_at) messages of a chat session."""
+    rng = random.Random(f"{spec.seed}:{tenant}:session:{session}")
+    pool = text_pool(spec.seed)
+    started = datetime.utcnow() - timedelta(days=rng.uniform(0, spec.days))
+    at = started
+    messages = []
+    for i in range(count):
+        if i % 2 == 0:
+            content = f"What does the report say about {rng.choice(WORDS)} and {rng.choice(WORDS)}?"
+        else:
+            length = min(4000, max(80, int(rng.lognormvariate(math.log(600), 0.6))))
+            content = cut_text(pool, rng, length)
+        at += timedelta(seconds=rng.uniform(2, 60))
+        messages.append(("user" if i % 2 == 0 else "assistant", content, at))
+    return started, messages[0][1][:50], messages
+
+
+# =============================================================================
+# Embeddings
+# =============================================================================
+
+@lru_cache(maxsize=4)
+def topic_centres(seed: int, clusters: int) -> "np.ndarray":
+    import numpy as np
+
+    centres = np.random.default_rng([seed, 0]).standard_normal((clusters, DIMENSIONS)).astype(np.float32)
+    return centres / np.linalg.norm(centres, axis=1, keepdims=True)
+
+
+def tenant_topics(spec: CorpusSpec, tenant: int) -> "np.ndarray":
+    import numpy as np
+
+    rng = np.random.default_rng([spec.seed, 1, tenant])
+    return rng.choice(spec.clusters, size=min(spec.topics, spec.clusters), replace=False)
+
+
+def around(spec: CorpusSpec, topics, rng) -> "np.ndarray":
+    """Unit vectors near the given topic centres."""
+    import numpy as np
+
+    centres = topic_centres(spec.seed, spec.clusters)
+    noise = rng.standard_normal((len(topics), DIMENSIONS)).astype(np.float32) * (spec.spread / math.sqrt(DIMENSIONS))
+    vectors = centres[topics] + noise
+    return vectors / np.linalg.norm(vectors, axis=1, keepdims=True)
+
+
+def document_vectors(spec: CorpusSpec, tenant: int, document: int, texts: List[str]):
+    """Embedding of each chunk of a document."""
+    if spec.embeddings == "hash":
+        from benchmarks.fake_openai import fake_embedding
+        return [fake_embedding(t) for t in texts]
+
+    import numpy as np
+
+    rng = np.random.default_rng([spec.seed, 2, tenant, document])
+    topic = rng.choice(tenant_topics(spec, tenant))
+    return around(spec, np.full(len(texts), topic), rng)
+
+
+def tenant_vectors(spec: CorpusSpec, tenant: int, plan: TenantPlan) -> "np.ndarray":
+    """All of a tenant's chunk vectors, in chunk id order."""
+    import numpy as np
+
+    vectors = []
+    for document, count in enumerate(plan.documents):
+        texts = document_chunks(spec, tenant, document, count)[1]
+        vectors.append(np.asarray(document_vectors(spec, tenant, document, texts), dtype=np.float32))
+    return np.concatenate(vectors)
+
+
+def query_vectors(spec: CorpusSpec, sizes: List[int], count: int, seed: int) -> Tuple[List[int], "np.ndarray"]:
+    """
+    Queries for a clustered corpus: a tenant picked in proportion to its
+    size, a vector near one of its topics.
+
+    Returns:
+        (tenant per query, query vectors)
+    """
+    import numpy as np
+
+    if spec.embeddings != "clustered":
+        raise ValueError("Query vectors need a clustered corpus")
+    rng = np.random.default_rng([spec.seed, 3, seed])
+    weights = np.array(sizes, dtype=np.float64) / sum(sizes)
+    tenants = rng.choice(len(sizes), size=count, p=weights)
+    topics = np.array([rng.choice(tenant_topics(spec, int(t))) for t in tenants])
+    return [int(t) for t in tenants], around(spec, topics, rng)
+
+
+# =============================================================================
+# Loading
+# =============================================================================
+
+def conninfo() -> str:
+    """DATABASE_URL for psycopg (without SQLAlchemy's driver suffix)."""
+    from sqlalchemy.engine import make_url
+
+    from app.config import settings
+
+    return make_url(settings.DATABASE_URL).set(drivername="postgresql").render_as_string(hide_password=False)
+
+
+def reserve_ids(conn, table: str, count: int) -> int:
+    """
+    Take `count` consecutive ids from a table's sequence; returns the first.
+
+    ALTER SEQUENCE locks out concurrent nextval() until commit, so the app
+    can keep inserting while the corpus loads.
+    """
+    with conn.transaction():
+        sequence = conn.execute("SELECT pg_get_serial_sequence(%s, 'id')", (table,)).fetchone()[0]
+        conn.execute(f"ALTER SEQUENCE {sequence} INCREMENT BY 1")
+        last, called = conn.execute(f"SELECT last_value, is_called FROM {sequence}").fetchone()
+        base = last if called else last - 1
+        if count:
+            conn.execute("SELECT setval(%s, %s, true)", (sequence, base + count))
+    return base + 1
+
+
+def load_segments(spec: CorpusSpec, segments: List[Segment], pdf_dir: Optional[str], pdf_tenants: int) -> Dict[str, int]:
+    """
+    COPY the rows of some segments over one connection (runs in a worker process).
+
+    Returns:
+        Rows written per table
+    """
+    import psycopg
+    from pgvector.psycopg import register_vector
+
+    rows: Counter = Counter()
+    # (segment, document number, document id, first chunk id, created_at, chunk texts)
+    documents = []
+    # (segment, session id, first message id, started, title, messages)
+    sessions = []
+    for segment in segments:
+        chunk_id = segment.first_chunk_id
+        for i, size in enumerate(segment.document_sizes):
+            document = segment.first_document + i
+            created_at, texts = document_chunks(spec, segment.tenant, document, size)
+            documents.append((segment, document, segment.first_document_id + i, chunk_id, created_at, texts))
+            chunk_id += size
+        message_id = segment.first_message_id
+        for s, count in enumerate(segment.session_sizes):
+            started, title, messages = session_messages(spec, segment.tenant, s, count)
+            sessions.append((segment, segment.first_session_id + s, message_id, started, title, messages))
+            message_id += count
+
+    with psycopg.connect(conninfo()) as conn:
+        register_vector(conn)
+        with conn.cursor() as cursor:
+            with cursor.copy("COPY documents (id, user_id, filename, s3_key, created_at) FROM STDIN") as copy:
+                for segment, document, document_id, _, created_at, _ in documents:
+                    name = filename(document)
+                    copy.write_row((document_id, segment.user_id, name,
+                                    f"users/{segment.user_id}/synthetic_{name}", created_at))
+            rows["documents"] += len(documents)
+
+            with cursor.copy(
+                "COPY chunks (id, document_id, user_id, content, embedding, created_at) FROM STDIN WITH (FORMAT BINARY)"
+            ) as copy:
+                copy.set_types(["int4", "int4", "int4", "text", "vector", "timestamp"])
+                for segment, document, document_id, chunk_id, created_at, texts in documents:
+                    vectors = document_vectors(spec, segment.tenant, document, texts)
+                    for i, (text, vector) in enumerate(zip(texts, vectors)):
+                        copy.write_row((chunk_id + i, document_id, segment.user_id, text, vector, created_at))
+                    rows["chunks"] += len(texts)
+
+            with cursor.copy("COPY chat_sessions (id, user_id, title, created_at) FROM STDIN") as copy:
+                for segment, session_id, _, started, title, _ in sessions:
+                    copy.write_row((session_id, segment.user_id, title, started))
+            rows["chat_sessions"] += len(sessions)
+
+            with cursor.copy("COPY chat_messages (id, session_id, role, content, created_at) FROM STDIN") as copy:
+                for _, session_id, message_id, _, _, messages in sessions:
+                    for i, (role, content, created_at) in enumerate(messages):
+                        copy.write_row((message_id + i, session_id, role, content, created_at))
+                    rows["chat_messages"] += len(messages)
+
+    if pdf_dir:
+        from benchmarks.pdfs import make_pdf
+
+        for segment, document, _, _, _, texts in documents:
+            if segment.tenant < pdf_tenants:
+                directory = os.path.join(pdf_dir, f"tenant-{segment.tenant:05d}")
+                os.makedirs(directory, exist_ok=True)
+                with open(os.path.join(directory, filename(document)), "wb") as f:
+                    f.write(make_pdf(" ".join(texts)))
+                rows["pdfs"] += 1
+    return dict(rows)
+
+
+def plan_segments(spec: CorpusSpec, plans: List[TenantPlan], user_ids: List[int],
+                  first_ids: Dict[str, int], batch_chunks: int) -> Tuple[List[List[Segment]], List[dict]]:
+    """
+    Cut the corpus into batches of about `batch_chunks` chunks and give every
+    row its id; ids run consecutively in tenant, then document order.
+
+    Returns:
+        (batches of segments, per-tenant summary for the manifest)
+    """
+    batches: List[List[Segment]] = [[]]
+    batch_size = 0
+    tenants = []
+    document_id, chunk_id = first_ids["documents"], first_ids["chunks"]
+    session_id, message_id = first_ids["chat_sessions"], first_ids["chat_messages"]
+    for tenant, plan in enumerate(plans):
+        tenants.append({
+            "tenant": tenant,
+            "user_id": user_ids[tenant],
+            "email": email(spec, tenant),
+            "documents": len(plan.documents),
+            "first_document_id": document_id,
+            "chunks": sum(plan.documents),
+            "first_chunk_id": chunk_id,
+            "chat_sessions": len(plan.sessions),
+            "chat_messages": sum(plan.sessions)
+        })
+        start = 0
+        sessions = tuple(plan.sessions)
+        while start < len(plan.documents):
+            end, size = start, 0
+            while end < len(plan.documents) and (end == start or batch_size + size + plan.documents[end] <= batch_chunks):
+                size += plan.documents[end]
+                end += 1
+            sizes = tuple(plan.documents[start:end])
+            batches[-1].append(Segment(
+                tenant, user_ids[tenant], start, sizes, document_id, chunk_id,
+                sessions, session_id, message_id
+            ))
+            document_id += len(sizes)
+            chunk_id += size
+            session_id += len(sessions)
+            message_id += sum(sessions)
+            sessions = ()
+            batch_size += size
+            if batch_size >= batch_chunks:
+                batches.append([])
+                batch_size = 0
+            start = end
+    return [batch for batch in batches if batch], tenants
+
+
+def generate(spec: CorpusSpec, workers: int = 4, password: str = "synthetic-password",
+             pdf_dir: Optional[str] = None, pdf_tenants: int = 0, batch_chunks: int = 50000,
+             index: str = "rebuild") -> dict:
+    """
+    Generate and load a corpus.
+
+    Args:
+        spec: What to generate
+        workers: Loader processes
+        password: Password of every generated user
+        pdf_dir: Also write the documents of the first `pdf_tenants` tenants as PDFs here
+        pdf_tenants: See pdf_dir
+        batch_chunks: Chunks per COPY batch (one connection and transaction each)
+        index: "rebuild" (drop the vector index, build it after loading),
+            "drop" (drop it and leave it for the caller) or "keep"
+
+    Returns:
+        Manifest: spec, row counts, timings and the per-tenant ids
+    """
+    import psycopg
+
+    from app import vector_index
+    from app.db import engine
+    from app.security import hash_password
+
+    started = time.perf_counter()
+    sizes = tenant_sizes(spec)
+    plans = [plan_tenant(spec, tenant, size) for tenant, size in enumerate(sizes)]
+    counts = {
+        "users": spec.tenants,
+        "documents": sum(len(plan.documents) for plan in plans),
+        "chunks": sum(sizes),
+        "chat_sessions": sum(len(plan.sessions) for plan in plans),
+        "chat_messages": sum(sum(plan.sessions) for plan in plans)
+    }
+    print(f"Planned {counts} in {time.perf_counter() - started:.1f}s")
+
+    if index in ("rebuild", "drop"):
+        for managed in vector_index.MANAGED_INDEXES:
+            vector_index.rebuild_index(managed, drop_only=True)
+
+    hashed = hash_password(password)
+    with psycopg.connect(conninfo()) as conn:
+        first_ids = {table: reserve_ids(conn, table, counts[table]) for table in TABLES}
+        user_ids = list(range(first_ids["users"], first_ids["users"] + spec.tenants))
+        now = datetime.utcnow()
+        with conn.cursor() as cursor:
+            with cursor.copy("COPY users (id, email, hashed_password, created_at) FROM STDIN") as copy:
+                for tenant, user_id in enumerate(user_ids):
+                    copy.write_row((user_id, email(spec, tenant), hashed, now))
+
+    batches, tenants = plan_segments(spec, plans, user_ids, first_ids, batch_chunks)
+    del plans
+
+    # Worker processes are forked: none may inherit a pooled connection
+    engine.dispose()
+    loaded: Counter = Counter({"users": spec.tenants})
+    load_started = time.perf_counter()
+    with ProcessPoolExecutor(max_workers=workers) as pool:
+        futures = [pool.submit(load_segments, spec, batch, pdf_dir, pdf_tenants) for batch in batches]
+        for done, future in enumerate(futures, 1):
+            loaded.update(future.result())
+            if done % max(1, len(futures) // 20) == 0 or done == len(futures):
+                elapsed = time.perf_counter() - load_started
+                print(f"  {done}/{len(futures)} batches, {loaded['chunks']} chunks, "
+                      f"{loaded['chunks'] / max(elapsed, 1e-9) * 60:,.0f} chunks/min")
+    load_seconds = time.perf_counter() - load_started
+
+    with psycopg.connect(conninfo(), autocommit=True) as conn:
+        for table in TABLES:
+            conn.execute(f"ANALYZE {table}")
+    build = vector_index.maintain() if index == "rebuild" else []
+
+    total_rows = sum(loaded[table] for table in TABLES)
+    return {
+        "spec": spec._asdict(),
+        "password": password,
+        "rows": dict(loaded),
+        "load_seconds": round(load_seconds, 1),
+        "rows_per_minute": round(total_rows / max(load_seconds, 1e-9) * 60),
+        "chunks_per_minute": round(loaded["chunks"] / max(load_seconds, 1e-9) * 60),
+        "index": build,
+        "total_seconds": round(time.perf_counter() - started, 1),
+        "tenants": tenants
+    }
+
+
+def remove(manifest: dict) -> None:
+    """Delete a generated corpus: its users, and everything else by cascade."""
+    import psycopg
+
+    user_ids = [tenant["user_id"] for tenant in manifest["tenants"]]
+    with psycopg.connect(conninfo()) as conn:
+        conn.execute("DELETE FROM users WHERE id = ANY(%s)", (user_ids,))
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Load a synthetic multi-tenant corpus into Postgres")
+    parser.add_argument("--tenants", type=int, default=100)
+    parser.add_argument("--chunks", type=int, default=100000, help="Total chunks across all tenants")
+    parser.add_argument("--skew", type=float, default=1.0, help="Zipf exponent of tenant sizes")
+    parser.add_argument("--chunks-per-document", type=int, default=20, help="Median")
+    parser.add_argument("--embeddings", choices=("clustered", "hash"), default="clustered")
+    parser.add_argument("--clusters", type=int, default=1000, help="Shared topics (clustered)")
+    parser.add_argument("--topics", type=int, default=8, help="Topics per tenant (clustered)")
+    parser.add_argument("--spread", type=float, default=0.8, help="Noise around a topic, relative to its norm")
+    parser.add_argument("--sessions", type=float, default=3.0, help="Mean chat sessions per tenant")
+    parser.add_argument("--turns", type=float, default=4.0, help="Mean question/answer pairs per session")
+    parser.add_argument("--days", type=int, default=90, help="Spread timestamps over this many past days")
+    parser.add_argument("--seed", type=int, default=42)
+    parser.add_argument("--email-prefix", default="synthetic")
+    parser.add_argument("--password", default="synthetic-password")
+    parser.add_argument("--workers", type=int, default=os.cpu_count() or 4)
+    parser.add_argument("--batch-chunks", type=int, default=50000, help="Chunks per COPY transaction")
+    parser.add_argument("--index", choices=("rebuild", "drop", "keep"), default="rebuild",
+                        help="What to do with the vector index around the load")
+    parser.add_argument("--pdfs", help="Directory to write matching PDFs to")
+    parser.add_argument("--pdf-tenants", type=int, default=1, help="Tenants whose documents get PDFs")
+    parser.add_argument("--manifest", default="corpus_manifest.json")
+    args = parser.parse_args()
+    os.environ.setdefault("OPENAI_API_KEY", "sk-fake")
+
+    from app.db import init_db
+
+    init_db()
+    spec = CorpusSpec(
+        tenants=args.tenants, chunks=args.chunks, skew=args.skew,
+        chunks_per_document=args.chunks_per_document, embeddings=args.embeddings,
+        clusters=args.clusters, topics=args.topics, spread=args.spread,
+        sessions=args.sessions, turns=args.turns, days=args.days, seed=args.seed,
+        email_prefix=args.email_prefix
+    )
+    manifest = generate(
+        spec, workers=args.workers, password=args.password, pdf_dir=args.pdfs,
+        pdf_tenants=args.pdf_tenants if args.pdfs else 0, batch_chunks=args.batch_chunks,
+        index=args.index
+    )
+    with open(args.manifest, "w") as f:
+        json.dump(manifest, f, indent=2)
+    print(json.dumps({key: value for key, value in manifest.items() if key != "tenants"}, indent=2, default=str))
+    print(f"Wrote {args.manifest}")
+
+
+if __name__ == "__main__":
+    main()